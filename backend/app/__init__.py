@@ -1,8 +1,33 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import books, members, allocations, history
+from .config import settings
+from .pagination import NEXT_CURSOR_HEADER
+from .responses import ORJSONResponse, CompressionMiddleware
+from .etags import ETAG_HEADER
+from .routers import books, members, allocations, history, metrics, stats
+from .database import init_db
+from .tasks import overdue_sweeper, history_archiver
+from .write_queue import allocation_write_queue
 
-app = FastAPI(title="Library Management System")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Upgrade the database schema and start the background jobs when the application starts, and stop them when it shuts down.
+    The allocation write queue, if enabled, commits the writes still queued before it stops.
+    """
+    await asyncio.to_thread(init_db)
+    overdue_sweeper.start()
+    history_archiver.start()
+    if(allocation_write_queue.enabled):
+        allocation_write_queue.start()
+    yield
+    await overdue_sweeper.stop()
+    await history_archiver.stop()
+    await asyncio.to_thread(allocation_write_queue.stop)
+
+app = FastAPI(title="Library Management System", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = [
     "http://localhost",
@@ -17,9 +42,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, ETAG_HEADER],
 )
 
+if(settings.compression_enabled):
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
+
 app.include_router(books.router, prefix="/books")
 app.include_router(members.router, prefix="/members")
 app.include_router(allocations.router, prefix="/allocations")
-app.include_router(history.router, prefix="/history")
\ No newline at end of file
+app.include_router(history.router, prefix="/history")
+app.include_router(stats.router, prefix="/stats")
+app.include_router(metrics.router, prefix="/metrics")
\ No newline at end of file
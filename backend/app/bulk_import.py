@@ -0,0 +1,150 @@
+from pydantic import ValidationError
+import codecs
+import csv
+import json
+import sqlite3
+from app.etags import bump_versions
+
+CSV_CONTENT_TYPES = {"text/csv"}
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+async def iter_records(chunks, quoted: bool):
+    """
+    Split a streamed request body into complete records without reading the whole body into memory.
+    Lines are decoded incrementally as UTF-8. For CSV, a record ends at a newline outside double quotes, so quoted fields may contain line breaks.
+    Parameters:
+        chunks (AsyncIterator[bytes]): The chunks of the request body, as yielded by Request.stream().
+        quoted (bool): Whether newlines inside double-quoted fields belong to the record, as in CSV.
+    Yields:
+        record (str): The text of one record, including its line break if it had one.
+    Raises:
+        UnicodeDecodeError: If the body is not valid UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    record = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            record += line + "\n"
+            if(not quoted or record.count('"') % 2 == 0):
+                yield record
+                record = ""
+    record += pending + decoder.decode(b"", final=True)
+    if(record.strip()):
+        yield record
+
+async def iter_row_batches(chunks, contentType: str, batchSize: int):
+    """
+    Parse a streamed CSV or NDJSON body into batches of row dictionaries.
+    CSV bodies must start with a header row naming the columns; NDJSON bodies hold one JSON object per line. Blank lines are skipped.
+    Rows that cannot be parsed are passed on as their error message, so they can be reported with the validation errors.
+    Parameters:
+        chunks (AsyncIterator[bytes]): The chunks of the request body.
+        contentType (str): The media type of the body.
+        batchSize (int): The number of rows per batch.
+    Yields:
+        batch (list): Up to batchSize tuples of the 1-based row number and either the row dictionary or an error message.
+    Raises:
+        ValueError: If the content type is not supported or a CSV body has no header row.
+    """
+    isCsv = contentType in CSV_CONTENT_TYPES
+    if(not isCsv and contentType not in NDJSON_CONTENT_TYPES):
+        raise ValueError(f"Unsupported content type {contentType}, expected text/csv or application/x-ndjson")
+
+    header = None
+    records = []
+    rowNumber = 0
+
+    def parse(records: list, firstRow: int):
+        if(isCsv):
+            rows = [dict(zip(header, values)) if len(values) == len(header) else f"Expected {len(header)} columns, got {len(values)}"
+                    for values in csv.reader(records)]
+        else:
+            rows = []
+            for record in records:
+                try:
+                    row = json.loads(record)
+                    rows.append(row if isinstance(row, dict) else "Expected a JSON object")
+                except json.JSONDecodeError as decodeError:
+                    rows.append(f"Invalid JSON: {decodeError}")
+        return list(enumerate(rows, start=firstRow))
+
+    async for record in iter_records(chunks, quoted=isCsv):
+        if(not record.strip()):
+            continue
+        if(isCsv and header is None):
+            header = [column.strip() for column in next(csv.reader([record]))]
+            continue
+        records.append(record)
+        if(len(records) == batchSize):
+            yield parse(records, rowNumber + 1)
+            rowNumber += len(records)
+            records = []
+
+    if(isCsv and header is None):
+        raise ValueError("CSV body must start with a header row")
+    if(records):
+        yield parse(records, rowNumber + 1)
+
+def validate_rows(rows: list, model, defaults: dict):
+    """
+    Validate parsed rows with a model, collecting an error for every row that does not fit it.
+    Empty CSV cells are treated as missing values.
+    Parameters:
+        rows (list): Tuples of the row number and either the row dictionary or a parse error message.
+        model (type): The pydantic model each row must satisfy.
+        defaults (dict): Values for model fields that imported rows need not provide.
+    Returns:
+        validation (tuple): The list of (row number, model instance) tuples of the valid rows and the list of errors, each a dictionary with the row number and a message.
+    """
+    valid = []
+    errors = []
+    for rowNumber, row in rows:
+        if(isinstance(row, str)):
+            errors.append({"row": rowNumber, "error": row})
+            continue
+        try:
+            values = {field: value for field, value in row.items() if value != ""}
+            valid.append((rowNumber, model(**{**defaults, **values})))
+        except ValidationError as validationError:
+            message = "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in validationError.errors())
+            errors.append({"row": rowNumber, "error": message})
+    return valid, errors
+
+def insert_rows(conn: sqlite3.Connection, query: str, rows: list, errors: list, table: str):
+    """
+    Insert a batch of rows in one transaction with a single executemany call.
+    If a constraint rejects the batch, it is rolled back and replayed row by row in one transaction, so only the offending rows are reported and the rest are still inserted.
+    Parameters:
+        conn (sqlite3.Connection): A connection to the database.
+        query (str): The parameterised insert statement.
+        rows (list): Tuples of the row number and the parameters of the statement.
+        errors (list): The error list of the import, extended with the rows rejected by a constraint.
+        table (str): The name of the table, whose change counter is bumped in the same transaction.
+    Returns:
+        inserted (int): The number of rows inserted.
+    Raises:
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+    """
+    try:
+        conn.executemany(query, [params for _, params in rows])
+        bump_versions(conn, table)
+        conn.commit()
+        return len(rows)
+    except sqlite3.IntegrityError:
+        conn.rollback()
+
+    inserted = 0
+    for rowNumber, params in rows:
+        try:
+            conn.execute(query, params)
+            inserted += 1
+        except sqlite3.IntegrityError as integrityError:
+            errors.append({"row": rowNumber, "error": f"Integrity error: {integrityError}"})
+    if(inserted):
+        bump_versions(conn, table)
+    conn.commit()
+    return inserted
@@ -0,0 +1,157 @@
+import collections
+import threading
+import time
+from app.config import settings
+
+MISSING = object()
+
+class LRUCache:
+    """
+    A bounded, thread-safe read cache with least-recently-used eviction and a time to live.
+    Entries can carry tags, so a write can drop exactly the entries that depend on the rows it changed, e.g. every cached list page containing a book.
+    Cached values are shared between callers and must be treated as read-only.
+    Attributes:
+        max_entries (int): The number of entries kept before the least recently used one is evicted.
+        ttl (float): The number of seconds an entry is served before it expires.
+        enabled (bool): Whether the cache stores and serves entries at all.
+    """
+    def __init__(self, max_entries: int, ttl: float, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = collections.OrderedDict()
+        self._tags = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def _remove(self, key):
+        """
+        Drop an entry and its tag references; must be called with the lock held.
+        Parameters:
+            key: The key of the entry.
+        Returns:
+            None
+        """
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if(not keys):
+                del self._tags[tag]
+
+    def generation(self):
+        """
+        Read the invalidation generation, to be passed to put() by a caller about to read from the database.
+        Parameters:
+            None
+        Returns:
+            generation (int): A counter increased by every invalidation.
+        """
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        """
+        Look up an entry, refreshing its position in the eviction order.
+        Parameters:
+            key: The key of the entry.
+        Returns:
+            value: The cached value, or MISSING if there is no live entry.
+        """
+        if(not self.enabled):
+            return MISSING
+        with self._lock:
+            entry = self._entries.get(key)
+            if(entry is None):
+                self._stats["misses"] += 1
+                return MISSING
+            value, expires, _ = entry
+            if(expires < time.monotonic()):
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key, value, tags=(), generation: int = None):
+        """
+        Store an entry, evicting the least recently used ones beyond the size bound.
+        The entry is not stored if an invalidation happened after the given generation was read, since the value may then predate the write.
+        Parameters:
+            key: The key of the entry.
+            value: The value to cache.
+            tags (iterable): Tags that invalidate_tags() can drop the entry by.
+            generation (int): The generation read before the value was loaded, or None to store unconditionally.
+        Returns:
+            None
+        """
+        if(not self.enabled):
+            return
+        with self._lock:
+            if(generation is not None and generation != self._generation):
+                return
+            if(key in self._entries):
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, time.monotonic() + self.ttl, tags)
+            for tag in tags:
+                self._tags[tag].add(key)
+            while(len(self._entries) > self.max_entries):
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate_tags(self, tags):
+        """
+        Drop every entry carrying any of the given tags.
+        Parameters:
+            tags (iterable): The tags of the entries to drop.
+        Returns:
+            None
+        """
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._stats["invalidations"] += 1
+
+    def clear(self):
+        """
+        Drop every entry.
+        Parameters:
+            None
+        Returns:
+            None
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        """
+        Report the cache counters.
+        Parameters:
+            None
+        Returns:
+            stats (dict): Whether the cache is enabled, its size bound and TTL, the number of entries, and the hit, miss, eviction, expiration and invalidation counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["enabled"] = self.enabled
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        return stats
+
+book_cache = LRUCache(settings.cache_max_entries, settings.cache_ttl, settings.cache_enabled)
+member_cache = LRUCache(settings.cache_max_entries, settings.cache_ttl, settings.cache_enabled)
@@ -0,0 +1,98 @@
+import os
+from pydantic import BaseModel
+from typing import Literal
+
+ENV_PREFIX = "LIBRARY_"
+
+class Settings(BaseModel):
+    """
+    Runtime configuration of the backend.
+    Every attribute can be overridden with an environment variable named after it in upper case and prefixed with LIBRARY_, e.g. LIBRARY_DB_POOL_SIZE=16.
+    Attributes:
+        db_path (str): The path of the SQLite database file, relative to the working directory.
+        db_journal_mode (str): The journal mode of the database; WAL lets readers proceed while a write is in progress.
+        db_synchronous (str): How often SQLite syncs to disk; NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit.
+        db_mmap_size (int): The number of bytes of the database file SQLite may memory-map for reads.
+        db_cache_size (int): The page cache size of each connection, in pages if positive or in KiB if negative.
+        db_temp_store (str): Where SQLite keeps temporary tables and indices.
+        db_busy_timeout (int): The number of milliseconds a connection retries on a locked database before failing with "database is locked".
+        db_pool_size (int): The maximum number of SQLite connections kept by the connection pool.
+        db_pool_timeout (float): The number of seconds a request waits for a free connection before failing.
+        db_pool_health_check_interval (float): The number of seconds a connection may sit idle before it is health checked on checkout.
+        db_executor_workers (int): The number of threads that run database calls for the async routes, which bounds how many queries run at once.
+        page_size_default (int): The number of rows a list endpoint returns when no limit is given.
+        page_size_max (int): The largest page a list endpoint returns; larger limits are capped to it.
+        batch_ids_max (int): The largest number of IDs a batch lookup accepts.
+        import_batch_size (int): The number of rows a bulk import validates and inserts per transaction.
+        cache_enabled (bool): Whether book and member reads are served from the in-process cache.
+        cache_max_entries (int): The number of entries each of the book and member caches keeps before evicting the least recently used one.
+        cache_ttl (float): The number of seconds a cached entry is served before it is read again, bounding staleness after writes made outside the application.
+        overdue_sweep_interval (float): The number of seconds between runs of the background overdue sweeper, or 0 to disable it.
+        suggest_limit_default (int): The number of matches a suggest endpoint returns when no limit is given.
+        suggest_limit_max (int): The largest number of matches a suggest endpoint returns; larger limits are capped to it.
+        write_queue_enabled (bool): Whether single checkouts and returns are committed in groups by the allocation write queue instead of one transaction each.
+        write_queue_max_batch (int): The largest number of allocation writes the write queue commits together.
+        write_queue_max_delay (float): The number of seconds the first write of a batch waits for more writes before the batch is committed.
+        archive_path (str): The path of the SQLite file closed loans are archived to, or empty for library.archive.sql next to the database.
+        archive_horizon_days (int): The number of days after its end date a returned loan is kept in the History table before it is archived.
+        archive_interval (float): The number of seconds between runs of the background history archiver, or 0 to disable it.
+        archive_batch_size (int): The number of loans the archiver moves per transaction.
+        stats_top_default (int): The number of books or members a top list returns when no limit is given.
+        stats_window_max_days (int): The longest window of days the daily checkout statistics cover in one request.
+        stream_chunk_size (int): The number of rows a streamed report reads and sends at a time.
+        compression_enabled (bool): Whether responses are compressed with brotli or gzip for clients that accept it.
+        compression_minimum_size (int): The smallest response body, in bytes, that is compressed; smaller bodies are cheaper to send as they are.
+    """
+    db_path: str = "data/library.sql"
+    db_journal_mode: Literal["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"] = "WAL"
+    db_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    db_mmap_size: int = 268435456
+    db_cache_size: int = -65536
+    db_temp_store: Literal["DEFAULT", "FILE", "MEMORY"] = "MEMORY"
+    db_busy_timeout: int = 5000
+    db_pool_size: int = 8
+    db_pool_timeout: float = 30.0
+    db_pool_health_check_interval: float = 60.0
+    db_executor_workers: int = 8
+    page_size_default: int = 100
+    page_size_max: int = 1000
+    batch_ids_max: int = 10000
+    import_batch_size: int = 5000
+    cache_enabled: bool = True
+    cache_max_entries: int = 4096
+    cache_ttl: float = 300.0
+    overdue_sweep_interval: float = 3600.0
+    suggest_limit_default: int = 10
+    suggest_limit_max: int = 50
+    write_queue_enabled: bool = False
+    write_queue_max_batch: int = 64
+    write_queue_max_delay: float = 0.002
+    archive_path: str = ""
+    archive_horizon_days: int = 365
+    archive_interval: float = 86400.0
+    archive_batch_size: int = 5000
+    stats_top_default: int = 10
+    stats_window_max_days: int = 366
+    stream_chunk_size: int = 1000
+    compression_enabled: bool = True
+    compression_minimum_size: int = 1024
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the settings from the LIBRARY_* environment variables.
+        Parameters:
+            None
+        Returns:
+            settings (Settings): The settings, with defaults for every variable that is not set.
+        Raises:
+            pydantic.ValidationError: If an environment variable cannot be converted to the type of its setting.
+        """
+        values = {}
+        for name in cls.__annotations__:
+            envName = f"{ENV_PREFIX}{name.upper()}"
+            if(envName in os.environ):
+                values[name] = os.environ[envName]
+        return cls(**values)
+
+settings = Settings.from_env()
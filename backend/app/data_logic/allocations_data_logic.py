@@ -1,35 +1,91 @@
-from app.database import get_db_connection
-from app.models import Allocation
+from app.models import Allocation, to_day_number, dates_to_iso, iso_date
+from app.config import settings
+from app.pagination import page_bounds, json_object, to_json_page
+from app.filters import where_clause, id_chunks
+from app.cache import book_cache
+from app.etags import bump_versions
+from app.errors import ConflictError
+from collections import Counter
 import sqlite3
 import datetime
 
-def get_all_allocation():
+# The fields of an allocation row, as JSON key and column.
+ALLOCATION_FIELDS = {
+    "id": "id",
+    "book_id": "book_id",
+    "member_id": "member_id",
+    "start_date": iso_date("start_date"),
+    "end_date": iso_date("end_date"),
+    "returned": "returned",
+    "overdue": "overdue",
+}
+
+# The fields of a row of the overdue report, as JSON key and column, with the names of the book and the member.
+OVERDUE_FIELDS = {
+    "id": "Allocations.id",
+    "book_id": "Allocations.book_id",
+    "book_name": "Books.name",
+    "member_id": "Allocations.member_id",
+    "member_name": "Members.name",
+    "start_date": iso_date("Allocations.start_date"),
+    "end_date": iso_date("Allocations.end_date"),
+}
+
+def get_all_allocation(conn: sqlite3.Connection, after: int = 0, limit: int = settings.page_size_default, book_id: int = None, member_id: int = None,
+        returned: bool = None, overdue: bool = None, start_from: datetime.date = None, start_to: datetime.date = None, end_from: datetime.date = None, end_to: datetime.date = None):
     """
-    Retrieve all allocations from the database.
-    Connects to the database, executes a query to fetch all allocations, and returns the results as a list of dictionaries.
+    Retrieve a page of allocations from the database.
+    Uses the given connection to fetch the allocations matching the given filters with an ID greater than the cursor in ID order, reading at most one row more than the page size, so memory per request stays bounded regardless of table size.
+    Each row is serialised to JSON by SQLite's json_object(), so the page is returned as encoded bytes without building a dictionary per row.
     Parameters:
-        None
+        conn (sqlite3.Connection): A pooled connection to the database.
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+        book_id (int): Only return allocations of this book, if given.
+        member_id (int): Only return allocations to this member, if given.
+        returned (bool): Only return allocations with this returned status, if given.
+        overdue (bool): Only return allocations with this overdue status, if given.
+        start_from (date): Only return allocations starting on or after this date, if given.
+        start_to (date): Only return allocations starting on or before this date, if given.
+        end_from (date): Only return allocations ending on or after this date, if given.
+        end_to (date): Only return allocations ending on or before this date, if given.
     Returns:
-        allocations (list): A list of dictionaries, each representing an allocation.
+        page (tuple): The JSON array of the allocations as bytes, and the cursor of the next page, or None on the last page.
     Raises:
+        ValueError: If the cursor or the limit is invalid.
         sqliteError: If there is an issue with the database connection or query execution.
         exception: If any other error occurs
     """
     try:
-        conn = get_db_connection()
-        allocations = conn.execute("SELECT * FROM Allocations;").fetchall()
-        conn.close()
-        return [dict(allocation) for allocation in allocations]
+        after, limit = page_bounds(after, limit)
+        where, params = where_clause({
+            "id > ?": after,
+            "book_id = ?": book_id,
+            "member_id = ?": member_id,
+            "returned = ?": returned,
+            "overdue = ?": overdue,
+            "start_date >= ?": to_day_number(start_from),
+            "start_date <= ?": to_day_number(start_to),
+            "end_date >= ?": to_day_number(end_from),
+            "end_date <= ?": to_day_number(end_to),
+        })
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        allocations = cursor.execute(f"SELECT id, {json_object(ALLOCATION_FIELDS)} FROM Allocations WHERE {where} ORDER BY id LIMIT ?;", (*params, limit + 1)).fetchall()
+        return to_json_page(allocations, limit)
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def get_allocation(allocation_id: int):
+def get_allocation(conn: sqlite3.Connection, allocation_id: int):
     """
     Retrieve a specific allocation from the database by its ID.
-    Connects to the database, executes a query to fetch the allocation with the given ID, and returns the result as a dictionary.
+    Uses the given connection to fetch the allocation with the given ID, and returns the result as a dictionary.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         allocation_id (int): The ID of the allocation to retrieve.
     Returns:
         allocation (dict): A dictionary representing the allocation.
@@ -40,12 +96,10 @@ def get_allocation(allocation_id: int):
     try:
         if(allocation_id <=0):
             raise ValueError
-        conn = get_db_connection()
         allocation = conn.execute("SELECT * FROM Allocations WHERE id=?;", (allocation_id,)).fetchone()
-        conn.close()
         if(not allocation):
             raise KeyError("Allocation not found")        
-        return dict(allocation)
+        return dates_to_iso(allocation)
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except KeyError:
@@ -55,11 +109,12 @@ def get_allocation(allocation_id: int):
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def get_allocations_of_book(book_id: int):
+def get_allocations_of_book(conn: sqlite3.Connection, book_id: int):
     """
     Retrieve all allocations for a specific book from the database.
-    Connects to the database, executes a query to fetch all allocations for the given book ID, and returns the results as a list of dictionaries.
+    Uses the given connection to fetch all allocations for the given book ID, and returns the results as a list of dictionaries.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         book_id (int): The ID of the book to retrieve allocations for.
     Returns:
         allocations (list): A list of dictionaries, each representing an allocation.
@@ -68,12 +123,10 @@ def get_allocations_of_book(book_id: int):
         exception: If any other error occurs
     """
     try:
-        conn = get_db_connection()
         allocations = conn.execute("SELECT * FROM Allocations WHERE book_id=?;", (book_id,)).fetchall()
-        conn.close()
         if(not allocations):
             raise KeyError
-        return [dict(allocation) for allocation in allocations]
+        return [dates_to_iso(allocation) for allocation in allocations]
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except KeyError:
@@ -81,11 +134,12 @@ def get_allocations_of_book(book_id: int):
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def get_allocations_of_member(member_id: int):
+def get_allocations_of_member(conn: sqlite3.Connection, member_id: int):
     """
     Retrieve all allocations for a specific member from the database.
-    Connects to the database, executes a query to fetch all allocations for the given member ID, and returns the results as a list of dictionaries.
+    Uses the given connection to fetch all allocations for the given member ID, and returns the results as a list of dictionaries.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         member_id (int): The ID of the member to retrieve allocations for.
     Returns:
         allocations (list): A list of dictionaries, each representing an allocation.
@@ -94,12 +148,10 @@ def get_allocations_of_member(member_id: int):
         exception: If any other error occurs
     """
     try:
-        conn = get_db_connection()
         allocations = conn.execute("SELECT * FROM Allocations WHERE member_id=?;", (member_id,)).fetchall()
-        conn.close()
         if(not allocations):
             raise KeyError
-        return [dict(allocation) for allocation in allocations]
+        return [dates_to_iso(allocation) for allocation in allocations]
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except KeyError:
@@ -107,11 +159,13 @@ def get_allocations_of_member(member_id: int):
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def get_allocation_by_book_and_member(book_id: int, member_id: int):
+def get_allocation_by_book_and_member(conn: sqlite3.Connection, book_id: int, member_id: int):
     """
     Retrieve a specific allocation for a book and member from the database.
-    Connects to the database, executes a query to fetch the allocation with the given book ID and member ID, and returns the result as a dictionary.
+    Uses the given connection to fetch the allocation with the given book ID and member ID, and returns the result as a dictionary.
+    The overdue flag is kept up to date by the background sweeper, so this read does not write.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         book_id (int): The ID of the book.
         member_id (int): The ID of the member.
     Returns:
@@ -121,22 +175,10 @@ def get_allocation_by_book_and_member(book_id: int, member_id: int):
         exception: If any other error occurs
     """
     try:
-        conn = get_db_connection()
         allocation = conn.execute("SELECT * FROM Allocations WHERE book_id=? AND member_id=?;", (book_id, member_id)).fetchone()
-        
         if(not allocation):
-            conn.close()
             raise KeyError
-        
-        end_date = datetime.datetime.strptime(allocation["end_date"], "%Y-%m-%d")
-        if(end_date < datetime.datetime.now()):
-            conn.execute("UPDATE Allocations SET overdue = 1 WHERE id=?",(allocation["id"]))
-            conn.execute("UPDATE History SET overdue = 1 WHERE id=?", (allocation["id"]))
-            conn.commit()
-            allocation = conn.execute("SELECT * FROM Allocations WHERE id=?;", (allocation["id"],)).fetchone()
-        
-        conn.close()
-        return dict(allocation)
+        return dates_to_iso(allocation)
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except KeyError:
@@ -144,38 +186,138 @@ def get_allocation_by_book_and_member(book_id: int, member_id: int):
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def add_allocation(allocation: Allocation):
+def apply_add_allocation(conn: sqlite3.Connection, allocation: Allocation):
+    """
+    Claim a copy of a book and record the allocation inside the caller's write transaction, without committing.
+    A single conditional update increases allocated_copies only while it is below total_copies, so a book can never be allocated beyond its copies.
+    Used by add_allocation and by the allocation write queue, which commits many of these together.
+    Parameters:
+        conn (sqlite3.Connection): A connection holding a write transaction.
+        allocation (Allocation): An instance of the Allocation class containing the allocation's details.
+    Returns:
+        bookId (int): The ID of the book whose allocated copies changed, to be dropped from the book cache after the commit.
+    Raises:
+        KeyError: If the book is not found.
+        ConflictError: If every copy of the book is allocated.
+        sqlite3.Error: If there is an issue with the query execution.
+    """
+    cursor = conn.cursor()
+    cursor.execute("UPDATE Books SET allocated_copies = allocated_copies + 1 WHERE id=? AND allocated_copies < total_copies;", (allocation.book_id,))
+    if(cursor.rowcount == 0):
+        if(not conn.execute("SELECT 1 FROM Books WHERE id=?;", (allocation.book_id,)).fetchone()):
+            raise KeyError("Book not found")
+        raise ConflictError("No copy of the book is available")
+    cursor.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, ?);",
+                   (allocation.book_id, allocation.member_id, allocation.start_day, allocation.end_day, allocation.returned, allocation.overdue))
+    cursor.execute("INSERT INTO History (book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, ?);",
+                   (allocation.book_id, allocation.member_id, allocation.start_day, allocation.end_day, allocation.returned, allocation.overdue))
+    bump_versions(conn, "Allocations", "History", "Books")
+    return allocation.book_id
+
+def add_allocation(conn: sqlite3.Connection, allocation: Allocation):
     """
     Add a new allocation to the database.
-    Connects to the database, executes an insert query to add the allocation's details, and commits the transaction.
+    Uses the given connection to claim a copy of the book with a single conditional update that only succeeds while allocated_copies is below total_copies, then inserts the allocation's details and commits the transaction.
+    The transaction is begun IMMEDIATE, taking the write lock up front, so concurrent checkouts queue on the busy timeout instead of failing on a lock upgrade, and a book can never be allocated beyond its copies.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         allocation (Allocation): An instance of the Allocation class containing the allocation's details.
     Returns:
         None
     Raises:
+        KeyError: If the book is not found.
+        ConflictError: If every copy of the book is allocated.
         sqliteError: If there is an issue with the database connection or query execution.
         exception: If any other error occurs
     """
     try:
-        conn = get_db_connection()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            bookId = apply_add_allocation(conn, allocation)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        book_cache.invalidate_tags([("id", bookId)])
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except KeyError as bookNotFound:
+        raise KeyError(bookNotFound)
+    except ConflictError as conflictError:
+        raise ConflictError(conflictError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def add_allocations(conn: sqlite3.Connection, allocations: list):
+    """
+    Add several allocations to the database in one transaction.
+    Uses the given connection to begin an IMMEDIATE transaction, read the free copies of the books and check which members exist with one "WHERE id IN (...)" query per chunk, inserts the Allocations and History rows of the valid items, and updates allocated_copies with one statement per book rather than one per item, so the whole batch costs a single commit.
+    The write lock is held from the first read, so the free copies cannot change before the update and no book is allocated beyond its copies.
+    Items naming an unknown book or member, or a book with no copy left, are reported instead of failing the whole batch.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        allocations (list): Instances of the Allocation class containing the allocations' details.
+    Returns:
+        outcomes (list): One dictionary per item in request order, with its index, a status of "allocated" and the new allocation ID, or a status of "failed" and an error message ("Book not found", "Member not found" or "No copy available").
+    Raises:
+        ValueError: If more items are given than the configured batch maximum.
+        sqliteError: If there is an issue with the database connection or query execution; no item is added.
+        exception: If any other error occurs
+    """
+    try:
+        if(len(allocations) > settings.batch_ids_max):
+            raise ValueError(f"At most {settings.batch_ids_max} allocations can be added at once")
+
+        conn.execute("BEGIN IMMEDIATE;")
         cursor = conn.cursor()
-        cursor.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, ?);",
-                       (allocation.book_id, allocation.member_id, allocation.start_date, allocation.end_date, allocation.returned, allocation.overdue))
-        cursor.execute("INSERT INTO History (book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, ?);",
-                       (allocation.book_id, allocation.member_id, allocation.start_date, allocation.end_date, allocation.returned, allocation.overdue))
-        cursor.execute("UPDATE Books SET allocated_copies = allocated_copies + 1 WHERE id=?;", (allocation.book_id,))
-        conn.commit()
-        conn.close()
+        outcomes = []
+        copies = Counter()
+        try:
+            freeCopies = {}
+            for placeholders, chunk in id_chunks(list({allocation.book_id for allocation in allocations})):
+                for row in conn.execute(f"SELECT id, total_copies - allocated_copies FROM Books WHERE id IN ({placeholders});", chunk):
+                    freeCopies[row[0]] = row[1]
+            existingMembers = set()
+            for placeholders, chunk in id_chunks(list({allocation.member_id for allocation in allocations})):
+                existingMembers.update(row["id"] for row in conn.execute(f"SELECT id FROM Members WHERE id IN ({placeholders});", chunk))
+
+            for index, allocation in enumerate(allocations):
+                if(allocation.book_id not in freeCopies):
+                    outcomes.append({"index": index, "status": "failed", "error": "Book not found"})
+                    continue
+                if(allocation.member_id not in existingMembers):
+                    outcomes.append({"index": index, "status": "failed", "error": "Member not found"})
+                    continue
+                if(copies[allocation.book_id] >= (freeCopies[allocation.book_id] or 0)):
+                    outcomes.append({"index": index, "status": "failed", "error": "No copy available"})
+                    continue
+                values = (allocation.book_id, allocation.member_id, allocation.start_day, allocation.end_day, allocation.returned, allocation.overdue)
+                cursor.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, ?);", values)
+                outcomes.append({"index": index, "status": "allocated", "id": cursor.lastrowid})
+                cursor.execute("INSERT INTO History (book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, ?);", values)
+                copies[allocation.book_id] += 1
+            cursor.executemany("UPDATE Books SET allocated_copies = allocated_copies + ? WHERE id=?;", [(count, book_id) for book_id, count in copies.items()])
+            if(copies):
+                bump_versions(conn, "Allocations", "History", "Books")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        book_cache.invalidate_tags([("id", book_id) for book_id in copies])
+        return outcomes
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def edit_allocation(allocation_id:int, allocation: Allocation):
+def edit_allocation(conn: sqlite3.Connection, allocation_id:int, allocation: Allocation):
     """
     Edit an existing allocation's details in the database.
-    Connects to the database, executes an update query to modify the allocation's details, and commits the transaction.
+    Uses the given connection to execute an update query to modify the allocation's details, and commits the transaction.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         allocation (Allocation): An instance of the Allocation class containing the updated allocation's details.
     Returns:
         None
@@ -187,20 +329,18 @@ def edit_allocation(allocation_id:int, allocation: Allocation):
         if(allocation_id <= 0):
             raise ValueError
 
-        conn = get_db_connection()
         cursor = conn.cursor()
         existingAllocation = conn.execute("SELECT * FROM Allocations WHERE id=?;", (allocation_id,)).fetchone()
         
         if(not existingAllocation):
-            conn.close()
             raise KeyError
 
         cursor.execute("UPDATE Allocations SET book_id=?, member_id=?, start_date=?, end_date=?, returned=? WHERE id=?;",
-                       (allocation.book_id, allocation.member_id, allocation.start_date, allocation.end_date, allocation.returned, allocation_id))
+                       (allocation.book_id, allocation.member_id, allocation.start_day, allocation.end_day, allocation.returned, allocation_id))
         cursor.execute("UPDATE History SET book_id=?, member_id=?, start_date=?, end_date=?, returned=? WHERE id=?;",
-                       (allocation.book_id, allocation.member_id, allocation.start_date, allocation.end_date, allocation.returned, allocation_id))
+                       (allocation.book_id, allocation.member_id, allocation.start_day, allocation.end_day, allocation.returned, allocation_id))
+        bump_versions(conn, "Allocations", "History")
         conn.commit()
-        conn.close()
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except KeyError:
@@ -210,11 +350,42 @@ def edit_allocation(allocation_id:int, allocation: Allocation):
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def delete_allocation(allocation_id: int):
+def apply_delete_allocation(conn: sqlite3.Connection, allocation_id: int):
+    """
+    Return an allocation inside the caller's write transaction, without committing.
+    Marks its History row returned, deletes it and gives the copy back to the book.
+    Used by delete_allocation and by the allocation write queue, which commits many of these together.
+    Parameters:
+        conn (sqlite3.Connection): A connection holding a write transaction.
+        allocation_id (int): The ID of the allocation to delete.
+    Returns:
+        bookId (int): The ID of the book whose allocated copies changed, to be dropped from the book cache after the commit.
+    Raises:
+        ValueError: If the allocation ID is not a positive integer.
+        KeyError: If the allocation is not found.
+        sqlite3.Error: If there is an issue with the query execution.
+    """
+    if(allocation_id <= 0):
+        raise ValueError("Allocation ID must be a positive integer")
+
+    cursor = conn.cursor()
+    existingAllocation = conn.execute("SELECT * FROM Allocations WHERE id=?;", (allocation_id,)).fetchone()
+
+    if(not existingAllocation):
+        raise KeyError("Allocation not Found")
+
+    cursor.execute("UPDATE History SET returned = 1 WHERE id=? ;", (existingAllocation['id'],))
+    cursor.execute("DELETE FROM Allocations WHERE id=?;", (allocation_id,))
+    cursor.execute("UPDATE Books SET allocated_copies = allocated_copies - 1 WHERE id=?", (existingAllocation['book_id'],))
+    bump_versions(conn, "Allocations", "History", "Books")
+    return existingAllocation['book_id']
+
+def delete_allocation(conn: sqlite3.Connection, allocation_id: int):
     """
     Delete an allocation from the database by its ID.
-    Connects to the database, executes a delete query to remove the allocation with the given ID, and commits the transaction.
+    Uses the given connection to execute a delete query to remove the allocation with the given ID, and commits the transaction.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         allocation_id (int): The ID of the allocation to delete.
     Returns:
         None
@@ -226,20 +397,14 @@ def delete_allocation(allocation_id: int):
         if(allocation_id <= 0):
             raise ValueError
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        existingAllocation = conn.execute("SELECT * FROM Allocations WHERE id=?;", (allocation_id,)).fetchone()
-        
-        if(not existingAllocation):
-            conn.close()
-            raise KeyError("Allocation not found")
-        
-        cursor.execute("UPDATE History SET returned = 1 WHERE id=? ;", (existingAllocation['id'],))
-        cursor.execute("DELETE FROM Allocations WHERE id=?;", (allocation_id,))
-        cursor.execute("UPDATE Books SET allocated_copies = allocated_copies - 1 WHERE id=?", (existingAllocation['book_id'],))
-        
-        conn.commit()
-        conn.close()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            bookId = apply_delete_allocation(conn, allocation_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        book_cache.invalidate_tags([("id", bookId)])
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except KeyError:
@@ -248,3 +413,135 @@ def delete_allocation(allocation_id: int):
         raise ValueError("Allocation ID must be a positive integer")
     except Exception as exception:
         raise Exception(f"Error: {exception}")
+
+def delete_allocations(conn: sqlite3.Connection, allocation_ids: list):
+    """
+    Return several allocations in one transaction.
+    Uses the given connection to fetch the allocations with one "WHERE id IN (...)" query per chunk, deletes them, marks the History rows of those actually deleted returned, and updates allocated_copies with one statement per book rather than one per item, so the whole batch costs a single commit.
+    The transaction is begun IMMEDIATE before the allocations are read, so concurrent returns of the same IDs queue on the write lock and each allocation is returned, and its copy given back, only once.
+    IDs without an allocation are reported instead of failing the whole batch.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        allocation_ids (list): The IDs of the allocations to return; duplicates are returned once.
+    Returns:
+        outcomes (list): One dictionary per distinct ID in request order, with the ID and a status of "returned", or a status of "failed" and an error message.
+    Raises:
+        ValueError: If more IDs are given than the configured batch maximum.
+        sqliteError: If there is an issue with the database connection or query execution; no item is returned.
+        exception: If any other error occurs
+    """
+    try:
+        allocation_ids = list(dict.fromkeys(allocation_ids))
+        if(len(allocation_ids) > settings.batch_ids_max):
+            raise ValueError(f"At most {settings.batch_ids_max} allocations can be returned at once")
+
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            existingAllocations = {}
+            for placeholders, chunk in id_chunks(allocation_ids):
+                for row in conn.execute(f"SELECT id, book_id FROM Allocations WHERE id IN ({placeholders});", chunk):
+                    existingAllocations[row["id"]] = row["book_id"]
+
+            cursor = conn.cursor()
+            returnedAllocations = {allocation_id: book_id for allocation_id, book_id in existingAllocations.items()
+                                   if cursor.execute("DELETE FROM Allocations WHERE id=?;", (allocation_id,)).rowcount}
+            copies = Counter(returnedAllocations.values())
+            cursor.executemany("UPDATE History SET returned = 1 WHERE id=? ;", [(allocation_id,) for allocation_id in returnedAllocations])
+            cursor.executemany("UPDATE Books SET allocated_copies = allocated_copies - ? WHERE id=?;", [(count, book_id) for book_id, count in copies.items()])
+            if(copies):
+                bump_versions(conn, "Allocations", "History", "Books")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        book_cache.invalidate_tags([("id", book_id) for book_id in copies])
+        return [{"id": allocation_id, "status": "returned"} if allocation_id in returnedAllocations
+                else {"id": allocation_id, "status": "failed", "error": "Allocation not found"} for allocation_id in allocation_ids]
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def get_overdue_allocations(conn: sqlite3.Connection, today: datetime.date, due_before: datetime.date = None, due_within_days: int = None,
+        chunk_size: int = settings.stream_chunk_size):
+    """
+    Stream the open allocations due before a date, with the names of their book and member.
+    Uses the given connection to run one range query on the index over (returned, end_date), which reads only the matching loans in end date order, and joins Books and Members on their primary keys; a deleted book or member gives a null name.
+    The rows are serialised to JSON by SQLite's json_object() and fetched chunk_size at a time, so memory stays bounded however many loans match.
+    The arguments are checked when the first chunk is requested.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database, which must stay checked out until the generator is exhausted.
+        today (date): The current date; by default loans ending before it are returned, as they are overdue.
+        due_before (date): Return the open loans ending before this date instead, if given.
+        due_within_days (int): Return the open loans already overdue or ending within this many days from today instead, if given.
+        chunk_size (int): The number of rows read and yielded at a time.
+    Yields:
+        chunk (bytes): Consecutive pieces of a JSON array of the allocations, earliest end date first.
+    Raises:
+        ValueError: If both due_before and due_within_days are given, or due_within_days is negative.
+        sqliteError: If there is an issue with the database connection or query execution.
+        exception: If any other error occurs
+    """
+    try:
+        if(due_before is not None and due_within_days is not None):
+            raise ValueError("Give either due_before or due_within_days, not both")
+        if(due_within_days is not None and due_within_days < 0):
+            raise ValueError("due_within_days must not be negative")
+        if(due_within_days is not None):
+            due_before = today + datetime.timedelta(days=due_within_days + 1)
+        cutoff = to_day_number(due_before or today)
+
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(f"""
+            SELECT {json_object(OVERDUE_FIELDS)} FROM Allocations
+            LEFT JOIN Books ON Books.id = Allocations.book_id
+            LEFT JOIN Members ON Members.id = Allocations.member_id
+            WHERE Allocations.returned = 0 AND Allocations.end_date < ?
+            ORDER BY Allocations.end_date, Allocations.id;
+        """, (cutoff,))
+        separator = "["
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if(not rows):
+                break
+            yield f"{separator}{','.join(row[0] for row in rows)}".encode()
+            separator = ","
+        yield b"[]" if separator == "[" else b"]"
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def mark_overdue_allocations(conn: sqlite3.Connection, today: datetime.date):
+    """
+    Flag every open loan whose end date has passed as overdue.
+    Uses the given connection to run one set-based update on Allocations and one on History, each answered from a partial index over the loans not yet flagged, and commits them together.
+    Parameters:
+        conn (sqlite3.Connection): A connection to the database.
+        today (date): The current date; loans ending before it are overdue.
+    Returns:
+        marked (tuple): The number of Allocations rows and of History rows flagged.
+    Raises:
+        sqliteError: If there is an issue with the database connection or query execution; nothing is flagged.
+        exception: If any other error occurs
+    """
+    try:
+        try:
+            allocations = conn.execute("UPDATE Allocations SET overdue = 1 WHERE overdue = 0 AND end_date < ?;", (to_day_number(today),)).rowcount
+            history = conn.execute("UPDATE History SET overdue = 1 WHERE overdue = 0 AND returned = 0 AND end_date < ?;", (to_day_number(today),)).rowcount
+            if(allocations or history):
+                bump_versions(conn, "Allocations", "History")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        return allocations, history
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
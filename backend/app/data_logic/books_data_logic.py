@@ -1,35 +1,136 @@
-from app.database import get_db_connection
-from app.models import Book
+from app.models import Book, dates_to_iso
+from app.config import settings
+from app.pagination import page_bounds, json_object, to_json_page
+from app.filters import where_clause, id_chunks, prefix_bounds, match_expression
+from app.bulk_import import validate_rows, insert_rows
+from app.etags import bump_versions
+from app.cache import book_cache, MISSING
 import sqlite3
 
-def get_all_books():
+# The fields of a book row, as JSON key and column.
+BOOK_FIELDS = {
+    "id": "id",
+    "name": "name",
+    "author": "author",
+    "total_copies": "total_copies",
+    "allocated_copies": "allocated_copies",
+}
+
+def get_all_books(conn: sqlite3.Connection, after: int = 0, limit: int = settings.page_size_default, name: str = None, author: str = None):
     """
-    Retrieve all books from the database.
-    Connects to the database, executes a query to fetch all books, and returns the results as a list of dictionaries.
+    Retrieve a page of books from the database.
+    Uses the given connection to fetch the books matching the given filters with an ID greater than the cursor in ID order, reading at most one row more than the page size, so memory per request stays bounded regardless of table size.
+    Each row is serialised to JSON by SQLite's json_object(), and the encoded page is what the book cache keeps, so a cached page is sent as it is without building a dictionary per row or encoding it again.
     Parameters:
-        None
+        conn (sqlite3.Connection): A pooled connection to the database.
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+        name (str): Only return books with exactly this name, if given.
+        author (str): Only return books by exactly this author, if given.
+    Returns:
+        page (tuple): The JSON array of the books as bytes and the cursor of the next page, or None on the last page.
+    Raises:
+        ValueError: If the cursor or the limit is invalid.
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        after, limit = page_bounds(after, limit)
+        key = ("list", after, limit, name, author)
+        page = book_cache.get(key)
+        if(page is not MISSING):
+            return page
+
+        generation = book_cache.generation()
+        where, params = where_clause({"id > ?": after, "name = ?": name, "author = ?": author})
+        books = conn.execute(f"SELECT id, {json_object(BOOK_FIELDS)} FROM Books WHERE {where} ORDER BY id LIMIT ?;", (*params, limit + 1)).fetchall()
+        page = to_json_page(books, limit)
+        book_cache.put(key, page, ["list", *(("id", book[0]) for book in books[:limit])], generation)
+        return page
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def search_books(conn: sqlite3.Connection, query: str, offset: int = 0, limit: int = settings.page_size_default):
+    """
+    Search the books by the words of their name and author.
+    Uses the given connection to match every word of the query as a prefix against the books_fts index, which triggers keep in sync with the Books table, and returns the best matches first.
+    Matches are ranked by bm25 with words in the name weighted twice as much as words in the author; ties are broken by ID so pages are stable.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        query (str): The search text, e.g. "lord ring".
+        offset (int): The number of matches to skip, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+    Returns:
+        page (tuple): A list of dictionaries, each representing a book, and the offset of the next page, or None on the last page.
+    Raises:
+        ValueError: If the query contains no word, or the offset or the limit is invalid.
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        offset, limit = page_bounds(offset, limit)
+        books = conn.execute("""
+            SELECT Books.* FROM books_fts
+            JOIN Books ON Books.id = books_fts.rowid
+            WHERE books_fts MATCH ?
+            ORDER BY bm25(books_fts, 2.0, 1.0), Books.id
+            LIMIT ? OFFSET ?;
+        """, (match_expression(query), limit + 1, offset)).fetchall()
+        nextOffset = offset + limit if len(books) > limit else None
+        return [dict(book) for book in books[:limit]], nextOffset
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def suggest_books(conn: sqlite3.Connection, prefix: str, limit: int = settings.suggest_limit_default):
+    """
+    Retrieve the books whose name starts with the given prefix, ignoring case, for a type-ahead picker.
+    Uses the given connection to read the first matches in name order with a range scan of the name COLLATE NOCASE index, so only the returned rows are visited whatever the size of the table.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        prefix (str): The beginning of the name, e.g. "jo".
+        limit (int): The number of matches to return, capped to the configured maximum.
     Returns:
-        books (list): A list of dictionaries, each representing a book.
+        books (list): A list of dictionaries with the ID, name and author of each matching book, in name order.
     Raises:
+        ValueError: If the prefix is empty or the limit is not a positive integer.
         sqlite3.Error: If there is an issue with the database connection or query execution.
         Exception: If any other error occurs.
     """
     try:
-        conn = get_db_connection()
-        books = conn.execute("SELECT * FROM Books;").fetchall()
-        conn.close()
+        if(limit <= 0):
+            raise ValueError("Limit must be a positive integer")
+        low, high = prefix_bounds(prefix)
+        books = conn.execute("""
+            SELECT id, name, author FROM Books
+            WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE
+            ORDER BY name COLLATE NOCASE, id
+            LIMIT ?;
+        """, (low, high, min(limit, settings.suggest_limit_max))).fetchall()
         return [dict(book) for book in books]
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def get_book(book_id: int):
+def get_book(conn: sqlite3.Connection, book_id: int, include_allocations: bool = False):
     """
     Retrieve a specific book from the database by its ID.
-    Connects to the database, executes a query to fetch the book with the given ID, and returns the result as a dictionary.
+    Uses the given connection to fetch the book with the given ID, unless it is in the book cache, and returns the result as a dictionary.
+    If requested, the current allocations of the book are read with the names of their members in a single query joining Allocations to Members on the indexed book_id.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         book_id (int): The ID of the book to retrieve.
+        include_allocations (bool): Whether to add the current allocations of the book, each with a member_name, under allocations.
     Returns:
         book (dict): A dictionary representing the book.
     Raises:
@@ -42,14 +143,24 @@ def get_book(book_id: int):
         if(book_id <= 0):
             raise ValueError("Book ID must be a positive integer")
 
-        conn = get_db_connection()
-        book = conn.execute("SELECT * FROM Books WHERE id=?;", (book_id,)).fetchone()
-        conn.close()
-        
-        if(not book):
-            raise KeyError("Book not found")
-        
-        return dict(book)
+        book = book_cache.get(("book", book_id))
+        if(book is MISSING):
+            generation = book_cache.generation()
+            book = conn.execute("SELECT * FROM Books WHERE id=?;", (book_id,)).fetchone()
+            if(not book):
+                raise KeyError("Book not found")
+            book = dict(book)
+            book_cache.put(("book", book_id), book, [("id", book_id)], generation)
+
+        book = dict(book)
+        if(include_allocations):
+            allocations = conn.execute("""
+                SELECT Allocations.*, Members.name AS member_name FROM Allocations
+                LEFT JOIN Members ON Members.id = Allocations.member_id
+                WHERE Allocations.book_id=? ORDER BY Allocations.id;
+            """, (book_id,)).fetchall()
+            book["allocations"] = [dates_to_iso(allocation) for allocation in allocations]
+        return book
 
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
@@ -60,48 +171,55 @@ def get_book(book_id: int):
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def get_book_by_name(book_name: str):
+def get_books_by_ids(conn: sqlite3.Connection, book_ids: list):
     """
-    Retrieve a specific book from the database by its name.
-    Connects to the database, executes a query to fetch the book with the given name, and returns the result as a dictionary.
+    Retrieve several books from the database by their IDs.
+    Uses the given connection to fetch the books with one "WHERE id IN (...)" query per chunk of IDs, keeping each query under SQLite's limit on bound parameters. Books in the book cache are not queried.
+    IDs without a book are reported instead of failing the whole lookup.
     Parameters:
-        book_name (str): The name of the book to retrieve.
+        conn (sqlite3.Connection): A pooled connection to the database.
+        book_ids (list): The IDs of the books to retrieve; duplicates are looked up once.
     Returns:
-        book (dict): A dictionary representing the book.
+        lookup (tuple): A dictionary mapping each found ID to a dictionary representing the book, and the list of IDs that were not found, in request order.
     Raises:
-        ValueError: If the book name is empty.
-        KeyError: If the book is not found.
+        ValueError: If more IDs are given than the configured batch maximum.
         sqlite3.Error: If there is an issue with the database connection or query execution.
         Exception: If any other error occurs.
     """
     try:
-        if(book_name == ""):
-            raise ValueError("Book Name must be valid")
+        book_ids = list(dict.fromkeys(book_ids))
+        if(len(book_ids) > settings.batch_ids_max):
+            raise ValueError(f"At most {settings.batch_ids_max} IDs can be looked up at once")
 
-        conn = get_db_connection()
-        book = conn.execute("SELECT * FROM Books WHERE name=?;", (book_name,)).fetchone()
-        conn.close()
-        
-        if(not book):
-            raise KeyError("Book not found")
-        
-        return dict(book)
+        found = {}
+        uncached = []
+        for book_id in book_ids:
+            book = book_cache.get(("book", book_id))
+            if(book is MISSING):
+                uncached.append(book_id)
+            else:
+                found[book_id] = dict(book)
 
+        generation = book_cache.generation()
+        for placeholders, chunk in id_chunks(uncached):
+            for book in conn.execute(f"SELECT * FROM Books WHERE id IN ({placeholders});", chunk):
+                found[book["id"]] = dict(book)
+                book_cache.put(("book", book["id"]), dict(book), [("id", book["id"])], generation)
+        missing = [book_id for book_id in book_ids if book_id not in found]
+        return found, missing
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except ValueError as valueError:
         raise ValueError(valueError)
-    except KeyError as bookNotFound:
-        raise KeyError(bookNotFound)
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-
-def add_book(book: Book):
+def add_book(conn: sqlite3.Connection, book: Book):
     """
     Add a new book to the database.
-    Connects to the database, executes an insert query to add the book's details, and commits the transaction.
+    Uses the given connection to execute an insert query to add the book's details, and commits the transaction.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         book (Book): An instance of the Book class containing the book's details.
     Returns:
         None
@@ -111,11 +229,11 @@ def add_book(book: Book):
         Exception: If any other error occurs.
     """
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("INSERT INTO Books (name, author, total_copies) VALUES (?, ?, ?);", (book.name, book.author, book.total_copies))
+        bump_versions(conn, "Books")
         conn.commit()
-        conn.close()
+        book_cache.invalidate_tags(["list"])
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except sqlite3.IntegrityError:
@@ -123,11 +241,43 @@ def add_book(book: Book):
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
-def edit_book(book_id:int, book: Book):
+def import_books(conn: sqlite3.Connection, rows: list):
+    """
+    Add a batch of imported books to the database.
+    Validates every row with the Book model and inserts the valid rows with a single executemany call in one transaction, so the batch costs one commit instead of one per book.
+    As in add_book, the ID of a row is ignored and assigned by the database.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        rows (list): Tuples of the row number and either the row dictionary or a parse error message.
+    Returns:
+        report (tuple): The number of books inserted and the list of errors, each a dictionary with the row number and a message.
+    Raises:
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        valid, errors = validate_rows(rows, Book, {"id": -1, "allocated_copies": 0})
+        inserted = insert_rows(
+            conn,
+            "INSERT INTO Books (name, author, total_copies) VALUES (?, ?, ?);",
+            [(rowNumber, (book.name, book.author, book.total_copies)) for rowNumber, book in valid],
+            errors,
+            "Books",
+        )
+        if(inserted):
+            book_cache.invalidate_tags(["list"])
+        return inserted, errors
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def edit_book(conn: sqlite3.Connection, book_id:int, book: Book):
     """
     Edit an existing book's details in the database.
-    Connects to the database, executes an update query to modify the book's details, and commits the transaction.
+    Uses the given connection to execute an update query to modify the book's details, and commits the transaction.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         book_id (int): The ID of the book to update/edit.
         book (Book): An instance of the Book class containing the updated book's details.
     Returns:
@@ -142,7 +292,6 @@ def edit_book(book_id:int, book: Book):
         if(book_id <= 0):
             raise ValueError("Book ID must be a positive integer")
 
-        conn = get_db_connection()
         cursor = conn.cursor()
         existingBook = conn.execute("SELECT * FROM Books WHERE id=?;", (book_id,)).fetchone()
         
@@ -151,8 +300,9 @@ def edit_book(book_id:int, book: Book):
         
         cursor.execute("UPDATE Books SET name=?, author=?, total_copies=?, allocated_copies=? WHERE id=?;", (book.name, book.author, book.total_copies, book.allocated_copies, book_id))
 
+        bump_versions(conn, "Books")
         conn.commit()
-        conn.close()
+        book_cache.invalidate_tags(["list", ("id", book_id)])
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except ValueError as valueError:
@@ -163,11 +313,12 @@ def edit_book(book_id:int, book: Book):
         raise Exception(f"Error: {exception}")
 
 
-def delete_book(book_id: int):
+def delete_book(conn: sqlite3.Connection, book_id: int):
     """
     Delete a book from the database by its ID.
-    Connects to the database, executes a delete query to remove the book with the given ID, and commits the transaction.
+    Uses the given connection to execute a delete query to remove the book with the given ID, and commits the transaction.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         book_id (int): The ID of the book to delete.
     Returns:
         None
@@ -181,7 +332,6 @@ def delete_book(book_id: int):
         if(book_id <= 0):
             raise ValueError("Book ID must be a positive integer")
         
-        conn = get_db_connection()
         cursor = conn.cursor()
         existingBook = conn.execute("SELECT * FROM Books WHERE id=?;", (book_id,)).fetchone()
         
@@ -192,8 +342,9 @@ def delete_book(book_id: int):
             raise Exception("Cannot delete a book that has been allocated")
         
         cursor.execute("DELETE FROM Books WHERE id=?;", (book_id,))
+        bump_versions(conn, "Books")
         conn.commit()
-        conn.close()
+        book_cache.invalidate_tags(["list", ("id", book_id)])
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except ValueError as valueError:
@@ -1,24 +1,209 @@
-from app.database import get_db_connection
+from app.config import settings
+from app.pagination import page_bounds, json_object, to_json_page
+from app.filters import where_clause, id_chunks, prefix_bounds
+from app.database import attach_archive
+from app.models import to_day_number, iso_date, EPOCH_JULIAN_DAY
+from app.etags import bump_versions
+from datetime import date
+import pathlib
 import sqlite3
 
-def get_history():
+# The schema of the history archive, created by the first archival run.
+ARCHIVE_SCHEMA = [
     """
-    Retrieve all historic allocations from the database.
-    Connects to the database, executes a query to fetch all historic allocations, and returns the results as a list of dictionaries.
+    CREATE TABLE IF NOT EXISTS archive_rw.History (
+        id INTEGER PRIMARY KEY,
+        book_id INTEGER NOT NULL,
+        member_id INTEGER NOT NULL,
+        start_date INTEGER NOT NULL,
+        end_date INTEGER NOT NULL,
+        returned BOOLEAN DEFAULT FALSE,
+        overdue BOOLEAN DEFAULT FALSE
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS archive_rw.idx_history_book_id ON History (book_id);",
+    "CREATE INDEX IF NOT EXISTS archive_rw.idx_history_member_id ON History (member_id);",
+    "CREATE INDEX IF NOT EXISTS archive_rw.idx_history_end_date ON History (end_date);",
+]
+
+# Rebuilds an archive written before dates were stored as day numbers; the schema is then created again around the new table.
+ARCHIVE_DAY_NUMBER_UPGRADE = [
+    "ALTER TABLE archive_rw.History RENAME TO History_text_dates;",
+    ARCHIVE_SCHEMA[0],
+    f"""
+    INSERT INTO archive_rw.History (id, book_id, member_id, start_date, end_date, returned, overdue)
+    SELECT id, book_id, member_id, CAST(julianday(start_date) - {EPOCH_JULIAN_DAY} AS INTEGER), CAST(julianday(end_date) - {EPOCH_JULIAN_DAY} AS INTEGER), returned, overdue
+    FROM archive_rw.History_text_dates;
+    """,
+    "DROP TABLE archive_rw.History_text_dates;",
+]
+
+# The fields of a history row, as JSON key and column.
+HISTORY_FIELDS = {
+    "id": "History.id",
+    "book_id": "History.book_id",
+    "member_id": "History.member_id",
+    "start_date": iso_date("History.start_date"),
+    "end_date": iso_date("History.end_date"),
+    "returned": "History.returned",
+    "overdue": "History.overdue",
+}
+
+# The orders a page of history can be read in: by ascending ID, oldest loan first, or by descending ID, newest loan first.
+ORDERS = {"asc": "History.id > ?", "desc": "History.id < ?"}
+
+# Related entities that can be expanded into history rows, as (JSON key, selected column, join clause).
+EXPANSIONS = {
+    "book": ("book_name", "Books.name", "LEFT JOIN Books ON Books.id = History.book_id"),
+    "member": ("member_name", "Members.name", "LEFT JOIN Members ON Members.id = History.member_id"),
+}
+
+def get_history(conn: sqlite3.Connection, after: int = 0, limit: int = settings.page_size_default, book_id: int = None, book_name: str = None, member_id: int = None,
+        returned: bool = None, overdue: bool = None, start_from: date = None, start_to: date = None, end_from: date = None, end_to: date = None,
+        expand: set = frozenset(), order: str = "asc"):
+    """
+    Retrieve a page of historic allocations from the database.
+    Uses the given connection to fetch the historic allocations matching the given filters with an ID past the cursor in ID order, reading at most one row more than the page size, so memory per request stays bounded regardless of table size.
+    In descending order the page holds the newest loans first and the cursor continues towards older ones, so recent loans are read without paging through the whole table.
+    Expanded names are read in the same query by joining Books and Members on their primary keys; a deleted book or member gives a null name.
+    Each row is serialised to JSON by SQLite's json_object(), so the page is returned as encoded bytes without building a dictionary per row.
+    Loans moved to the history archive are included transparently: the archive is attached read-only and queried as well, unless the filters rule out every archived loan (returned is false, or the date range starts after the newest archived end date).
+    Each tier is read up to the page size in ID order and the two are merged, so the cost stays bounded by the page size.
     Parameters:
-        None
+        conn (sqlite3.Connection): A pooled connection to the database.
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+        book_id (int): Only return allocations of this book, if given.
+        book_name (str): Only return allocations of books whose name starts with this prefix, ignoring case, if given.
+        member_id (int): Only return allocations to this member, if given.
+        returned (bool): Only return allocations with this returned status, if given.
+        overdue (bool): Only return allocations with this overdue status, if given.
+        start_from (date): Only return allocations starting on or after this date, if given.
+        start_to (date): Only return allocations starting on or before this date, if given.
+        end_from (date): Only return allocations ending on or after this date, if given.
+        end_to (date): Only return allocations ending on or before this date, if given.
+        expand (set): The related entities whose names are added to each row: "book" adds book_name and "member" adds member_name.
+        order (str): "asc" for the oldest loans first, or "desc" for the newest loans first.
     Returns:
-        history (list): A list of dictionaries, each representing a historic allocation.
+        page (tuple): The JSON array of the historic allocations as bytes, and the cursor of the next page, or None on the last page.
     Raises:
+        ValueError: If the cursor, the limit or the order is invalid, the book name prefix is empty, or an unknown entity is expanded.
         sqliteError: If there is an issue with the database connection or query execution.
         exception: If any other error occurs
     """
     try:
-        conn = get_db_connection()
-        history = conn.execute("SELECT * FROM History;").fetchall()
-        conn.close()
-        return [dict(allocation) for allocation in history]
+        after, limit = page_bounds(after, limit)
+        if(order not in ORDERS):
+            raise ValueError(f"Cannot order by {order}")
+        unknown = set(expand) - EXPANSIONS.keys()
+        if(unknown):
+            raise ValueError(f"Cannot expand {', '.join(sorted(unknown))}")
+
+        fields = dict(HISTORY_FIELDS)
+        fields.update((EXPANSIONS[entity][0], EXPANSIONS[entity][1]) for entity in sorted(expand))
+        joins = [EXPANSIONS[entity][2] for entity in sorted(expand)]
+        where, params = where_clause({
+            ORDERS[order]: after if after or order == "asc" else None,
+            "History.book_id = ?": book_id,
+            # The matching books are found with a range scan of the name COLLATE NOCASE index, and their loans through the book_id index.
+            "History.book_id IN (SELECT id FROM main.Books WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE)": prefix_bounds(book_name) if book_name is not None else None,
+            "History.member_id = ?": member_id,
+            "History.returned = ?": returned,
+            "History.overdue = ?": overdue,
+            "History.start_date >= ?": to_day_number(start_from),
+            "History.start_date <= ?": to_day_number(start_to),
+            "History.end_date >= ?": to_day_number(end_from),
+            "History.end_date <= ?": to_day_number(end_to),
+        })
+        tiers = ["main"]
+        if(returned is not False and attach_archive(conn)):
+            archivedUntil = conn.execute("SELECT MAX(end_date) FROM archive.History;").fetchone()[0]
+            # A loan ends on or after it starts, so a start date bound is also a bound on the end date.
+            since = max((to_day_number(bound) for bound in (start_from, end_from) if bound), default=None)
+            if(archivedUntil is not None and (since is None or since <= archivedUntil)):
+                tiers.append("archive")
+
+        branches = [
+            f"SELECT History.id, {json_object(fields)} FROM {tier}.History AS History {' '.join(joins)} WHERE {where} ORDER BY History.id {order.upper()} LIMIT ?"
+            for tier in tiers
+        ]
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        if(len(branches) == 1):
+            history = cursor.execute(f"{branches[0]};", (*params, limit + 1)).fetchall()
+        else:
+            # UNION also drops a loan copied to the archive by an interrupted run but not yet deleted from History.
+            history = cursor.execute(
+                f"SELECT * FROM ({branches[0]}) UNION SELECT * FROM ({branches[1]}) ORDER BY 1 {order.upper()} LIMIT ?;",
+                (*params, limit + 1, *params, limit + 1, limit + 1),
+            ).fetchall()
+        return to_json_page(history, limit)
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def archive_history(conn: sqlite3.Connection, archive_path: pathlib.Path, before: date, batch_size: int = settings.archive_batch_size):
+    """
+    Move the returned loans that ended before the given date from the History table to the history archive.
+    Uses the given connection to attach the archive file read-write, creating it and its schema if needed, or rebuilding an archive that still stores dates as text, and moves the loans in batches of IDs: each batch is copied into the archive and committed, then deleted from History and committed.
+    Copying before deleting means an interrupted run can leave a loan in both tiers but never loses one; the next run skips the copy and finishes the delete, and get_history drops the duplicate meanwhile.
+    Parameters:
+        conn (sqlite3.Connection): A connection to the database, outside any transaction.
+        archive_path (Path): The archive file.
+        before (date): Loans ending before this date are archived.
+        batch_size (int): The number of loans moved per transaction.
+    Returns:
+        archived (int): The number of loans removed from the History table.
+    Raises:
+        ValueError: If the batch size is not a positive integer.
+        sqliteError: If there is an issue with the database connection or query execution; batches already moved stay moved.
+        exception: If any other error occurs
+    """
+    try:
+        if(batch_size <= 0):
+            raise ValueError("Batch size must be a positive integer")
+
+        archived = 0
+        conn.execute("ATTACH DATABASE ? AS archive_rw;", (str(pathlib.Path(archive_path).absolute()),))
+        try:
+            conn.execute("PRAGMA archive_rw.journal_mode=WAL;")
+            columns = {column[1]: column[2] for column in conn.execute("PRAGMA archive_rw.table_info(History);")}
+            if(columns.get("start_date") == "TEXT"):
+                conn.execute("BEGIN IMMEDIATE;")
+                for statement in ARCHIVE_DAY_NUMBER_UPGRADE:
+                    conn.execute(statement)
+            for statement in ARCHIVE_SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+
+            while True:
+                loanIds = [row[0] for row in conn.execute(
+                    "SELECT id FROM main.History WHERE returned = 1 AND end_date < ? ORDER BY id LIMIT ?;", (to_day_number(before), batch_size))]
+                if(not loanIds):
+                    break
+                try:
+                    for placeholders, chunk in id_chunks(loanIds):
+                        conn.execute(f"INSERT OR IGNORE INTO archive_rw.History SELECT * FROM main.History WHERE id IN ({placeholders});", chunk)
+                    conn.commit()
+                    for placeholders, chunk in id_chunks(loanIds):
+                        conn.execute(f"DELETE FROM main.History WHERE id IN ({placeholders});", chunk)
+                    bump_versions(conn, "History")
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+                archived += len(loanIds)
+                if(len(loanIds) < batch_size):
+                    break
+        finally:
+            conn.execute("DETACH DATABASE archive_rw;")
+        return archived
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
     except Exception as exception:
         raise Exception(f"Error: {exception}")
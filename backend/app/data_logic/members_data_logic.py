@@ -1,34 +1,99 @@
-from app.database import get_db_connection
-from app.models import Member
+from app.models import Member, dates_to_iso
+from app.config import settings
+from app.pagination import page_bounds, json_object, to_json_page
+from app.filters import where_clause, id_chunks, prefix_bounds
+from app.bulk_import import validate_rows, insert_rows
+from app.etags import bump_versions
+from app.cache import member_cache, MISSING
 import sqlite3
 
-def get_all_members():
+# The fields of a member row, as JSON key and column.
+MEMBER_FIELDS = {
+    "id": "id",
+    "name": "name",
+    "email": "email",
+    "phone": "phone",
+}
+
+def get_all_members(conn: sqlite3.Connection, after: int = 0, limit: int = settings.page_size_default, name: str = None, email: str = None):
     """
-    Retrieve all members from the database.
-    Connects to the database, executes a query to fetch all members, and returns the results as a list of dictionaries.
+    Retrieve a page of members from the database.
+    Uses the given connection to fetch the members matching the given filters with an ID greater than the cursor in ID order, reading at most one row more than the page size, so memory per request stays bounded regardless of table size.
+    Each row is serialised to JSON by SQLite's json_object(), and the encoded page is what the member cache keeps, so a cached page is sent as it is without building a dictionary per row or encoding it again.
     Parameters:
-        None
+        conn (sqlite3.Connection): A pooled connection to the database.
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+        name (str): Only return members with exactly this name, if given.
+        email (str): Only return the member with this email, if given.
     Returns:
-        members (list): A list of dictionaries, each representing a member.
+        page (tuple): The JSON array of the members as bytes and the cursor of the next page, or None on the last page.
     Raises:
+        ValueError: If the cursor or the limit is invalid.
         sqliteError: If there is an issue with the database connection or query execution.
     """
     try:
-        conn = get_db_connection()
-        members = conn.execute("SELECT * FROM Members;").fetchall()
-        conn.close()
-        return [dict(member) for member in members]
+        after, limit = page_bounds(after, limit)
+        key = ("list", after, limit, name, email)
+        page = member_cache.get(key)
+        if(page is not MISSING):
+            return page
+
+        generation = member_cache.generation()
+        where, params = where_clause({"id > ?": after, "name = ?": name, "email = ?": email})
+        members = conn.execute(f"SELECT id, {json_object(MEMBER_FIELDS)} FROM Members WHERE {where} ORDER BY id LIMIT ?;", (*params, limit + 1)).fetchall()
+        page = to_json_page(members, limit)
+        member_cache.put(key, page, ["list", *(("id", member[0]) for member in members[:limit])], generation)
+        return page
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
     except Exception as e:
         raise Exception(f"Error: {e}")
 
-def get_member(member_id: int):
+def suggest_members(conn: sqlite3.Connection, prefix: str, limit: int = settings.suggest_limit_default):
+    """
+    Retrieve the members whose name starts with the given prefix, ignoring case, for a type-ahead picker.
+    Uses the given connection to read the first matches in name order with a range scan of the name COLLATE NOCASE index, so only the returned rows are visited whatever the size of the table.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        prefix (str): The beginning of the name, e.g. "jo".
+        limit (int): The number of matches to return, capped to the configured maximum.
+    Returns:
+        members (list): A list of dictionaries with the ID, name, email and phone of each matching member, in name order, so they can be listed and edited like a page of members.
+    Raises:
+        ValueError: If the prefix is empty or the limit is not a positive integer.
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        if(limit <= 0):
+            raise ValueError("Limit must be a positive integer")
+        low, high = prefix_bounds(prefix)
+        members = conn.execute("""
+            SELECT id, name, email, phone FROM Members
+            WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE
+            ORDER BY name COLLATE NOCASE, id
+            LIMIT ?;
+        """, (low, high, min(limit, settings.suggest_limit_max))).fetchall()
+        return [dict(member) for member in members]
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def get_member(conn: sqlite3.Connection, member_id: int, include_allocations: bool = False):
     """
     Retrieve a specific member from the database by their ID.
-    Connects to the database, executes a query to fetch the member with the given ID, and returns the result as a dictionary.
+    Uses the given connection to fetch the member with the given ID, unless it is in the member cache, and returns the result as a dictionary.
+    If requested, the current allocations of the member are read with the names of their books in a single query joining Allocations to Books on the indexed member_id.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         member_id (int): The ID of the member to retrieve.
+        include_allocations (bool): Whether to add the current allocations of the member, each with a book_name, under allocations.
     Returns:
         member (dict): A dictionary representing the member.
     Raises:
@@ -38,14 +103,24 @@ def get_member(member_id: int):
         if(member_id <= 0):
             raise ValueError("Member ID must be a positive integer")
 
-        conn = get_db_connection()
-        member = conn.execute("SELECT * FROM Members WHERE id=?;", (member_id,)).fetchone()
-        conn.close()
-
-        if(not member):
-            raise KeyError("Member not found")
+        member = member_cache.get(("member", member_id))
+        if(member is MISSING):
+            generation = member_cache.generation()
+            member = conn.execute("SELECT * FROM Members WHERE id=?;", (member_id,)).fetchone()
+            if(not member):
+                raise KeyError("Member not found")
+            member = dict(member)
+            member_cache.put(("member", member_id), member, [("id", member_id)], generation)
 
-        return dict(member)
+        member = dict(member)
+        if(include_allocations):
+            allocations = conn.execute("""
+                SELECT Allocations.*, Books.name AS book_name FROM Allocations
+                LEFT JOIN Books ON Books.id = Allocations.book_id
+                WHERE Allocations.member_id=? ORDER BY Allocations.id;
+            """, (member_id,)).fetchall()
+            member["allocations"] = [dates_to_iso(allocation) for allocation in allocations]
+        return member
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except ValueError:
@@ -55,47 +130,55 @@ def get_member(member_id: int):
     except Exception as error:
         raise Exception(f"Error: {error}")
 
-def get_member_by_name(member_name: str):
+def get_members_by_ids(conn: sqlite3.Connection, member_ids: list):
     """
-    Retrieve a specific member from the database by its name.
-    Connects to the database, executes a query to fetch the member with the given name, and returns the result as a dictionary.
+    Retrieve several members from the database by their IDs.
+    Uses the given connection to fetch the members with one "WHERE id IN (...)" query per chunk of IDs, keeping each query under SQLite's limit on bound parameters. Members in the member cache are not queried.
+    IDs without a member are reported instead of failing the whole lookup.
     Parameters:
-        member_name (str): The name of the member to retrieve.
+        conn (sqlite3.Connection): A pooled connection to the database.
+        member_ids (list): The IDs of the members to retrieve; duplicates are looked up once.
     Returns:
-        member (dict): A dictionary representing the member.
+        lookup (tuple): A dictionary mapping each found ID to a dictionary representing the member, and the list of IDs that were not found, in request order.
     Raises:
-        ValueError: If the member name is empty.
-        KeyError: If the member is not found.
+        ValueError: If more IDs are given than the configured batch maximum.
         sqlite3.Error: If there is an issue with the database connection or query execution.
         Exception: If any other error occurs.
     """
     try:
-        if(member_name == ""):
-            raise ValueError("Member Name must be valid")
+        member_ids = list(dict.fromkeys(member_ids))
+        if(len(member_ids) > settings.batch_ids_max):
+            raise ValueError(f"At most {settings.batch_ids_max} IDs can be looked up at once")
 
-        conn = get_db_connection()
-        member = conn.execute("SELECT * FROM Members WHERE name=?", (member_name,)).fetchone()
-        conn.close()
-        
-        if(not member):
-            raise KeyError("Member not found")
-        
-        return dict(member)
+        found = {}
+        uncached = []
+        for member_id in member_ids:
+            member = member_cache.get(("member", member_id))
+            if(member is MISSING):
+                uncached.append(member_id)
+            else:
+                found[member_id] = dict(member)
 
+        generation = member_cache.generation()
+        for placeholders, chunk in id_chunks(uncached):
+            for member in conn.execute(f"SELECT * FROM Members WHERE id IN ({placeholders});", chunk):
+                found[member["id"]] = dict(member)
+                member_cache.put(("member", member["id"]), dict(member), [("id", member["id"])], generation)
+        missing = [member_id for member_id in member_ids if member_id not in found]
+        return found, missing
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
-    except ValueError:
-        raise ValueError("Member ID must be a positive integer")
-    except KeyError as memberNotFound:
-        raise KeyError(memberNotFound)
-    except Exception as error:
-        raise Exception(f"Error: {error}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
 
-def add_member(member: Member):
+def add_member(conn: sqlite3.Connection, member: Member):
     """
     Add a new member to the database.
-    Connects to the database, executes an insert query to add the member's details, and commits the transaction.
+    Uses the given connection to execute an insert query to add the member's details, and commits the transaction.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         member (Member): An instance of the Member class containing the member's details.
     Returns:
         None
@@ -103,11 +186,11 @@ def add_member(member: Member):
         sqliteError: If there is an issue with the database connection or query execution.
     """
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("INSERT INTO Members (name, email, phone) VALUES (?, ?, ?);", (member.name, member.email, member.phone))
+        bump_versions(conn, "Members")
         conn.commit()
-        conn.close()
+        member_cache.invalidate_tags(["list"])
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except sqlite3.IntegrityError:
@@ -115,11 +198,43 @@ def add_member(member: Member):
     except Exception as error:
         raise Exception(f"Error: {error}")
 
-def edit_member(member_id:int, member: Member):
+def import_members(conn: sqlite3.Connection, rows: list):
+    """
+    Add a batch of imported members to the database.
+    Validates every row with the Member model and inserts the valid rows with a single executemany call in one transaction, so the batch costs one commit instead of one per member.
+    As in add_member, the ID of a row is ignored and assigned by the database.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        rows (list): Tuples of the row number and either the row dictionary or a parse error message.
+    Returns:
+        report (tuple): The number of members inserted and the list of errors, each a dictionary with the row number and a message.
+    Raises:
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        valid, errors = validate_rows(rows, Member, {"id": -1, "email": None, "phone": None})
+        inserted = insert_rows(
+            conn,
+            "INSERT INTO Members (name, email, phone) VALUES (?, ?, ?);",
+            [(rowNumber, (member.name, member.email, member.phone)) for rowNumber, member in valid],
+            errors,
+            "Members",
+        )
+        if(inserted):
+            member_cache.invalidate_tags(["list"])
+        return inserted, errors
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def edit_member(conn: sqlite3.Connection, member_id:int, member: Member):
     """
     Edit an existing member's details in the database.
-    Connects to the database, executes an update query to modify the member's details, and commits the transaction.
+    Uses the given connection to execute an update query to modify the member's details, and commits the transaction.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         member (Member): An instance of the Member class containing the updated member's details.
     Returns:
         None
@@ -130,17 +245,16 @@ def edit_member(member_id:int, member: Member):
         if(member_id <= 0):
             raise ValueError("member ID must be a positive integer")
 
-        conn = get_db_connection()
         cursor = conn.cursor()
         existingMember = conn.execute("SELECT * FROM Members WHERE id=?;", (member_id,)).fetchone()
         
         if(not existingMember):
-            conn.close()
             raise KeyError("Member not found")
         
         cursor.execute("UPDATE Members SET name=?, email=?, phone=? WHERE id=?;", (member.name, member.email, member.phone, member_id))
+        bump_versions(conn, "Members")
         conn.commit()
-        conn.close()
+        member_cache.invalidate_tags(["list", ("id", member_id)])
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except ValueError:
@@ -150,11 +264,12 @@ def edit_member(member_id:int, member: Member):
     except Exception as error:
         raise Exception(f"Error: {error}")
 
-def delete_member(member_id: int):
+def delete_member(conn: sqlite3.Connection, member_id: int):
     """
     Delete a member from the database by their ID.
-    Connects to the database, executes a delete query to remove the member with the given ID, and commits the transaction.
+    Uses the given connection to execute a delete query to remove the member with the given ID, and commits the transaction.
     Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
         member_id (int): The ID of the member to delete.
     Returns:
         None
@@ -165,12 +280,10 @@ def delete_member(member_id: int):
         if(member_id <= 0):
             raise ValueError("Member ID must be a positive integer")
 
-        conn = get_db_connection()
         cursor = conn.cursor()
         existingMember = conn.execute("SELECT * FROM Members WHERE id=?;", (member_id,)).fetchone()
         
         if(not existingMember):
-            conn.close()
             raise KeyError("Member not found")
         
         activeAllocations = conn.execute("SELECT * FROM Allocations WHERE member_id=?;", (member_id,)).fetchall()
@@ -180,8 +293,9 @@ def delete_member(member_id: int):
         
         cursor.execute("DELETE FROM Members WHERE id=?;", (member_id,))
         
+        bump_versions(conn, "Members")
         conn.commit()
-        conn.close()
+        member_cache.invalidate_tags(["list", ("id", member_id)])
     except sqlite3.Error as sqliteError:
         raise sqlite3.Error(f"Database error: {sqliteError}")
     except ValueError:
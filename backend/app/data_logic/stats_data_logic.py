@@ -0,0 +1,180 @@
+from app.config import settings
+from app.pagination import page_bounds
+from app.models import to_day_number, iso_date
+from datetime import date, timedelta
+import sqlite3
+
+# The counters the top lists can be ranked by, each backed by an index in descending order.
+RANKINGS = ("loans", "active_loans")
+
+def get_top_books(conn: sqlite3.Connection, by: str = "loans", limit: int = settings.stats_top_default):
+    """
+    Retrieve the most borrowed books.
+    Uses the given connection to read the first rows of the book_stats index on the chosen counter, which triggers on History keep up to date, so the cost depends on the limit and not on the number of loans.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        by (str): "loans" to rank by loans ever made, or "active_loans" to rank by loans not yet returned.
+        limit (int): The number of books to return, capped to the configured maximum.
+    Returns:
+        books (list): A list of dictionaries with the book ID, name and author, and its loans and active_loans, best first; a deleted book has a null name and author.
+    Raises:
+        ValueError: If the ranking is unknown or the limit is not a positive integer.
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        if(by not in RANKINGS):
+            raise ValueError(f"Cannot rank by {by}")
+        _, limit = page_bounds(0, limit)
+        books = conn.execute(f"""
+            SELECT book_stats.book_id, Books.name, Books.author, book_stats.loans, book_stats.active_loans FROM book_stats
+            LEFT JOIN Books ON Books.id = book_stats.book_id
+            ORDER BY book_stats.{by} DESC, book_stats.book_id
+            LIMIT ?;
+        """, (limit,)).fetchall()
+        return [dict(book) for book in books]
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def get_top_members(conn: sqlite3.Connection, by: str = "loans", limit: int = settings.stats_top_default):
+    """
+    Retrieve the busiest members.
+    Uses the given connection to read the first rows of the member_stats index on the chosen counter, which triggers on History keep up to date, so the cost depends on the limit and not on the number of loans.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        by (str): "loans" to rank by loans ever made, or "active_loans" to rank by loans not yet returned.
+        limit (int): The number of members to return, capped to the configured maximum.
+    Returns:
+        members (list): A list of dictionaries with the member ID and name, and their loans and active_loans, best first; a deleted member has a null name.
+    Raises:
+        ValueError: If the ranking is unknown or the limit is not a positive integer.
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        if(by not in RANKINGS):
+            raise ValueError(f"Cannot rank by {by}")
+        _, limit = page_bounds(0, limit)
+        members = conn.execute(f"""
+            SELECT member_stats.member_id, Members.name, member_stats.loans, member_stats.active_loans FROM member_stats
+            LEFT JOIN Members ON Members.id = member_stats.member_id
+            ORDER BY member_stats.{by} DESC, member_stats.member_id
+            LIMIT ?;
+        """, (limit,)).fetchall()
+        return [dict(member) for member in members]
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def get_book_stats(conn: sqlite3.Connection, book_id: int):
+    """
+    Retrieve the loan counters of a book.
+    Uses the given connection to read the book's row of book_stats by primary key.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        book_id (int): The ID of the book.
+    Returns:
+        stats (dict): The book ID, its loans ever made and its loans not yet returned; both are 0 for a book never borrowed.
+    Raises:
+        ValueError: If the book ID is not a positive integer.
+        KeyError: If the book is not found.
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        if(book_id <= 0):
+            raise ValueError("Book ID must be a positive integer")
+
+        stats = conn.execute("""
+            SELECT Books.id AS book_id, COALESCE(book_stats.loans, 0) AS loans, COALESCE(book_stats.active_loans, 0) AS active_loans FROM Books
+            LEFT JOIN book_stats ON book_stats.book_id = Books.id
+            WHERE Books.id=?;
+        """, (book_id,)).fetchone()
+        if(not stats):
+            raise KeyError("Book not found")
+        return dict(stats)
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except KeyError as bookNotFound:
+        raise KeyError(bookNotFound)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def get_member_stats(conn: sqlite3.Connection, member_id: int):
+    """
+    Retrieve the loan counters of a member.
+    Uses the given connection to read the member's row of member_stats by primary key.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        member_id (int): The ID of the member.
+    Returns:
+        stats (dict): The member ID, their loans ever made and their loans not yet returned; both are 0 for a member who never borrowed.
+    Raises:
+        ValueError: If the member ID is not a positive integer.
+        KeyError: If the member is not found.
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        if(member_id <= 0):
+            raise ValueError("Member ID must be a positive integer")
+
+        stats = conn.execute("""
+            SELECT Members.id AS member_id, COALESCE(member_stats.loans, 0) AS loans, COALESCE(member_stats.active_loans, 0) AS active_loans FROM Members
+            LEFT JOIN member_stats ON member_stats.member_id = Members.id
+            WHERE Members.id=?;
+        """, (member_id,)).fetchone()
+        if(not stats):
+            raise KeyError("Member not found")
+        return dict(stats)
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except KeyError as memberNotFound:
+        raise KeyError(memberNotFound)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
+
+def get_daily_checkouts(conn: sqlite3.Connection, start: date = None, end: date = None):
+    """
+    Retrieve the number of checkouts per day over a window of days.
+    Uses the given connection to read a range of the daily_checkouts table by its primary key, so the cost depends on the number of days and not on the number of loans.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+        start (date): The first day of the window, or None for 30 days up to the end.
+        end (date): The last day of the window, or None for today.
+    Returns:
+        checkouts (dict): The first and last day of the window, the total number of checkouts, and the days with checkouts, each with its day and count, in date order.
+    Raises:
+        ValueError: If the window ends before it starts or is longer than the configured maximum.
+        sqlite3.Error: If there is an issue with the database connection or query execution.
+        Exception: If any other error occurs.
+    """
+    try:
+        end = end or date.today()
+        start = start or end - timedelta(days=29)
+        if(start > end):
+            raise ValueError("Window must not end before it starts")
+        if((end - start).days + 1 > settings.stats_window_max_days):
+            raise ValueError(f"Window must not be longer than {settings.stats_window_max_days} days")
+
+        days = conn.execute(f"SELECT {iso_date('day')} AS day, checkouts FROM daily_checkouts WHERE daily_checkouts.day >= ? AND daily_checkouts.day <= ? AND checkouts > 0 ORDER BY daily_checkouts.day;",
+                            (to_day_number(start), to_day_number(end))).fetchall()
+        days = [dict(day) for day in days]
+        return {"start": start.isoformat(), "end": end.isoformat(), "total": sum(day["checkouts"] for day in days), "days": days}
+    except sqlite3.Error as sqliteError:
+        raise sqlite3.Error(f"Database error: {sqliteError}")
+    except ValueError as valueError:
+        raise ValueError(valueError)
+    except Exception as exception:
+        raise Exception(f"Error: {exception}")
@@ -1,13 +1,67 @@
+import asyncio
+import collections
+import functools
 import sqlite3
 import pathlib
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from app.config import settings
+from app import migrations
 
-DB_PATH = pathlib.Path("data/library.sql")
+DB_PATH = pathlib.Path(settings.db_path)
+ARCHIVE_PATH = pathlib.Path(settings.archive_path) if settings.archive_path else DB_PATH.with_suffix(".archive.sql")
 
-def get_db_connection():
+ENGINE_PRAGMAS = {
+    "journal_mode": settings.db_journal_mode,
+    "synchronous": settings.db_synchronous,
+    "mmap_size": settings.db_mmap_size,
+    "cache_size": settings.db_cache_size,
+    "temp_store": settings.db_temp_store,
+    "busy_timeout": settings.db_busy_timeout,
+}
+
+logger = logging.getLogger(__name__)
+
+def apply_engine_profile(conn: sqlite3.Connection):
     """
-    Establish a connection to the database.
-    Connects to the SQLite database specified by DB_PATH and sets the row factory to sqlite3.Row for dictionary-like access to rows.
-    If the database file does not exist, it creates the file.
+    Apply the configured engine profile to a connection.
+    Sets every pragma in ENGINE_PRAGMAS on the connection. The values come from the validated settings, since pragmas cannot take bound parameters.
+    Parameters:
+        conn (sqlite3.Connection): The connection to configure.
+    Returns:
+        None
+    Raises:
+        sqlite3.Error: If a pragma cannot be applied.
+    """
+    for pragma, value in ENGINE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma}={value};")
+
+def get_engine_profile(conn: sqlite3.Connection):
+    """
+    Read back the engine settings in effect on a connection.
+    Parameters:
+        conn (sqlite3.Connection): The connection to inspect.
+    Returns:
+        profile (dict): The effective value of every pragma in ENGINE_PRAGMAS, keyed by pragma name, or None where the database does not support it.
+    Raises:
+        sqlite3.Error: If a pragma cannot be read.
+    """
+    profile = {}
+    for pragma in ENGINE_PRAGMAS:
+        row = conn.execute(f"PRAGMA {pragma};").fetchone()
+        profile[pragma] = row[0] if row else None
+    return profile
+
+def create_connection():
+    """
+    Open a new connection to the database.
+    Connects to the SQLite database specified by DB_PATH, applies the engine profile and sets the row factory to sqlite3.Row for dictionary-like access to rows.
+    If the database file does not exist, it creates the file. The connection is opened with URI filenames enabled, so the history archive can be attached read-only.
+    The connection may be used from any thread, since the pool hands it to whichever worker thread serves the request.
     Parameters:
         None
     Returns:
@@ -22,7 +76,8 @@ def get_db_connection():
             DB_PATH.parent.mkdir(parents=True, exist_ok=True)
             DB_PATH.touch()
 
-        conn = sqlite3.connect(str(DB_PATH.absolute()))
+        conn = sqlite3.connect(DB_PATH.absolute().as_uri(), uri=True, check_same_thread=False)
+        apply_engine_profile(conn)
         conn.row_factory = sqlite3.Row
         return conn
     except sqlite3.Error as sqliteError:
@@ -30,10 +85,435 @@ def get_db_connection():
     except Exception as exception:
         raise Exception(f"Error: {exception}")
 
+@contextmanager
+def dedicated_connection():
+    """
+    Context manager that opens a connection outside the pool and closes it on exit.
+    Used by background jobs that change the state of their connection, such as attaching files, which pooled connections must not carry over to requests.
+    Parameters:
+        None
+    Yields:
+        conn (sqlite3.Connection): A new connection to the database.
+    """
+    conn = create_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def attach_archive(conn: sqlite3.Connection, path: pathlib.Path = None):
+    """
+    Attach the history archive to a connection read-only, under the schema name archive.
+    Does nothing if it is already attached, so pooled connections attach it once on first use.
+    The connection must have URI filenames enabled, as connections from create_connection() do, for the read-only mode to apply.
+    Parameters:
+        conn (sqlite3.Connection): A connection outside any transaction.
+        path (Path): The archive file, or None for the configured ARCHIVE_PATH.
+    Returns:
+        attached (bool): True if the archive is attached, or False if no archive has been written yet.
+    Raises:
+        sqlite3.Error: If the archive cannot be attached.
+    """
+    if(any(database[1] == "archive" for database in conn.execute("PRAGMA database_list;"))):
+        return True
+    path = pathlib.Path(path or ARCHIVE_PATH)
+    if(not path.exists()):
+        return False
+    conn.execute("ATTACH DATABASE ? AS archive;", (f"{path.absolute().as_uri()}?mode=ro",))
+    return True
+
+class ConnectionPool:
+    """
+    A bounded pool of reusable SQLite connections.
+    Connections are opened lazily up to the pool size and handed back to the pool after each request instead of being closed.
+    Idle connections are kept in LIFO order so the most recently used (and warmest) connection is reused first.
+    Attributes:
+        size (int): The maximum number of connections the pool opens.
+        timeout (float): The number of seconds acquire() waits for a free connection.
+        health_check_interval (float): The number of idle seconds after which a connection is pinged before reuse.
+    """
+    def __init__(self, connect, size: int, timeout: float, health_check_interval: float):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._waiters = collections.deque()
+        self._opened = 0
+        self._inUse = 0
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "health_check_failures": 0,
+        }
+
+    def _open(self):
+        """
+        Open a new connection and count it against the pool size.
+        Parameters:
+            None
+        Returns:
+            conn (sqlite3.Connection): The new connection.
+        Raises:
+            Exception: If the connection cannot be opened.
+        """
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+        with self._lock:
+            self._stats["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        """
+        Close a connection and free its slot in the pool.
+        Parameters:
+            conn (sqlite3.Connection): The connection to discard.
+        Returns:
+            None
+        """
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+            self._stats["connections_discarded"] += 1
+            self._hand_over(None)
+
+    def _is_healthy(self, conn: sqlite3.Connection, idleSince: float):
+        """
+        Check that a connection which has been idle for a while still works.
+        Parameters:
+            conn (sqlite3.Connection): The connection to check.
+            idleSince (float): The monotonic time at which the connection was returned to the pool.
+        Returns:
+            healthy (bool): False if the connection failed the check.
+        """
+        if(time.monotonic() - idleSince < self.health_check_interval):
+            return True
+        try:
+            conn.execute("SELECT 1;").fetchone()
+            return True
+        except sqlite3.Error:
+            with self._lock:
+                self._stats["health_check_failures"] += 1
+            return False
+
+    def _try_acquire(self):
+        """
+        Check a connection out of the pool without waiting.
+        Reuses an idle connection if there is one and opens a new one if the pool is below its size.
+        Parameters:
+            None
+        Returns:
+            conn (sqlite3.Connection): A connection reserved for the caller, or None if every connection is in use.
+        Raises:
+            Exception: If a new connection cannot be opened.
+        """
+        while True:
+            try:
+                conn, idleSince = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    canOpen = self._opened < self.size
+                    if(canOpen):
+                        self._opened += 1
+                if(not canOpen):
+                    return None
+                conn, idleSince = self._open(), time.monotonic()
+
+            if(self._is_healthy(conn, idleSince)):
+                break
+            self._discard(conn)
+
+        with self._lock:
+            self._inUse += 1
+            self._stats["checkouts"] += 1
+        return conn
+
+    def _exhausted(self):
+        """
+        Tell whether a caller has to wait for a connection; must be called with the lock held.
+        Parameters:
+            None
+        Returns:
+            exhausted (bool): True if no connection is idle and the pool is at its size.
+        """
+        return self._idle.empty() and self._opened >= self.size
+
+    def _hand_over(self, conn: sqlite3.Connection):
+        """
+        Give a released connection, or a freed slot if conn is None, to the coroutine that has waited longest, or else to the idle connections and a waiting thread; must be called with the lock held.
+        Handing a connection straight to a waiter keeps new requests from overtaking the ones already queued.
+        Parameters:
+            conn (sqlite3.Connection): The released connection, or None if a slot was freed.
+        Returns:
+            None
+        """
+        while self._waiters:
+            loop, waiter = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._deliver, waiter, conn)
+                if(conn is not None):
+                    self._inUse += 1
+                return
+            except RuntimeError:
+                continue
+        if(conn is not None):
+            self._idle.put_nowait((conn, time.monotonic()))
+        self._available.notify()
+
+    def _deliver(self, waiter: asyncio.Future, conn: sqlite3.Connection):
+        """
+        Resolve a coroutine's wait with a connection on the coroutine's event loop, or pass the connection on if the coroutine has given up.
+        Parameters:
+            waiter (asyncio.Future): The future the coroutine is awaiting.
+            conn (sqlite3.Connection): The connection handed over, or None if a slot was freed.
+        Returns:
+            None
+        """
+        if(not waiter.done()):
+            waiter.set_result(conn)
+            return
+        with self._lock:
+            if(conn is not None):
+                self._inUse -= 1
+            self._hand_over(conn)
+
+    def _record_wait(self, waitStart: float, timedOut: bool):
+        """
+        Count a wait for a connection in the pool statistics.
+        Parameters:
+            waitStart (float): The monotonic time at which the wait started.
+            timedOut (bool): Whether the wait ended without a connection.
+        Returns:
+            None
+        """
+        with self._lock:
+            self._stats["waits"] += 1
+            self._stats["wait_time_total"] += time.monotonic() - waitStart
+            if(timedOut):
+                self._stats["timeouts"] += 1
+
+    def acquire(self):
+        """
+        Check a connection out of the pool.
+        Reuses an idle connection if there is one, opens a new one if the pool is below its size, and otherwise waits for another request to release one.
+        Parameters:
+            None
+        Returns:
+            conn (sqlite3.Connection): A connection reserved for the caller until it is released.
+        Raises:
+            sqlite3.OperationalError: If no connection becomes free within the pool timeout.
+            Exception: If a new connection cannot be opened.
+        """
+        waitStart = None
+        while True:
+            conn = self._try_acquire()
+            if(conn is not None):
+                break
+            if(waitStart is None):
+                waitStart = time.monotonic()
+            remaining = self.timeout - (time.monotonic() - waitStart)
+            if(remaining <= 0):
+                self._record_wait(waitStart, timedOut=True)
+                raise sqlite3.OperationalError("Timed out waiting for a database connection")
+            with self._available:
+                if(self._exhausted()):
+                    self._available.wait(remaining)
+
+        if(waitStart is not None):
+            self._record_wait(waitStart, timedOut=False)
+        return conn
+
+    async def acquire_async(self):
+        """
+        Check a connection out of the pool from a coroutine.
+        Behaves like acquire(), but waits on the event loop instead of blocking a thread, so requests queued for a connection do not hold worker threads that the requests holding connections need.
+        Waiting coroutines are served in arrival order.
+        Parameters:
+            None
+        Returns:
+            conn (sqlite3.Connection): A connection reserved for the caller until it is released.
+        Raises:
+            sqlite3.OperationalError: If no connection becomes free within the pool timeout.
+            Exception: If a new connection cannot be opened.
+        """
+        loop = asyncio.get_running_loop()
+        waitStart = None
+        while True:
+            conn = self._try_acquire()
+            if(conn is not None):
+                break
+            if(waitStart is None):
+                waitStart = time.monotonic()
+            remaining = self.timeout - (time.monotonic() - waitStart)
+            if(remaining <= 0):
+                self._record_wait(waitStart, timedOut=True)
+                raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+            waiter = loop.create_future()
+            with self._lock:
+                if(not self._exhausted()):
+                    continue
+                self._waiters.append((loop, waiter))
+            try:
+                conn = await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                continue
+            finally:
+                with self._lock:
+                    if((loop, waiter) in self._waiters):
+                        self._waiters.remove((loop, waiter))
+            if(conn is not None):
+                with self._lock:
+                    self._stats["checkouts"] += 1
+                break
+
+        if(waitStart is not None):
+            self._record_wait(waitStart, timedOut=False)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """
+        Return a connection to the pool.
+        Any transaction left open by the request is rolled back so the next user starts from a clean state, and the connection is handed to the longest waiting caller, if any.
+        Parameters:
+            conn (sqlite3.Connection): The connection obtained from acquire().
+        Returns:
+            None
+        """
+        with self._lock:
+            self._inUse -= 1
+        try:
+            if(conn.in_transaction):
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._lock:
+            self._hand_over(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks a connection out of the pool and releases it on exit.
+        Parameters:
+            None
+        Yields:
+            conn (sqlite3.Connection): A pooled connection.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """
+        Close every idle connection held by the pool.
+        Parameters:
+            None
+        Returns:
+            None
+        """
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def metrics(self):
+        """
+        Report the pool usage counters.
+        Parameters:
+            None
+        Returns:
+            metrics (dict): The configured size, the number of open, idle and in-use connections, and the cumulative checkout, wait, timeout and health check counters.
+        """
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics["size"] = self.size
+            metrics["open"] = self._opened
+            metrics["in_use"] = self._inUse
+        metrics["idle"] = self._idle.qsize()
+        return metrics
+
+pool = ConnectionPool(
+    create_connection,
+    size=settings.db_pool_size,
+    timeout=settings.db_pool_timeout,
+    health_check_interval=settings.db_pool_health_check_interval,
+)
+
+db_executor = ThreadPoolExecutor(max_workers=settings.db_executor_workers, thread_name_prefix="db")
+
+async def run_db(func, *args, **kwargs):
+    """
+    Run a blocking database call on the dedicated database executor and wait for it without blocking the event loop.
+    The executor has a fixed number of threads, so at most that many queries run at once however many requests are waiting.
+    Parameters:
+        func (callable): The data_logic function to call.
+        *args: The positional arguments of the call, usually starting with the connection.
+        **kwargs: The keyword arguments of the call.
+    Returns:
+        result: The return value of the call.
+    Raises:
+        Exception: Whatever the call raises.
+    """
+    return await asyncio.get_running_loop().run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+async def iterate_db(chunks, first):
+    """
+    Drive a blocking generator of database rows from the event loop, one chunk per executor call, for a streaming response.
+    The caller reads the first chunk with run_db() before the response starts, so argument and query errors can still become an error status.
+    Parameters:
+        chunks (generator): A data_logic generator whose first chunk has been read.
+        first: The first chunk.
+    Yields:
+        chunk: The first chunk, then every remaining chunk of the generator.
+    """
+    yield first
+    while True:
+        chunk = await run_db(next, chunks, None)
+        if(chunk is None):
+            return
+        yield chunk
+
+async def get_db_connection():
+    """
+    FastAPI dependency that provides a pooled connection to the database for the duration of a request.
+    The connection is checked out on the event loop, so requests waiting for one hold no thread, and is returned to the pool, with any uncommitted transaction rolled back, once the request has been handled.
+    Parameters:
+        None
+    Yields:
+        conn (sqlite3.Connection): A connection object to the SQLite database.
+    Raises:
+        sqlite3.OperationalError: If no connection becomes free within the pool timeout.
+    """
+    conn = await pool.acquire_async()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
 def init_db():
     """
-    Initialize the database with the required tables.
-    Connects to the database, creates the Books, Members, and Allocations tables if they do not exist, and commits the changes.
+    Initialize the database with the required tables and indexes.
+    Checks a connection out of the pool and upgrades the schema to the latest migration, which is a no-op on an up-to-date database.
+    Called by the application lifespan at startup rather than on import, so importing the app package, as the tests and benchmarks do, never writes to the database.
+    Logs the schema version and the effective engine profile so the state of the database can be checked at startup.
     Parameters:
         None
     Returns:
@@ -43,61 +523,10 @@ def init_db():
         Exception: If any other error occurs
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            author TEXT NOT NULL,
-            total_copies INTEGER NOT NULL,
-            allocated_copies INTEGER DEFAULT 0
-        );
-        """)
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Members (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE,
-            phone TEXT
-        );
-        """)
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Allocations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            returned BOOLEAN DEFAULT FALSE,
-            overdue BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (book_id) REFERENCES Books(id),
-            FOREIGN KEY (member_id) REFERENCES Members(id)
-        );
-        """)
-        
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS History (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            returned BOOLEAN DEFAULT FALSE,
-            overdue BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (book_id) REFERENCES Books(id),
-            FOREIGN KEY (member_id) REFERENCES Members(id)
-        );
-        """)
-
-        conn.commit()
-        conn.close()
+        with pool.connection() as conn:
+            version = migrations.upgrade(conn)
+            logger.info("Database %s at schema version %d with engine profile %s", DB_PATH, version, get_engine_profile(conn))
     except sqlite3.Error as sqliteError:
         raise Exception(f"Database initialization error: {sqliteError}")
     except Exception as exception:
         raise Exception(f"Error: {exception}")
-
-init_db()
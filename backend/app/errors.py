@@ -0,0 +1,5 @@
+class ConflictError(Exception):
+    """
+    Raised when a request cannot be applied to the current state of the data, e.g. checking out a book with no copy left.
+    Routers answer it with 409 Conflict.
+    """
@@ -0,0 +1,87 @@
+from fastapi import Request, Response
+import hashlib
+import sqlite3
+
+ETAG_HEADER = "ETag"
+
+def bump_versions(conn: sqlite3.Connection, *tables: str):
+    """
+    Record a change to the given tables by increasing their change counters.
+    Must be called inside the transaction that makes the change, before it is committed, so the counters never run behind the data.
+    Parameters:
+        conn (sqlite3.Connection): The connection holding the write transaction.
+        *tables (str): The names of the changed tables.
+    Returns:
+        None
+    Raises:
+        sqlite3.Error: If the counters cannot be updated.
+    """
+    conn.executemany("UPDATE change_counters SET version = version + 1 WHERE table_name=?;", [(table,) for table in tables])
+
+def make_etag(conn: sqlite3.Connection, tables: tuple, variant: str):
+    """
+    Derive a strong ETag for a response built from the given tables.
+    The tag combines the change counters of the tables with a digest of the request, so it changes whenever one of the tables is written and differs between pages and filters.
+    Read the tag before the data: a write in between then makes the tag older than the body, which only costs a later full response.
+    Parameters:
+        conn (sqlite3.Connection): A connection to the database.
+        tables (tuple): The names of the tables the response is built from.
+        variant (str): The path and query string of the request.
+    Returns:
+        etag (str): The quoted entity tag.
+    Raises:
+        sqlite3.Error: If the counters cannot be read.
+    """
+    placeholders = ", ".join("?" for _ in tables)
+    versions = dict(conn.execute(f"SELECT table_name, version FROM change_counters WHERE table_name IN ({placeholders});", tables).fetchall())
+    digest = hashlib.blake2b(variant.encode(), digest_size=8).hexdigest()
+    return f'"{".".join(str(versions.get(table, 0)) for table in tables)}-{digest}"'
+
+def request_variant(request: Request):
+    """
+    Identify the representation a request asks for.
+    Parameters:
+        request (Request): The incoming request.
+    Returns:
+        variant (str): The path and query string of the request.
+    """
+    return f"{request.url.path}?{request.url.query}"
+
+def is_not_modified(request: Request, etag: str):
+    """
+    Tell whether the client already holds the representation with the given ETag.
+    Follows the weak comparison that RFC 9110 prescribes for If-None-Match, so a tag weakened by a proxy still matches.
+    Parameters:
+        request (Request): The incoming request.
+        etag (str): The current entity tag of the representation.
+    Returns:
+        notModified (bool): True if If-None-Match lists the tag or is "*".
+    """
+    header = request.headers.get("if-none-match")
+    if(not header):
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+def not_modified_response(etag: str):
+    """
+    Build the empty 304 response for a client that holds the current representation.
+    Parameters:
+        etag (str): The current entity tag of the representation.
+    Returns:
+        response (Response): The response with status 304.
+    """
+    return Response(status_code=304, headers={ETAG_HEADER: etag, "Cache-Control": "no-cache"})
+
+def with_etag(response: Response, etag: str):
+    """
+    Add the entity tag to a response, asking clients to revalidate it on every use.
+    Parameters:
+        response (Response): The response to tag.
+        etag (str): The entity tag of its body.
+    Returns:
+        response (Response): The same response.
+    """
+    response.headers[ETAG_HEADER] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -0,0 +1,73 @@
+import re
+
+# The highest code point, which sorts after every character that can follow a prefix.
+MAX_CHARACTER = "\U0010ffff"
+
+# SQLite limits the number of bound parameters per statement (999 before 3.32), so IN lists are split into chunks below it.
+IN_CLAUSE_CHUNK_SIZE = 900
+
+def where_clause(conditions: dict):
+    """
+    Build the WHERE clause of a filtered query from the filters given in a request.
+    Each key is a condition with a single placeholder, such as "book_id = ?", and each value is the parameter bound to it.
+    A condition with several placeholders, such as "name >= ? AND name < ?", takes a tuple of the parameters bound to them in order.
+    Conditions whose value is None were not requested and are left out.
+    Parameters:
+        conditions (dict): The conditions mapped to their parameters.
+    Returns:
+        clause (tuple): The conditions joined with AND (or "1" if there are none) and the list of parameters in the same order.
+    """
+    clauses = []
+    params = []
+    for condition, value in conditions.items():
+        if(value is None):
+            continue
+        clauses.append(condition)
+        if(isinstance(value, tuple)):
+            params.extend(value)
+        else:
+            params.append(value)
+    return (" AND ".join(clauses) or "1"), params
+
+def id_chunks(ids: list):
+    """
+    Split a list of IDs into chunks small enough to bind in a single IN clause.
+    Parameters:
+        ids (list): The IDs to look up.
+    Yields:
+        chunk (tuple): The placeholders of the IN clause, e.g. "?, ?, ?", and the IDs bound to them.
+    """
+    for start in range(0, len(ids), IN_CLAUSE_CHUNK_SIZE):
+        chunk = ids[start:start + IN_CLAUSE_CHUNK_SIZE]
+        yield ", ".join("?" * len(chunk)), chunk
+
+def match_expression(text: str):
+    """
+    Build an FTS5 MATCH expression that finds rows containing every word of a search text, each word possibly incomplete.
+    The text is split into words the way the unicode61 tokenizer splits it, and each word is quoted, so operators and punctuation typed by a user are matched literally instead of being parsed as FTS5 syntax.
+    Parameters:
+        text (str): The search text.
+    Returns:
+        expression (str): The words as quoted prefix queries joined with AND, e.g. "lord"* "ring"*.
+    Raises:
+        ValueError: If the text contains no word.
+    """
+    words = re.findall(r"[^\W_]+", text)
+    if(not words):
+        raise ValueError("Search query must contain a word")
+    return " ".join(f'"{word}"*' for word in words)
+
+def prefix_bounds(prefix: str):
+    """
+    Turn a prefix into the bounds of an index range scan over the values starting with it.
+    Used as "column >= ? AND column < ?", which SQLite answers by seeking an index instead of scanning the table as LIKE 'prefix%' would without special collation settings.
+    Parameters:
+        prefix (str): The prefix to look up.
+    Returns:
+        bounds (tuple): The inclusive lower bound and the exclusive upper bound.
+    Raises:
+        ValueError: If the prefix is empty.
+    """
+    if(prefix == ""):
+        raise ValueError("Prefix must not be empty")
+    return prefix, prefix + MAX_CHARACTER
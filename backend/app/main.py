@@ -1 +1,5 @@
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
 from app import app
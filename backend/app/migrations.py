@@ -0,0 +1,305 @@
+import sqlite3
+
+# Ordered schema migrations as (version, description, statements).
+# Applied migrations are recorded in the schema_version table; append new steps at the end and never edit an applied one.
+MIGRATIONS = [
+    (1, "Create the Books, Members, Allocations and History tables", [
+        """
+        CREATE TABLE IF NOT EXISTS Books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            author TEXT NOT NULL,
+            total_copies INTEGER NOT NULL,
+            allocated_copies INTEGER DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE,
+            phone TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS Allocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            returned BOOLEAN DEFAULT FALSE,
+            overdue BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (book_id) REFERENCES Books(id),
+            FOREIGN KEY (member_id) REFERENCES Members(id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS History (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            returned BOOLEAN DEFAULT FALSE,
+            overdue BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (book_id) REFERENCES Books(id),
+            FOREIGN KEY (member_id) REFERENCES Members(id)
+        );
+        """,
+    ]),
+    (2, "Index allocations by book and by member", [
+        "CREATE INDEX IF NOT EXISTS idx_allocations_book_id ON Allocations (book_id);",
+        "CREATE INDEX IF NOT EXISTS idx_allocations_member_id ON Allocations (member_id);",
+    ]),
+    (3, "Index history by book, by member and by end date", [
+        "CREATE INDEX IF NOT EXISTS idx_history_book_id ON History (book_id);",
+        "CREATE INDEX IF NOT EXISTS idx_history_member_id ON History (member_id);",
+        "CREATE INDEX IF NOT EXISTS idx_history_end_date ON History (end_date);",
+    ]),
+    (4, "Index books and members by name", [
+        "CREATE INDEX IF NOT EXISTS idx_books_name ON Books (name);",
+        "CREATE INDEX IF NOT EXISTS idx_members_name ON Members (name);",
+    ]),
+    (5, "Index books by author", [
+        "CREATE INDEX IF NOT EXISTS idx_books_author ON Books (author);",
+    ]),
+    (6, "Index open loans by end date for the overdue sweep", [
+        "CREATE INDEX IF NOT EXISTS idx_allocations_overdue_sweep ON Allocations (end_date) WHERE overdue = 0;",
+        "CREATE INDEX IF NOT EXISTS idx_history_overdue_sweep ON History (end_date) WHERE overdue = 0 AND returned = 0;",
+    ]),
+    (7, "Count changes per table for ETags", [
+        """
+        CREATE TABLE IF NOT EXISTS change_counters (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+        """,
+        "INSERT OR IGNORE INTO change_counters (table_name) VALUES ('Books'), ('Members'), ('Allocations'), ('History');",
+    ]),
+    (8, "Index book names and authors for full-text search", [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            name,
+            author,
+            content='Books',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        );
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON Books BEGIN
+            INSERT INTO books_fts (rowid, name, author) VALUES (new.id, new.name, new.author);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON Books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, name, author) VALUES ('delete', old.id, old.name, old.author);
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF name, author ON Books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, name, author) VALUES ('delete', old.id, old.name, old.author);
+            INSERT INTO books_fts (rowid, name, author) VALUES (new.id, new.name, new.author);
+        END;
+        """,
+        "INSERT INTO books_fts (books_fts) VALUES ('rebuild');",
+    ]),
+    (9, "Index book and member names case-insensitively for suggestions", [
+        "CREATE INDEX IF NOT EXISTS idx_books_name_nocase ON Books (name COLLATE NOCASE);",
+        "CREATE INDEX IF NOT EXISTS idx_members_name_nocase ON Members (name COLLATE NOCASE);",
+    ]),
+    (10, "Keep loan statistics per book, per member and per day", [
+        """
+        CREATE TABLE IF NOT EXISTS book_stats (
+            book_id INTEGER PRIMARY KEY,
+            loans INTEGER NOT NULL DEFAULT 0,
+            active_loans INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS member_stats (
+            member_id INTEGER PRIMARY KEY,
+            loans INTEGER NOT NULL DEFAULT 0,
+            active_loans INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_checkouts (
+            day TEXT PRIMARY KEY,
+            checkouts INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_book_stats_loans ON book_stats (loans DESC, book_id);",
+        "CREATE INDEX IF NOT EXISTS idx_book_stats_active_loans ON book_stats (active_loans DESC, book_id);",
+        "CREATE INDEX IF NOT EXISTS idx_member_stats_loans ON member_stats (loans DESC, member_id);",
+        "CREATE INDEX IF NOT EXISTS idx_member_stats_active_loans ON member_stats (active_loans DESC, member_id);",
+        """
+        CREATE TRIGGER IF NOT EXISTS history_stats_insert AFTER INSERT ON History BEGIN
+            INSERT INTO book_stats (book_id, loans, active_loans) VALUES (new.book_id, 1, new.returned = 0)
+                ON CONFLICT (book_id) DO UPDATE SET loans = loans + 1, active_loans = active_loans + excluded.active_loans;
+            INSERT INTO member_stats (member_id, loans, active_loans) VALUES (new.member_id, 1, new.returned = 0)
+                ON CONFLICT (member_id) DO UPDATE SET loans = loans + 1, active_loans = active_loans + excluded.active_loans;
+            INSERT INTO daily_checkouts (day, checkouts) VALUES (new.start_date, 1)
+                ON CONFLICT (day) DO UPDATE SET checkouts = checkouts + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS history_stats_update AFTER UPDATE OF book_id, member_id, start_date, returned ON History BEGIN
+            UPDATE book_stats SET loans = loans - 1, active_loans = active_loans - (old.returned = 0) WHERE book_id = old.book_id;
+            UPDATE member_stats SET loans = loans - 1, active_loans = active_loans - (old.returned = 0) WHERE member_id = old.member_id;
+            UPDATE daily_checkouts SET checkouts = checkouts - 1 WHERE day = old.start_date;
+            INSERT INTO book_stats (book_id, loans, active_loans) VALUES (new.book_id, 1, new.returned = 0)
+                ON CONFLICT (book_id) DO UPDATE SET loans = loans + 1, active_loans = active_loans + excluded.active_loans;
+            INSERT INTO member_stats (member_id, loans, active_loans) VALUES (new.member_id, 1, new.returned = 0)
+                ON CONFLICT (member_id) DO UPDATE SET loans = loans + 1, active_loans = active_loans + excluded.active_loans;
+            INSERT INTO daily_checkouts (day, checkouts) VALUES (new.start_date, 1)
+                ON CONFLICT (day) DO UPDATE SET checkouts = checkouts + 1;
+        END;
+        """,
+        "INSERT OR IGNORE INTO book_stats (book_id, loans, active_loans) SELECT book_id, COUNT(*), SUM(returned = 0) FROM History GROUP BY book_id;",
+        "INSERT OR IGNORE INTO member_stats (member_id, loans, active_loans) SELECT member_id, COUNT(*), SUM(returned = 0) FROM History GROUP BY member_id;",
+        "INSERT OR IGNORE INTO daily_checkouts (day, checkouts) SELECT start_date, COUNT(*) FROM History GROUP BY start_date;",
+    ]),
+    (11, "Index open allocations by end date for the overdue report", [
+        "CREATE INDEX IF NOT EXISTS idx_allocations_returned_end_date ON Allocations (returned, end_date);",
+    ]),
+    (12, "Store the dates of loans as day numbers since 1970-01-01", [
+        # Tables are rebuilt to change the column types: the old table is renamed, copied into a new one and dropped, which also drops its indexes and triggers.
+        # Its AUTOINCREMENT counter is carried over so IDs of deleted rows are not reused.
+        "ALTER TABLE Allocations RENAME TO Allocations_text_dates;",
+        """
+        CREATE TABLE Allocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            start_date INTEGER NOT NULL,
+            end_date INTEGER NOT NULL,
+            returned BOOLEAN DEFAULT FALSE,
+            overdue BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (book_id) REFERENCES Books(id),
+            FOREIGN KEY (member_id) REFERENCES Members(id)
+        );
+        """,
+        """
+        INSERT INTO Allocations (id, book_id, member_id, start_date, end_date, returned, overdue)
+        SELECT id, book_id, member_id, CAST(julianday(start_date) - 2440587.5 AS INTEGER), CAST(julianday(end_date) - 2440587.5 AS INTEGER), returned, overdue
+        FROM Allocations_text_dates;
+        """,
+        "DELETE FROM sqlite_sequence WHERE name = 'Allocations';",
+        "UPDATE sqlite_sequence SET name = 'Allocations' WHERE name = 'Allocations_text_dates';",
+        "DROP TABLE Allocations_text_dates;",
+        "CREATE INDEX IF NOT EXISTS idx_allocations_book_id ON Allocations (book_id);",
+        "CREATE INDEX IF NOT EXISTS idx_allocations_member_id ON Allocations (member_id);",
+        "CREATE INDEX IF NOT EXISTS idx_allocations_overdue_sweep ON Allocations (end_date) WHERE overdue = 0;",
+        "CREATE INDEX IF NOT EXISTS idx_allocations_returned_end_date ON Allocations (returned, end_date);",
+        "ALTER TABLE History RENAME TO History_text_dates;",
+        """
+        CREATE TABLE History (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            start_date INTEGER NOT NULL,
+            end_date INTEGER NOT NULL,
+            returned BOOLEAN DEFAULT FALSE,
+            overdue BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (book_id) REFERENCES Books(id),
+            FOREIGN KEY (member_id) REFERENCES Members(id)
+        );
+        """,
+        """
+        INSERT INTO History (id, book_id, member_id, start_date, end_date, returned, overdue)
+        SELECT id, book_id, member_id, CAST(julianday(start_date) - 2440587.5 AS INTEGER), CAST(julianday(end_date) - 2440587.5 AS INTEGER), returned, overdue
+        FROM History_text_dates;
+        """,
+        "DELETE FROM sqlite_sequence WHERE name = 'History';",
+        "UPDATE sqlite_sequence SET name = 'History' WHERE name = 'History_text_dates';",
+        "DROP TABLE History_text_dates;",
+        "CREATE INDEX IF NOT EXISTS idx_history_book_id ON History (book_id);",
+        "CREATE INDEX IF NOT EXISTS idx_history_member_id ON History (member_id);",
+        "CREATE INDEX IF NOT EXISTS idx_history_end_date ON History (end_date);",
+        "CREATE INDEX IF NOT EXISTS idx_history_overdue_sweep ON History (end_date) WHERE overdue = 0 AND returned = 0;",
+        "ALTER TABLE daily_checkouts RENAME TO daily_checkouts_text_dates;",
+        """
+        CREATE TABLE daily_checkouts (
+            day INTEGER PRIMARY KEY,
+            checkouts INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+        """,
+        "INSERT INTO daily_checkouts (day, checkouts) SELECT CAST(julianday(day) - 2440587.5 AS INTEGER), checkouts FROM daily_checkouts_text_dates;",
+        "DROP TABLE daily_checkouts_text_dates;",
+        """
+        CREATE TRIGGER IF NOT EXISTS history_stats_insert AFTER INSERT ON History BEGIN
+            INSERT INTO book_stats (book_id, loans, active_loans) VALUES (new.book_id, 1, new.returned = 0)
+                ON CONFLICT (book_id) DO UPDATE SET loans = loans + 1, active_loans = active_loans + excluded.active_loans;
+            INSERT INTO member_stats (member_id, loans, active_loans) VALUES (new.member_id, 1, new.returned = 0)
+                ON CONFLICT (member_id) DO UPDATE SET loans = loans + 1, active_loans = active_loans + excluded.active_loans;
+            INSERT INTO daily_checkouts (day, checkouts) VALUES (new.start_date, 1)
+                ON CONFLICT (day) DO UPDATE SET checkouts = checkouts + 1;
+        END;
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS history_stats_update AFTER UPDATE OF book_id, member_id, start_date, returned ON History BEGIN
+            UPDATE book_stats SET loans = loans - 1, active_loans = active_loans - (old.returned = 0) WHERE book_id = old.book_id;
+            UPDATE member_stats SET loans = loans - 1, active_loans = active_loans - (old.returned = 0) WHERE member_id = old.member_id;
+            UPDATE daily_checkouts SET checkouts = checkouts - 1 WHERE day = old.start_date;
+            INSERT INTO book_stats (book_id, loans, active_loans) VALUES (new.book_id, 1, new.returned = 0)
+                ON CONFLICT (book_id) DO UPDATE SET loans = loans + 1, active_loans = active_loans + excluded.active_loans;
+            INSERT INTO member_stats (member_id, loans, active_loans) VALUES (new.member_id, 1, new.returned = 0)
+                ON CONFLICT (member_id) DO UPDATE SET loans = loans + 1, active_loans = active_loans + excluded.active_loans;
+            INSERT INTO daily_checkouts (day, checkouts) VALUES (new.start_date, 1)
+                ON CONFLICT (day) DO UPDATE SET checkouts = checkouts + 1;
+        END;
+        """,
+        "UPDATE change_counters SET version = version + 1 WHERE table_name IN ('Allocations', 'History');",
+    ]),
+]
+
+def get_schema_version(conn: sqlite3.Connection):
+    """
+    Retrieve the version of the most recent migration applied to the database.
+    Parameters:
+        conn (sqlite3.Connection): A connection to the database.
+    Returns:
+        version (int): The highest applied migration version, or 0 if no migration has been applied.
+    Raises:
+        sqlite3.Error: If there is an issue with the query execution.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;").fetchone()[0]
+
+def upgrade(conn: sqlite3.Connection):
+    """
+    Bring the database schema up to the latest migration.
+    Applies every migration newer than the recorded schema version in order, each in its own immediate transaction together with its schema_version row, so a failed step leaves the database at the previous version.
+    Running it again on an up-to-date database does nothing, and concurrent callers serialise on the write lock and re-check the version before applying a step.
+    Parameters:
+        conn (sqlite3.Connection): A connection to the database.
+    Returns:
+        version (int): The schema version after the upgrade.
+    Raises:
+        sqlite3.Error: If a migration fails; its changes are rolled back.
+    """
+    version = get_schema_version(conn)
+    for migrationVersion, description, statements in MIGRATIONS:
+        if(migrationVersion <= version):
+            continue
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            if(get_schema_version(conn) < migrationVersion):
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?);", (migrationVersion, description))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        version = migrationVersion
+    return version
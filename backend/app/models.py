@@ -1,6 +1,55 @@
 from pydantic import BaseModel
-from datetime import date
-from typing import Optional
+from datetime import date, timedelta
+from typing import Optional, List
+
+# Dates of loans are stored as day numbers: the number of days since 1970-01-01, which is Julian day 2440587.5.
+EPOCH = date(1970, 1, 1)
+EPOCH_JULIAN_DAY = 2440587.5
+
+def to_day_number(value: date):
+    """
+    Convert a date received by the API to the day number stored in the database.
+    Parameters:
+        value (date): The date, or None.
+    Returns:
+        day (int): The number of days since 1970-01-01, or None.
+    """
+    return None if value is None else (value - EPOCH).days
+
+def from_day_number(day: int):
+    """
+    Convert a day number read from the database to the date sent by the API.
+    Parameters:
+        day (int): The number of days since 1970-01-01, or None.
+    Returns:
+        value (date): The date, or None.
+    """
+    return None if day is None else EPOCH + timedelta(days=day)
+
+def dates_to_iso(row, fields: tuple = ("start_date", "end_date")):
+    """
+    Convert a row read from the database to the dictionary sent by the API, turning its day numbers into ISO 8601 dates.
+    Parameters:
+        row (sqlite3.Row): The row, with day numbers in the given fields.
+        fields (tuple): The names of the fields holding day numbers.
+    Returns:
+        row (dict): The row as a dictionary, with text such as 2024-03-01 in the given fields.
+    """
+    row = dict(row)
+    for field in fields:
+        day = from_day_number(row[field])
+        row[field] = None if day is None else day.isoformat()
+    return row
+
+def iso_date(column: str):
+    """
+    Build the SQL expression converting a day number column to an ISO 8601 date, for rows serialised inside the query.
+    Parameters:
+        column (str): The column or expression holding the day number.
+    Returns:
+        expression (str): The date() call, giving text such as 2024-03-01.
+    """
+    return f"date({column} + {EPOCH_JULIAN_DAY})"
 
 class BookBase(BaseModel):
     """
@@ -58,6 +107,20 @@ class AllocationBase(BaseModel):
     start_date: date
     end_date: date
 
+    @property
+    def start_day(self):
+        """
+        The start date as the day number stored in the database.
+        """
+        return to_day_number(self.start_date)
+
+    @property
+    def end_day(self):
+        """
+        The end date as the day number stored in the database.
+        """
+        return to_day_number(self.end_date)
+
 class Allocation(AllocationBase):
     """
     Model for an allocation with an ID, returned status, and overdue status.
@@ -69,3 +132,27 @@ class Allocation(AllocationBase):
     id: int
     returned: bool = False
     overdue: bool = False
+
+class BatchLookup(BaseModel):
+    """
+    Model for a batch lookup by ID.
+    Attributes:
+        ids (List[int]): The IDs to look up.
+    """
+    ids: List[int]
+
+class AllocationBatch(BaseModel):
+    """
+    Model for a batch checkout of several allocations.
+    Attributes:
+        allocations (List[Allocation]): The allocations to add.
+    """
+    allocations: List[Allocation]
+
+class ReturnBatch(BaseModel):
+    """
+    Model for a batch return of several allocations.
+    Attributes:
+        ids (List[int]): The IDs of the allocations to return.
+    """
+    ids: List[int]
@@ -0,0 +1,76 @@
+from fastapi.responses import Response
+from app.responses import ORJSONResponse
+from app.config import settings
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def page_bounds(after: int, limit: int):
+    """
+    Validate the keyset pagination parameters of a list request.
+    Parameters:
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The requested number of rows.
+    Returns:
+        bounds (tuple): The cursor and the page size, capped to the configured maximum.
+    Raises:
+        ValueError: If the cursor is negative or the limit is not a positive integer.
+    """
+    if(after < 0):
+        raise ValueError("Cursor must be a non-negative integer")
+    if(limit <= 0):
+        raise ValueError("Limit must be a positive integer")
+    return after, min(limit, settings.page_size_max)
+
+def to_page(rows: list, limit: int):
+    """
+    Turn the rows fetched for a page into the page items and the cursor of the next page.
+    The query is expected to fetch one row more than the page size, which tells whether a next page exists without a separate count.
+    Parameters:
+        rows (list): Up to limit + 1 rows ordered by ID.
+        limit (int): The page size.
+    Returns:
+        page (tuple): The list of row dictionaries and the ID to pass as the next cursor, or None on the last page.
+    """
+    items = [dict(row) for row in rows[:limit]]
+    nextCursor = items[-1]["id"] if len(rows) > limit else None
+    return items, nextCursor
+
+def json_object(fields: dict):
+    """
+    Build a SQLite json_object() expression that serialises a row to JSON text inside the query.
+    Parameters:
+        fields (dict): The JSON keys mapped to the SQL expressions of their values, in output order.
+    Returns:
+        expression (str): The json_object() call.
+    """
+    pairs = ", ".join(f"'{key}', {expression}" for key, expression in fields.items())
+    return f"json_object({pairs})"
+
+def to_json_page(rows: list, limit: int):
+    """
+    Turn rows serialised by SQLite into the encoded body of a page and the cursor of the next page.
+    The rows are joined into a JSON array as they are, so no dictionary is built per row.
+    Parameters:
+        rows (list): Up to limit + 1 tuples of a row ID and the JSON text of the row, ordered by ID.
+        limit (int): The page size.
+    Returns:
+        page (tuple): The JSON array of the rows as bytes and the ID to pass as the next cursor, or None on the last page.
+    """
+    body = f"[{','.join(row[1] for row in rows[:limit])}]".encode()
+    nextCursor = rows[limit - 1][0] if len(rows) > limit else None
+    return body, nextCursor
+
+def paginated_response(items, nextCursor):
+    """
+    Build the response for a page of a list endpoint.
+    The body is the list of items; the cursor of the next page, if any, is sent in the X-Next-Cursor header.
+    Parameters:
+        items (list | bytes): The rows of the page, or their JSON array already encoded by to_json_page().
+        nextCursor (int): The cursor of the next page, or None on the last page.
+    Returns:
+        response (Response): The response with status 200.
+    """
+    headers = {NEXT_CURSOR_HEADER: str(nextCursor)} if nextCursor is not None else None
+    if(isinstance(items, bytes)):
+        return Response(content=items, status_code=200, headers=headers, media_type="application/json")
+    return ORJSONResponse(content=items, status_code=200, headers=headers)
@@ -0,0 +1,136 @@
+from fastapi.responses import JSONResponse
+import gzip
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class ORJSONResponse(JSONResponse):
+    """
+    A JSON response encoded with orjson, which serialises large lists several times faster than the standard library encoder.
+    Integer dictionary keys are written as strings, as the standard encoder does. Falls back to the standard encoder if orjson is not installed.
+    """
+    def render(self, content) -> bytes:
+        if(orjson is None):
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses response bodies with brotli or gzip, as accepted by the client.
+    Only complete bodies of at least the minimum size are compressed; streamed, already encoded and small responses pass through unchanged.
+    Every complete body that is not already encoded is sent with Vary: Accept-Encoding, compressed or not, so a shared cache never serves one coding to a client that asked for another.
+    Brotli is used when the brotli package is installed and the client accepts it. A strong ETag of a compressed body is marked weak, since the bytes differ from the identity representation; If-None-Match still matches it by weak comparison.
+    Attributes:
+        minimum_size (int): The smallest body, in bytes, that is compressed.
+    """
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _choose_encoding(self, scope):
+        """
+        Pick the content coding for a request from its Accept-Encoding header.
+        Parameters:
+            scope (dict): The ASGI scope of the request.
+        Returns:
+            encoding (str): "br", "gzip", or None if the client accepts neither.
+        """
+        header = dict(scope.get("headers", [])).get(b"accept-encoding", b"").decode("latin-1")
+        accepted = set()
+        for coding in header.split(","):
+            name, _, params = coding.strip().partition(";")
+            if(params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")):
+                accepted.add(name.strip().lower())
+        if(brotli is not None and "br" in accepted):
+            return "br"
+        if("gzip" in accepted):
+            return "gzip"
+        return None
+
+    def _compress(self, body: bytes, encoding: str):
+        """
+        Compress a body with the given content coding.
+        Parameters:
+            body (bytes): The response body.
+            encoding (str): "br" or "gzip".
+        Returns:
+            compressed (bytes): The compressed body.
+        """
+        if(encoding == "br"):
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def _vary(self, headers: list):
+        """
+        Add Accept-Encoding to the Vary header of a response.
+        Parameters:
+            headers (list): The raw (name, value) headers of the response.
+        Returns:
+            headers (list): The headers with Accept-Encoding appended to Vary, or a Vary header added.
+        """
+        varied = []
+        found = False
+        for name, value in headers:
+            if(name.lower() == b"vary"):
+                value += b", Accept-Encoding"
+                found = True
+            varied.append((name, value))
+        if(not found):
+            varied.append((b"vary", b"Accept-Encoding"))
+        return varied
+
+    async def __call__(self, scope, receive, send):
+        if(scope["type"] != "http"):
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self._choose_encoding(scope)
+        start = None
+        passthrough = False
+
+        async def compressingSend(message):
+            nonlocal start, passthrough
+            if(message["type"] == "http.response.start"):
+                start = message
+                return
+            if(message["type"] != "http.response.body" or passthrough):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            names = {name.lower() for name, _ in start["headers"]}
+            if(message.get("more_body", False) or b"content-encoding" in names):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            if(encoding is None or len(body) < self.minimum_size):
+                await send({**start, "headers": self._vary(start["headers"])})
+                await send(message)
+                return
+
+            compressed = self._compress(body, encoding)
+            headers = []
+            for name, value in start["headers"]:
+                name = name.lower()
+                if(name == b"content-length"):
+                    continue
+                if(name == b"etag" and not value.startswith(b"W/")):
+                    value = b"W/" + value
+                headers.append((name, value))
+            headers = self._vary(headers)
+            headers.append((b"content-encoding", encoding.encode()))
+            headers.append((b"content-length", str(len(compressed)).encode()))
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, compressingSend)
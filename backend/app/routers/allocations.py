@@ -1,75 +1,102 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from app.models import Allocation
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from app.responses import ORJSONResponse
+from app.models import Allocation, AllocationBatch, ReturnBatch
+from typing import Optional
+from datetime import date
 import app.data_logic.allocations_data_logic as allocation_crud
+from app.database import get_db_connection, run_db, iterate_db
+from app.config import settings
+from app.pagination import paginated_response
+from app.etags import make_etag, request_variant, is_not_modified, not_modified_response, with_etag
+from app.errors import ConflictError
+from app.write_queue import allocation_write_queue, get_write_connection
 import sqlite3
 
 router = APIRouter(tags=["Allocations"])
 
 @router.get("/")
-def getAllocations() -> list:
+async def getAllocations(request: Request, after: int = 0, limit: int = settings.page_size_default, book_id: Optional[int] = None, member_id: Optional[int] = None,
+        book: Optional[int] = None, member: Optional[int] = None, returned: Optional[bool] = None, overdue: Optional[bool] = None,
+        start_from: Optional[date] = None, start_to: Optional[date] = None, end_from: Optional[date] = None, end_to: Optional[date] = None,
+        conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve all allocations from the database.
-    Calls the get_all_allocation function from the allocation_crud module to fetch all allocations and returns the result.
+    Retrieve a page of allocations from the database.
+    Calls the get_all_allocation function from the allocation_crud module to fetch the page after the given cursor and returns it, with the cursor of the next page in the X-Next-Cursor header.
+    The filters are applied in the SQL query, so only matching allocations are read and sent.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
     Parameters:
-        None
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+        book_id (int): Only return allocations of this book; book is accepted as an alias.
+        member_id (int): Only return allocations to this member; member is accepted as an alias.
+        returned (bool): Only return allocations with this returned status.
+        overdue (bool): Only return allocations with this overdue status.
+        start_from (date): Only return allocations starting on or after this date.
+        start_to (date): Only return allocations starting on or before this date.
+        end_from (date): Only return allocations ending on or after this date.
+        end_to (date): Only return allocations ending on or before this date.
     Returns:
         allocations (list): A list of dictionaries, each representing an allocation.
     Raises:
+        HTTPException (400): If the cursor or the limit is invalid.
         HTTPException (500): If any error occurs during fetching of allocations.
     """
     try:
-        allocations = allocation_crud.get_all_allocation()
-        return JSONResponse(content=allocations, status_code=200)
+        etag = await run_db(make_etag, conn, ("Allocations",), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        allocations, nextCursor = await run_db(allocation_crud.get_all_allocation,
+            conn, after, limit, book_id=book_id if book_id is not None else book, member_id=member_id if member_id is not None else member,
+            returned=returned, overdue=overdue, start_from=start_from, start_to=start_to, end_from=end_from, end_to=end_to)
+        return with_etag(paginated_response(allocations, nextCursor), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
     except sqlite3.Error as databaseError:
         raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
-@router.get("/{allocation_id}")
-def getAllocation(allocation_id: str) -> dict:
+@router.post("/batch")
+async def addAllocationsBatch(batch: AllocationBatch, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve a specific allocation from the database by its ID.
-    Calls the get_allocation function from the allocation_crud module to fetch the allocation with the given ID and returns the result.
+    Check out several books in one request.
+    Calls the add_allocations function from the allocation_crud module to add all the allocations in a single transaction and returns the outcome of each item.
     Parameters:
-        allocation_id (str): The ID of the allocation to retrieve.
+        batch (AllocationBatch): An instance of the AllocationBatch class containing the allocations' details.
     Returns:
-        allocation (dict): A dictionary representing the allocation.
+        outcomes (list): One dictionary per item in request order, with its index, its status, and the new allocation ID or an error message.
     Raises:
-        HTTPException (400): If the allocation ID is not a positive integer.
-        HTTPException (404): If the allocation is not found.
-        HTTPException (500): If any error occurs during fetching of the allocation.
+        HTTPException (400): If too many allocations are given.
+        HTTPException (500): If any error occurs during adding of the allocations; none of them is added.
     """
     try:
-        if(not allocation_id.isdigit()):
-            raise ValueError("Allocation ID must be a positive integer")
-        allocation = allocation_crud.get_allocation(int(allocation_id))
-        return JSONResponse(content=allocation, status_code=200)
+        outcomes = await run_db(allocation_crud.add_allocations, conn, batch.allocations)
+        return ORJSONResponse(content=outcomes, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
-    except KeyError as allocationNotFound:
-        raise HTTPException(status_code=404, detail=str(allocationNotFound))
     except sqlite3.Error as databaseError:
         raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
-@router.get("/?book={book_id}")
-def getAllocationsOfBook(book_id: int) -> list:
+@router.post("/batch/return")
+async def returnAllocationsBatch(batch: ReturnBatch, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve all allocations for a specific book from the database.
-    Calls the get_allocations_of_book function from the allocation_crud module to fetch all allocations for the given book ID and returns the result.
+    Return several books in one request.
+    Calls the delete_allocations function from the allocation_crud module to return all the allocations in a single transaction and returns the outcome of each ID.
     Parameters:
-        book_id (str): The ID of the book to retrieve allocations for.
+        batch (ReturnBatch): An instance of the ReturnBatch class containing the allocation IDs.
     Returns:
-        allocations (list): A list of dictionaries, each representing an allocation.
+        outcomes (list): One dictionary per distinct ID in request order, with the ID, its status, and an error message if it failed.
     Raises:
-        HTTPException (400): If the book ID is not a positive integer.
-        HTTPException (500): If any error occurs during fetching of allocations.
+        HTTPException (400): If too many IDs are given.
+        HTTPException (500): If any error occurs during returning of the allocations; none of them is returned.
     """
     try:
-        allocations = allocation_crud.get_allocations_of_book(book_id)
-        return JSONResponse(content=allocations, status_code=200)
+        outcomes = await run_db(allocation_crud.delete_allocations, conn, batch.ids)
+        return ORJSONResponse(content=outcomes, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except sqlite3.Error as databaseError:
@@ -77,24 +104,31 @@ def getAllocationsOfBook(book_id: int) -> list:
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
-@router.get("/?member={member_id}")
-def getAllocationsOfMember(member_id) -> list:
+@router.get("/overdue")
+async def getOverdueAllocations(request: Request, due_before: Optional[date] = None, due_within_days: Optional[int] = None,
+        conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve all allocations for a specific member from the database.
-    Calls the get_allocations_of_member function from the allocation_crud module to fetch all allocations for the given member ID and returns the result.
+    Retrieve the open allocations that are overdue, or due before a date, with the names of their book and member.
+    Calls the get_overdue_allocations function from the allocation_crud module, which reads the matching loans with one range query on an index, and streams the JSON array as it is read.
+    Sends a strong ETag derived from the change counters of the tables read and the current date, which the default cutoff depends on, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
     Parameters:
-        member_id (str): The ID of the member to retrieve allocations for.
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        due_before (date): Return the open allocations ending before this date instead of before today.
+        due_within_days (int): Return the open allocations already overdue or ending within this many days instead.
     Returns:
-        allocations (list): A list of dictionaries, each representing an allocation.
+        allocations (list): A list of dictionaries with each allocation's ID, book ID and name, member ID and name, start date and end date, earliest end date first.
     Raises:
-        HTTPException (400): If the member ID is not a positive integer.
-        HTTPException (404): If the member is not found.
-        HTTPException (500): If any error occurs during fetching of allocations.
+        HTTPException (400): If both cutoffs are given or the number of days is negative.
+        HTTPException (500): If any error occurs during fetching of the allocations.
     """
     try:
-        print(member_id, type(member_id))
-        allocations = allocation_crud.get_allocations_of_member(member_id)
-        return JSONResponse(content=allocations, status_code=200)
+        today = date.today()
+        etag = await run_db(make_etag, conn, ("Allocations", "Books", "Members"), f"{request_variant(request)}@{today.isoformat()}")
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        chunks = allocation_crud.get_overdue_allocations(conn, today, due_before, due_within_days)
+        first = await run_db(next, chunks)
+        return with_etag(StreamingResponse(iterate_db(chunks, first), media_type="application/json"), etag)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except sqlite3.Error as databaseError:
@@ -102,24 +136,30 @@ def getAllocationsOfMember(member_id) -> list:
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
-@router.get("/?book={book_id}&member={member_id}")
-def getAllocationByBookAndMember(book_id: str, member_id: str) -> dict:
+@router.get("/{allocation_id}")
+async def getAllocation(request: Request, allocation_id: str, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
-    Retrieve a specific allocation for a book and member from the database.
-    Calls the get_allocation_by_book_and_member function from the allocation_crud module to fetch the allocation with the given book ID and member ID and returns the result.
+    Retrieve a specific allocation from the database by its ID.
+    Calls the get_allocation function from the allocation_crud module to fetch the allocation with the given ID and returns the result.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
     Parameters:
-        book_id (str): The ID of the book.
-        member_id (str): The ID of the member.
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        allocation_id (str): The ID of the allocation to retrieve.
     Returns:
         allocation (dict): A dictionary representing the allocation.
     Raises:
-        HTTPException (400): If the book ID or member ID is not a positive integer.
+        HTTPException (400): If the allocation ID is not a positive integer.
         HTTPException (404): If the allocation is not found.
         HTTPException (500): If any error occurs during fetching of the allocation.
     """
     try:
-        allocation = allocation_crud.get_allocation_by_book_and_member(int(book_id), int(member_id))
-        return JSONResponse(content=allocation, status_code=200)
+        if(not allocation_id.isdigit()):
+            raise ValueError("Allocation ID must be a positive integer")
+        etag = await run_db(make_etag, conn, ("Allocations",), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        allocation = await run_db(allocation_crud.get_allocation, conn, int(allocation_id))
+        return with_etag(ORJSONResponse(content=allocation, status_code=200), etag)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as allocationNotFound:
@@ -130,21 +170,31 @@ def getAllocationByBookAndMember(book_id: str, member_id: str) -> dict:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
 @router.post("/")
-def addAllocation(allocation: Allocation) -> dict:
+async def addAllocation(allocation: Allocation, conn: sqlite3.Connection = Depends(get_write_connection)) -> dict:
     """
     Add a new allocation to the database.
-    Calls the add_allocation function from the allocation_crud module to add the allocation's details to the database.
+    Calls the add_allocation function from the allocation_crud module to claim a copy of the book and add the allocation's details to the database in one transaction.
+    If the allocation write queue is enabled, the checkout is committed together with other queued writes instead, and the request holds no pooled connection.
     Parameters:
         allocation (Allocation): An instance of the Allocation class containing the allocation's details.
     Returns:
         msg (dict): A success message.
     Raises:
         HTTPException (400): If there is an integrity error.
+        HTTPException (404): If the book is not found.
+        HTTPException (409): If every copy of the book is allocated.
         HTTPException (500): If any error occurs during adding of the allocation.
     """
     try:
-        allocation_crud.add_allocation(allocation)
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        if(allocation_write_queue.enabled):
+            await allocation_write_queue.run(allocation_crud.apply_add_allocation, allocation)
+        else:
+            await run_db(allocation_crud.add_allocation, conn, allocation)
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
+    except KeyError as bookNotFound:
+        raise HTTPException(status_code=404, detail=str(bookNotFound))
+    except ConflictError as conflictError:
+        raise HTTPException(status_code=409, detail=str(conflictError))
     except sqlite3.IntegrityError as duplicateError:
         raise HTTPException(status_code=400, detail=f"Integrity error: {duplicateError}")
     except sqlite3.Error as databaseError:
@@ -153,7 +203,7 @@ def addAllocation(allocation: Allocation) -> dict:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
 @router.put("/{allocation_id}")
-def editAllocation(allocation_id: str, allocation: Allocation) -> dict:
+async def editAllocation(allocation_id: str, allocation: Allocation, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
     Edit an existing allocation's details in the database.
     Calls the edit_allocation function from the allocation_crud module to modify the allocation's details in the database.
@@ -168,8 +218,8 @@ def editAllocation(allocation_id: str, allocation: Allocation) -> dict:
         HTTPException (500): If any error occurs during editing of the allocation.
     """
     try:
-        allocation_crud.edit_allocation(int(allocation_id), allocation)
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        await run_db(allocation_crud.edit_allocation, conn, int(allocation_id), allocation)
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as allocationNotFound:
@@ -180,10 +230,11 @@ def editAllocation(allocation_id: str, allocation: Allocation) -> dict:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
 @router.delete("/{allocation_id}")
-def deleteAllocation(allocation_id: str) -> dict:
+async def deleteAllocation(allocation_id: str, conn: sqlite3.Connection = Depends(get_write_connection)) -> dict:
     """
     Delete an allocation from the database by its ID.
     Calls the delete_allocation function from the allocation_crud module to remove the allocation with the given ID from the database.
+    If the allocation write queue is enabled, the return is committed together with other queued writes instead, and the request holds no pooled connection.
     Parameters:
         allocation_id (str): The ID of the allocation to delete.
     Returns:
@@ -194,8 +245,11 @@ def deleteAllocation(allocation_id: str) -> dict:
         HTTPException (500): If any error occurs during deleting of the allocation.
     """
     try:
-        allocation_crud.delete_allocation(int(allocation_id))
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        if(allocation_write_queue.enabled):
+            await allocation_write_queue.run(allocation_crud.apply_delete_allocation, int(allocation_id))
+        else:
+            await run_db(allocation_crud.delete_allocation, conn, int(allocation_id))
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as allocationNotFound:
@@ -1,75 +1,180 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from app.models import Book
+from fastapi import APIRouter, HTTPException, Depends, Request
+from app.responses import ORJSONResponse
+from app.models import Book, BatchLookup
 import app.data_logic.books_data_logic as book_crud
+from app.database import get_db_connection, run_db
+from typing import Optional
+from app.config import settings
+from app.pagination import paginated_response
+from app.etags import make_etag, request_variant, is_not_modified, not_modified_response, with_etag
+from app.bulk_import import CSV_CONTENT_TYPES, NDJSON_CONTENT_TYPES, iter_row_batches
 import sqlite3
 
 router = APIRouter(tags=["Books"])
 
 @router.get("/")
-def getBooks() -> list:
+async def getBooks(request: Request, after: int = 0, limit: int = settings.page_size_default, name: Optional[str] = None, author: Optional[str] = None, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve all books from the database.
-    Calls the get_all_books function from the book_crud module to fetch all books and returns the result.
+    Retrieve a page of books from the database.
+    Calls the get_all_books function from the book_crud module to fetch the page after the given cursor and returns it, with the cursor of the next page in the X-Next-Cursor header.
+    The filters are applied in the SQL query, so only matching rows are read and sent.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
     Parameters:
-        None
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+        name (str): Only return books with exactly this name.
+        author (str): Only return books by exactly this author.
     Returns:
         books (list): A list of dictionaries, each representing a book.
     Raises:
+        HTTPException (400): If the cursor or the limit is invalid.
         HTTPException (500): If any error occurs during fetching of books.
     """
     try:
-        books = book_crud.get_all_books()
-        return JSONResponse(content=books, status_code=200)
+        etag = await run_db(make_etag, conn, ("Books",), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        books, nextCursor = await run_db(book_crud.get_all_books, conn, after, limit, name=name, author=author)
+        return with_etag(paginated_response(books, nextCursor), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
     except sqlite3.Error as databaseError:
         raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
-@router.get("/{book_id}")
-def getBook(book_id: str) -> dict:
+@router.get("/search")
+async def searchBooks(request: Request, q: str, offset: int = 0, limit: int = settings.page_size_default, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve a specific book from the database by its ID.
-    Calls the get_book function from the book_crud module to fetch the book with the given ID and returns the result.
+    Search the books by the words of their name and author.
+    Calls the search_books function from the book_crud module to fetch the best matches for the query and returns them, with the offset of the next page in the X-Next-Cursor header.
+    Every word of the query must match the start of a word in the name or author, so the endpoint can back a search box as the user types.
+    Sends a strong ETag derived from the change counter of Books, and answers 304 Not Modified without searching when If-None-Match matches it.
     Parameters:
-        book_id (str): The ID of the book to retrieve.
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        q (str): The search text, e.g. "lord ring".
+        offset (int): The number of matches to skip, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
     Returns:
-        book (dict): A dictionary representing the book.
+        books (list): A list of dictionaries, each representing a book, best match first.
     Raises:
-        HTTPException (400): If the book ID is not a positive integer.
-        HTTPException (404): If the book is not found.
-        HTTPException (500): If any error occurs during fetching of the book.
+        HTTPException (400): If the query contains no word, or the offset or the limit is invalid.
+        HTTPException (500): If any error occurs during the search.
     """
     try:
-        if(not book_id.isdigit()):
-            raise ValueError("Book ID is not a number")
-        book = book_crud.get_book(int(book_id))
-        return JSONResponse(content=book, status_code=200)
+        etag = await run_db(make_etag, conn, ("Books",), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        books, nextOffset = await run_db(book_crud.search_books, conn, q, offset, limit)
+        return with_etag(paginated_response(books, nextOffset), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.get("/suggest")
+async def suggestBooks(prefix: str, limit: int = settings.suggest_limit_default, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
+    """
+    Suggest books whose name starts with the given prefix, ignoring case.
+    Calls the suggest_books function from the book_crud module to fetch the first matches in name order and returns them, so a picker can look books up as the user types instead of loading every book.
+    Parameters:
+        prefix (str): The beginning of the name, e.g. "jo".
+        limit (int): The number of matches to return, capped to the configured maximum.
+    Returns:
+        books (list): A list of dictionaries with the ID, name and author of each matching book.
+    Raises:
+        HTTPException (400): If the prefix is empty or the limit is invalid.
+        HTTPException (500): If any error occurs during fetching of the suggestions.
+    """
+    try:
+        books = await run_db(book_crud.suggest_books, conn, prefix, limit)
+        return ORJSONResponse(content=books, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
-    except KeyError as bookNotFound:
-        raise HTTPException(status_code=404, detail=str(bookNotFound))
     except sqlite3.Error as databaseError:
         raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
-@router.get("/?name={book_name}")
-def getBookByName(book_name: str) -> dict:
+@router.get("/batch")
+async def getBooksBatch(ids: str, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
-    Retrieve a specific book from the database by its name.
-    Calls the get_book_by_name function from the book_crud module to fetch the book with the given name and returns the result.
+    Retrieve several books from the database by their IDs in one request.
+    Calls the get_books_by_ids function from the book_crud module to fetch all the books with a single query per chunk of IDs and returns them keyed by ID.
     Parameters:
-        book_name (str): The name of the book to retrieve.
+        ids (str): A comma-separated list of book IDs, e.g. 1,2,3.
+    Returns:
+        lookup (dict): The found books under items, keyed by ID, and the IDs that were not found under missing.
+    Raises:
+        HTTPException (400): If an ID is not a number or too many IDs are given.
+        HTTPException (500): If any error occurs during fetching of the books.
+    """
+    try:
+        bookIds = [int(bookId) for bookId in ids.split(",") if bookId.strip()]
+        found, missing = await run_db(book_crud.get_books_by_ids, conn, bookIds)
+        return ORJSONResponse(content={"items": found, "missing": missing}, status_code=200)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.post("/batch")
+async def lookupBooksBatch(lookup: BatchLookup, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Retrieve several books from the database by the IDs given in the request body.
+    The POST variant of the batch lookup, for ID sets too large for a query string.
+    Parameters:
+        lookup (BatchLookup): An instance of the BatchLookup class containing the book IDs.
+    Returns:
+        lookup (dict): The found books under items, keyed by ID, and the IDs that were not found under missing.
+    Raises:
+        HTTPException (400): If too many IDs are given.
+        HTTPException (500): If any error occurs during fetching of the books.
+    """
+    try:
+        found, missing = await run_db(book_crud.get_books_by_ids, conn, lookup.ids)
+        return ORJSONResponse(content={"items": found, "missing": missing}, status_code=200)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.get("/{book_id}")
+async def getBook(request: Request, book_id: str, include: Optional[str] = None, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Retrieve a specific book from the database by its ID.
+    Calls the get_book function from the book_crud module to fetch the book with the given ID and returns the result.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
+    Parameters:
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        book_id (str): The ID of the book to retrieve.
+        include (str): "allocations" to embed the current allocations of the book with the names of their counterparts, so clients need no further lookups.
     Returns:
         book (dict): A dictionary representing the book.
     Raises:
+        HTTPException (400): If the book ID is not a positive integer or include is not "allocations".
         HTTPException (404): If the book is not found.
         HTTPException (500): If any error occurs during fetching of the book.
     """
     try:
-        book = book_crud.get_book_by_name(book_name)
-        return JSONResponse(content=book, status_code=200)
+        if(not book_id.isdigit()):
+            raise ValueError("Book ID is not a number")
+        if(include not in (None, "allocations")):
+            raise ValueError(f"Cannot include {include}")
+        etag = await run_db(make_etag, conn, ("Books", "Allocations", "Members") if include == "allocations" else ("Books",), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        book = await run_db(book_crud.get_book, conn, int(book_id), include_allocations=include == "allocations")
+        return with_etag(ORJSONResponse(content=book, status_code=200), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as bookNotFound:
         raise HTTPException(status_code=404, detail=str(bookNotFound))
     except sqlite3.Error as databaseError:
@@ -78,7 +183,7 @@ def getBookByName(book_name: str) -> dict:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
 @router.post("/")
-def addBook(book: Book) -> dict:
+async def addBook(book: Book, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
     Add a new book to the database.
     Calls the add_book function from the book_crud module to add the book's details to the database.
@@ -91,8 +196,8 @@ def addBook(book: Book) -> dict:
         HTTPException (500): If any error occurs during adding of the book.
     """
     try:
-        book_crud.add_book(book)
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        await run_db(book_crud.add_book, conn, book)
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
     except sqlite3.IntegrityError as duplicateError:
         raise HTTPException(status_code=400, detail=f"Integrity error: {duplicateError}")
     except sqlite3.Error as databaseError:
@@ -100,8 +205,44 @@ def addBook(book: Book) -> dict:
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
+@router.post("/import")
+async def importBooks(request: Request, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Add many books to the database from a streamed CSV or NDJSON request body.
+    Parses the body as it arrives and calls the import_books function from the book_crud module once per batch of rows, so each batch is validated and inserted in a single transaction.
+    CSV bodies (text/csv) start with a header row naming the columns; NDJSON bodies (application/x-ndjson) hold one JSON object per line.
+    Parameters:
+        request (Request): The request whose body holds the books.
+    Returns:
+        report (dict): The number of books inserted and failed, and the errors, each with the 1-based row number and a message.
+    Raises:
+        HTTPException (400): If the body cannot be decoded or a CSV body has no header row.
+        HTTPException (415): If the content type is neither CSV nor NDJSON.
+        HTTPException (500): If any error occurs during adding of the books.
+    """
+    try:
+        contentType = request.headers.get("content-type", "").split(";")[0].strip()
+        if(contentType not in CSV_CONTENT_TYPES | NDJSON_CONTENT_TYPES):
+            raise HTTPException(status_code=415, detail=f"Unsupported content type {contentType}, expected text/csv or application/x-ndjson")
+
+        inserted = 0
+        errors = []
+        async for batch in iter_row_batches(request.stream(), contentType, settings.import_batch_size):
+            batchInserted, batchErrors = await run_db(book_crud.import_books, conn, batch)
+            inserted += batchInserted
+            errors += batchErrors
+        return ORJSONResponse(content={"inserted": inserted, "failed": len(errors), "errors": errors}, status_code=200)
+    except HTTPException:
+        raise
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
 @router.put("/{book_id}")
-def editBook(book_id: str, book: Book) -> dict:
+async def editBook(book_id: str, book: Book, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
     Edit an existing book's details in the database.
     Calls the edit_book function from the book_crud module to modify the book's details in the database.
@@ -116,8 +257,8 @@ def editBook(book_id: str, book: Book) -> dict:
         HTTPException (500): If any error occurs during editing of the book.
     """
     try:
-        book_crud.edit_book(int(book_id), book)
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        await run_db(book_crud.edit_book, conn, int(book_id), book)
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as bookNotFound:
@@ -128,7 +269,7 @@ def editBook(book_id: str, book: Book) -> dict:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
 @router.delete("/{book_id}")
-def deleteBook(book_id: str) -> dict:
+async def deleteBook(book_id: str, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
     Delete a book from the database by its ID.
     Calls the delete_book function from the book_crud module to remove the book with the given ID from the database.
@@ -142,8 +283,8 @@ def deleteBook(book_id: str) -> dict:
         HTTPException (500): If any error occurs during deleting of the book.
     """
     try:
-        book_crud.delete_book(int(book_id))
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        await run_db(book_crud.delete_book, conn, int(book_id))
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as bookNotFound:
@@ -1,27 +1,58 @@
-
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Request
 from fastapi.exceptions import HTTPException
 import app.data_logic.history_data_logic as history_crud
+from typing import Optional
+from datetime import date
+from app.database import get_db_connection, run_db
+from app.config import settings
+from app.pagination import paginated_response
+from app.etags import make_etag, request_variant, is_not_modified, not_modified_response, with_etag
 import sqlite3
 
 router = APIRouter(tags=["History"])
 
 @router.get("/")
-def getAllocations() -> list:
+async def getAllocations(request: Request, after: int = 0, limit: int = settings.page_size_default, book_id: Optional[int] = None, book_name: Optional[str] = None, member_id: Optional[int] = None,
+        returned: Optional[bool] = None, overdue: Optional[bool] = None, start_from: Optional[date] = None, start_to: Optional[date] = None,
+        end_from: Optional[date] = None, end_to: Optional[date] = None, expand: Optional[str] = None, order: str = "asc", conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve all allocations history from the database.
-    Calls the get_history function from the history_crud module to fetch all historic allocations and returns the result.
+    Retrieve a page of allocations history from the database.
+    Calls the get_history function from the history_crud module to fetch the page after the given cursor and returns it, with the cursor of the next page in the X-Next-Cursor header.
+    Pages run from the oldest loan by default, or from the newest with order=desc.
+    The filters are applied in the SQL query, so only matching allocations are read and sent.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
     Parameters:
-        None
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+        book_id (int): Only return allocations of this book.
+        book_name (str): Only return allocations of books whose name starts with this prefix, ignoring case.
+        member_id (int): Only return allocations to this member.
+        returned (bool): Only return allocations with this returned status.
+        overdue (bool): Only return allocations with this overdue status.
+        start_from (date): Only return allocations starting on or after this date.
+        start_to (date): Only return allocations starting on or before this date.
+        end_from (date): Only return allocations ending on or after this date.
+        end_to (date): Only return allocations ending on or before this date.
+        expand (str): A comma-separated list of related entities whose names are joined into each row, from "book" and "member", so clients do not look them up one by one.
+        order (str): "asc" for the oldest loans first, or "desc" for the newest loans first.
     Returns:
         history (list): A list of dictionaries, each representing a historic allocation.
     Raises:
+        HTTPException (400): If the cursor, the limit or the order is invalid, the book name prefix is empty, or an unknown entity is expanded.
         HTTPException (500): If any error occurs during fetching of historic allocations.
     """
     try:
-        history = history_crud.get_history()
-        return JSONResponse(content=history, status_code=200)
+        etag = await run_db(make_etag, conn, ("History", "Books", "Members") if expand or book_name is not None else ("History",), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        history, nextCursor = await run_db(history_crud.get_history,
+            conn, after, limit, book_id=book_id, book_name=book_name, member_id=member_id, returned=returned, overdue=overdue,
+            start_from=start_from, start_to=start_to, end_from=end_from, end_to=end_to,
+            expand={entity.strip() for entity in expand.split(",") if entity.strip()} if expand else frozenset(), order=order)
+        return with_etag(paginated_response(history, nextCursor), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
     except sqlite3.Error as databaseError:
         raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
     except Exception as exception:
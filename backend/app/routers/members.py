@@ -1,75 +1,149 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from app.models import Member
+from fastapi import APIRouter, HTTPException, Depends, Request
+from app.responses import ORJSONResponse
+from app.models import Member, BatchLookup
 import app.data_logic.members_data_logic as member_crud
+from app.database import get_db_connection, run_db
+from typing import Optional
+from app.config import settings
+from app.pagination import paginated_response
+from app.etags import make_etag, request_variant, is_not_modified, not_modified_response, with_etag
+from app.bulk_import import CSV_CONTENT_TYPES, NDJSON_CONTENT_TYPES, iter_row_batches
 import sqlite3
 
 router = APIRouter(tags=["Members"])
 
 @router.get("/")
-def getMembers() -> list:
+async def getMembers(request: Request, after: int = 0, limit: int = settings.page_size_default, name: Optional[str] = None, email: Optional[str] = None, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve all members from the database.
-    Calls the get_all_members function from the member_crud module to fetch all members and returns the result.
+    Retrieve a page of members from the database.
+    Calls the get_all_members function from the member_crud module to fetch the page after the given cursor and returns it, with the cursor of the next page in the X-Next-Cursor header.
+    The filters are applied in the SQL query, so only matching rows are read and sent.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
     Parameters:
-        None
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        after (int): The ID of the last row of the previous page, or 0 for the first page.
+        limit (int): The page size, capped to the configured maximum.
+        name (str): Only return members with exactly this name.
+        email (str): Only return the member with this email.
     Returns:
         members (list): A list of dictionaries, each representing a member.
     Raises:
+        HTTPException (400): If the cursor or the limit is invalid.
         HTTPException (500): If any error occurs during fetching of members.
     """
     try:
-        members = member_crud.get_all_members()
-        return JSONResponse(content=members, status_code=200)
+        etag = await run_db(make_etag, conn, ("Members",), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        members, nextCursor = await run_db(member_crud.get_all_members, conn, after, limit, name=name, email=email)
+        return with_etag(paginated_response(members, nextCursor), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
     except sqlite3.Error as databaseError:
         raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
-@router.get("/{member_id}")
-def getMember(member_id: str) -> dict:
+@router.get("/suggest")
+async def suggestMembers(prefix: str, limit: int = settings.suggest_limit_default, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
     """
-    Retrieve a specific member from the database by their ID.
-    Calls the get_member function from the member_crud module to fetch the member with the given ID and returns the result.
+    Suggest members whose name starts with the given prefix, ignoring case.
+    Calls the suggest_members function from the member_crud module to fetch the first matches in name order and returns them, so a picker can look members up as the user types instead of loading every member.
     Parameters:
-        member_id (str): The ID of the member to retrieve.
+        prefix (str): The beginning of the name, e.g. "jo".
+        limit (int): The number of matches to return, capped to the configured maximum.
     Returns:
-        member (dict): A dictionary representing the member.
+        members (list): A list of dictionaries with the ID, name, email and phone of each matching member.
     Raises:
-        HTTPException (400): If the member ID is not a positive integer.
-        HTTPException (404): If the member is not found.
-        HTTPException (500): If any error occurs during fetching of the member.
+        HTTPException (400): If the prefix is empty or the limit is invalid.
+        HTTPException (500): If any error occurs during fetching of the suggestions.
     """
     try:
-        if(not member_id.isdigit()):
-            raise ValueError("Member ID is not a number")
-        member = member_crud.get_member(int(member_id))
-        return JSONResponse(content=member, status_code=200)
+        members = await run_db(member_crud.suggest_members, conn, prefix, limit)
+        return ORJSONResponse(content=members, status_code=200)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.get("/batch")
+async def getMembersBatch(ids: str, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Retrieve several members from the database by their IDs in one request.
+    Calls the get_members_by_ids function from the member_crud module to fetch all the members with a single query per chunk of IDs and returns them keyed by ID.
+    Parameters:
+        ids (str): A comma-separated list of member IDs, e.g. 1,2,3.
+    Returns:
+        lookup (dict): The found members under items, keyed by ID, and the IDs that were not found under missing.
+    Raises:
+        HTTPException (400): If an ID is not a number or too many IDs are given.
+        HTTPException (500): If any error occurs during fetching of the members.
+    """
+    try:
+        memberIds = [int(memberId) for memberId in ids.split(",") if memberId.strip()]
+        found, missing = await run_db(member_crud.get_members_by_ids, conn, memberIds)
+        return ORJSONResponse(content={"items": found, "missing": missing}, status_code=200)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.post("/batch")
+async def lookupMembersBatch(lookup: BatchLookup, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Retrieve several members from the database by the IDs given in the request body.
+    The POST variant of the batch lookup, for ID sets too large for a query string.
+    Parameters:
+        lookup (BatchLookup): An instance of the BatchLookup class containing the member IDs.
+    Returns:
+        lookup (dict): The found members under items, keyed by ID, and the IDs that were not found under missing.
+    Raises:
+        HTTPException (400): If too many IDs are given.
+        HTTPException (500): If any error occurs during fetching of the members.
+    """
+    try:
+        found, missing = await run_db(member_crud.get_members_by_ids, conn, lookup.ids)
+        return ORJSONResponse(content={"items": found, "missing": missing}, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
-    except KeyError as memberNotFound:
-        raise HTTPException(status_code=404, detail=str(memberNotFound))
     except sqlite3.Error as databaseError:
         raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
-@router.get("/?name={member_name}")
-def getMemberByName(member_name: str) -> dict:
+@router.get("/{member_id}")
+async def getMember(request: Request, member_id: str, include: Optional[str] = None, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
-    Retrieve a specific member from the database by their name.
-    Calls the get_member_by_name function from the member_crud module to fetch the member with the given name and returns the result.
+    Retrieve a specific member from the database by their ID.
+    Calls the get_member function from the member_crud module to fetch the member with the given ID and returns the result.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
     Parameters:
-        member_name (str): The name of the member to retrieve.
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        member_id (str): The ID of the member to retrieve.
+        include (str): "allocations" to embed the current allocations of the member with the names of their counterparts, so clients need no further lookups.
     Returns:
         member (dict): A dictionary representing the member.
     Raises:
+        HTTPException (400): If the member ID is not a positive integer or include is not "allocations".
         HTTPException (404): If the member is not found.
         HTTPException (500): If any error occurs during fetching of the member.
     """
     try:
-        member = member_crud.get_member_by_name(member_name)
-        return JSONResponse(content=member, status_code=200)
+        if(not member_id.isdigit()):
+            raise ValueError("Member ID is not a number")
+        if(include not in (None, "allocations")):
+            raise ValueError(f"Cannot include {include}")
+        etag = await run_db(make_etag, conn, ("Members", "Allocations", "Books") if include == "allocations" else ("Members",), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        member = await run_db(member_crud.get_member, conn, int(member_id), include_allocations=include == "allocations")
+        return with_etag(ORJSONResponse(content=member, status_code=200), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as memberNotFound:
         raise HTTPException(status_code=404, detail=str(memberNotFound))
     except sqlite3.Error as databaseError:
@@ -78,7 +152,7 @@ def getMemberByName(member_name: str) -> dict:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
 @router.post("/")
-def addMember(member: Member) -> dict:
+async def addMember(member: Member, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
     Add a new member to the database.
     Calls the add_member function from the member_crud module to add the member's details to the database.
@@ -91,8 +165,8 @@ def addMember(member: Member) -> dict:
         HTTPException (500): If any error occurs during adding of the member.
     """
     try:
-        member_crud.add_member(member)
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        await run_db(member_crud.add_member, conn, member)
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
     except sqlite3.IntegrityError as duplicateError:
         raise HTTPException(status_code=400, detail=f"Integrity error: {duplicateError}")
     except sqlite3.Error as databaseError:
@@ -100,8 +174,44 @@ def addMember(member: Member) -> dict:
     except Exception as exception:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
+@router.post("/import")
+async def importMembers(request: Request, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Add many members to the database from a streamed CSV or NDJSON request body.
+    Parses the body as it arrives and calls the import_members function from the member_crud module once per batch of rows, so each batch is validated and inserted in a single transaction.
+    CSV bodies (text/csv) start with a header row naming the columns; NDJSON bodies (application/x-ndjson) hold one JSON object per line.
+    Parameters:
+        request (Request): The request whose body holds the members.
+    Returns:
+        report (dict): The number of members inserted and failed, and the errors, each with the 1-based row number and a message.
+    Raises:
+        HTTPException (400): If the body cannot be decoded or a CSV body has no header row.
+        HTTPException (415): If the content type is neither CSV nor NDJSON.
+        HTTPException (500): If any error occurs during adding of the members.
+    """
+    try:
+        contentType = request.headers.get("content-type", "").split(";")[0].strip()
+        if(contentType not in CSV_CONTENT_TYPES | NDJSON_CONTENT_TYPES):
+            raise HTTPException(status_code=415, detail=f"Unsupported content type {contentType}, expected text/csv or application/x-ndjson")
+
+        inserted = 0
+        errors = []
+        async for batch in iter_row_batches(request.stream(), contentType, settings.import_batch_size):
+            batchInserted, batchErrors = await run_db(member_crud.import_members, conn, batch)
+            inserted += batchInserted
+            errors += batchErrors
+        return ORJSONResponse(content={"inserted": inserted, "failed": len(errors), "errors": errors}, status_code=200)
+    except HTTPException:
+        raise
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
 @router.put("/{member_id}")
-def editMember(member_id: str, member: Member) -> dict:
+async def editMember(member_id: str, member: Member, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
     Edit an existing member's details in the database.
     Calls the edit_member function from the member_crud module to modify the member's details in the database.
@@ -116,8 +226,8 @@ def editMember(member_id: str, member: Member) -> dict:
         HTTPException (500): If any error occurs during editing of the member.
     """
     try:
-        member_crud.edit_member(int(member_id), member)
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        await run_db(member_crud.edit_member, conn, int(member_id), member)
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as memberNotFound:
@@ -128,7 +238,7 @@ def editMember(member_id: str, member: Member) -> dict:
         raise HTTPException(status_code=500, detail=f"Error: {exception}")
 
 @router.delete("/{member_id}")
-def deleteMember(member_id: str) -> dict:
+async def deleteMember(member_id: str, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
     """
     Delete a member from the database by their ID.
     Calls the delete_member function from the member_crud module to remove the member with the given ID from the database.
@@ -142,8 +252,8 @@ def deleteMember(member_id: str) -> dict:
         HTTPException (500): If any error occurs during deleting of the member.
     """
     try:
-        member_crud.delete_member(int(member_id))
-        return JSONResponse(content={"msg": "Success"}, status_code=200)
+        await run_db(member_crud.delete_member, conn, int(member_id))
+        return ORJSONResponse(content={"msg": "Success"}, status_code=200)
     except ValueError as valueError:
         raise HTTPException(status_code=400, detail=str(valueError))
     except KeyError as memberNotFound:
@@ -0,0 +1,87 @@
+from fastapi import APIRouter, HTTPException, Depends
+from app.responses import ORJSONResponse
+from app.database import pool, get_db_connection, get_engine_profile, DB_PATH
+from app.tasks import overdue_sweeper, history_archiver
+from app.cache import book_cache, member_cache
+from app.write_queue import allocation_write_queue
+import sqlite3
+
+router = APIRouter(tags=["Metrics"])
+
+@router.get("/pool")
+def getPoolMetrics() -> dict:
+    """
+    Retrieve the usage counters of the database connection pool.
+    Calls the metrics method of the connection pool and returns the result, so the pool size can be tuned.
+    Parameters:
+        None
+    Returns:
+        metrics (dict): The pool size, the open, idle and in-use connections, and the checkout, wait and timeout counters.
+    """
+    return ORJSONResponse(content=pool.metrics(), status_code=200)
+
+@router.get("/engine")
+def getEngineProfile(conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Retrieve the SQLite engine settings in effect.
+    Reads the configured pragmas back from a pooled connection, so the effective values can be compared with the configuration.
+    Parameters:
+        conn (sqlite3.Connection): A pooled connection to the database.
+    Returns:
+        profile (dict): The database path and the effective value of every configured pragma.
+    Raises:
+        HTTPException (500): If any error occurs during reading of the settings.
+    """
+    try:
+        profile = get_engine_profile(conn)
+        return ORJSONResponse(content={"db_path": str(DB_PATH), "pragmas": profile}, status_code=200)
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+
+@router.get("/overdue-sweeper")
+def getOverdueSweeperStatus() -> dict:
+    """
+    Retrieve the status of the background overdue sweeper.
+    Calls the status method of the sweeper and returns the result, so it can be checked that overdue flags are being kept up to date.
+    Parameters:
+        None
+    Returns:
+        status (dict): The interval, whether the sweeper is running, the time of the last run and the rows it touched.
+    """
+    return ORJSONResponse(content=overdue_sweeper.status(), status_code=200)
+
+@router.get("/history-archiver")
+def getHistoryArchiverStatus() -> dict:
+    """
+    Retrieve the status of the background history archiver.
+    Calls the status method of the archiver and returns the result, so it can be checked that old loans are being moved out of the History table.
+    Parameters:
+        None
+    Returns:
+        status (dict): The interval, horizon and archive path, whether the archiver is running, the time of the last run and the loans it moved.
+    """
+    return ORJSONResponse(content=history_archiver.status(), status_code=200)
+
+@router.get("/cache")
+def getCacheMetrics() -> dict:
+    """
+    Retrieve the counters of the book and member read caches.
+    Calls the stats method of each cache and returns the results, so the hit rate and the cache size can be tuned.
+    Parameters:
+        None
+    Returns:
+        metrics (dict): The stats of the book cache under books and of the member cache under members.
+    """
+    return ORJSONResponse(content={"books": book_cache.stats(), "members": member_cache.stats()}, status_code=200)
+
+@router.get("/write-queue")
+def getWriteQueueMetrics() -> dict:
+    """
+    Retrieve the counters of the allocation write queue.
+    Calls the metrics method of the queue and returns the result, so the batch size and delay can be tuned.
+    Parameters:
+        None
+    Returns:
+        metrics (dict): The configuration, the batch size distribution, the queue wait and the failure counters.
+    """
+    return ORJSONResponse(content=allocation_write_queue.metrics(), status_code=200)
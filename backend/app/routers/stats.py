@@ -0,0 +1,154 @@
+from fastapi import APIRouter, HTTPException, Depends, Request
+from app.responses import ORJSONResponse
+import app.data_logic.stats_data_logic as stats_crud
+from typing import Optional
+from datetime import date
+from app.database import get_db_connection, run_db
+from app.config import settings
+from app.etags import make_etag, request_variant, is_not_modified, not_modified_response, with_etag
+import sqlite3
+
+router = APIRouter(tags=["Stats"])
+
+@router.get("/books/top")
+async def getTopBooks(request: Request, by: str = "loans", limit: int = settings.stats_top_default, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
+    """
+    Retrieve the most borrowed books.
+    Calls the get_top_books function from the stats_crud module to read the top of the incrementally maintained book counters and returns it.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
+    Parameters:
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        by (str): "loans" to rank by loans ever made, or "active_loans" to rank by loans not yet returned.
+        limit (int): The number of books to return, capped to the configured maximum.
+    Returns:
+        books (list): A list of dictionaries with each book's ID, name, author, loans and active_loans, best first.
+    Raises:
+        HTTPException (400): If the ranking or the limit is invalid.
+        HTTPException (500): If any error occurs during fetching of the statistics.
+    """
+    try:
+        etag = await run_db(make_etag, conn, ("History", "Books"), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        books = await run_db(stats_crud.get_top_books, conn, by, limit)
+        return with_etag(ORJSONResponse(content=books, status_code=200), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.get("/books/{book_id}")
+async def getBookStats(book_id: str, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Retrieve the loan counters of a book.
+    Calls the get_book_stats function from the stats_crud module and returns the result.
+    Parameters:
+        book_id (str): The ID of the book.
+    Returns:
+        stats (dict): The book ID, its loans ever made and its loans not yet returned.
+    Raises:
+        HTTPException (400): If the book ID is not a positive integer.
+        HTTPException (404): If the book is not found.
+        HTTPException (500): If any error occurs during fetching of the statistics.
+    """
+    try:
+        if(not book_id.isdigit()):
+            raise ValueError("Book ID is not a number")
+        stats = await run_db(stats_crud.get_book_stats, conn, int(book_id))
+        return ORJSONResponse(content=stats, status_code=200)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except KeyError as bookNotFound:
+        raise HTTPException(status_code=404, detail=str(bookNotFound))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.get("/members/top")
+async def getTopMembers(request: Request, by: str = "loans", limit: int = settings.stats_top_default, conn: sqlite3.Connection = Depends(get_db_connection)) -> list:
+    """
+    Retrieve the busiest members.
+    Calls the get_top_members function from the stats_crud module to read the top of the incrementally maintained member counters and returns it.
+    Sends a strong ETag derived from the change counters of the tables read, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
+    Parameters:
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        by (str): "loans" to rank by loans ever made, or "active_loans" to rank by loans not yet returned.
+        limit (int): The number of members to return, capped to the configured maximum.
+    Returns:
+        members (list): A list of dictionaries with each member's ID, name, loans and active_loans, best first.
+    Raises:
+        HTTPException (400): If the ranking or the limit is invalid.
+        HTTPException (500): If any error occurs during fetching of the statistics.
+    """
+    try:
+        etag = await run_db(make_etag, conn, ("History", "Members"), request_variant(request))
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        members = await run_db(stats_crud.get_top_members, conn, by, limit)
+        return with_etag(ORJSONResponse(content=members, status_code=200), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.get("/members/{member_id}")
+async def getMemberStats(member_id: str, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Retrieve the loan counters of a member.
+    Calls the get_member_stats function from the stats_crud module and returns the result.
+    Parameters:
+        member_id (str): The ID of the member.
+    Returns:
+        stats (dict): The member ID, their loans ever made and their loans not yet returned.
+    Raises:
+        HTTPException (400): If the member ID is not a positive integer.
+        HTTPException (404): If the member is not found.
+        HTTPException (500): If any error occurs during fetching of the statistics.
+    """
+    try:
+        if(not member_id.isdigit()):
+            raise ValueError("Member ID is not a number")
+        stats = await run_db(stats_crud.get_member_stats, conn, int(member_id))
+        return ORJSONResponse(content=stats, status_code=200)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except KeyError as memberNotFound:
+        raise HTTPException(status_code=404, detail=str(memberNotFound))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
+
+@router.get("/checkouts")
+async def getDailyCheckouts(request: Request, start: Optional[date] = None, end: Optional[date] = None, conn: sqlite3.Connection = Depends(get_db_connection)) -> dict:
+    """
+    Retrieve the number of checkouts per day over a window of days.
+    Calls the get_daily_checkouts function from the stats_crud module to read the incrementally maintained daily counters and returns them with their total.
+    Sends a strong ETag derived from the change counter of History and the current date, which the default window depends on, and answers 304 Not Modified without querying the rows when If-None-Match matches it.
+    Parameters:
+        request (Request): The incoming request, whose If-None-Match header is checked.
+        start (date): The first day of the window; defaults to 30 days up to the end.
+        end (date): The last day of the window; defaults to today.
+    Returns:
+        checkouts (dict): The window, the total number of checkouts and the count of every day with checkouts.
+    Raises:
+        HTTPException (400): If the window is invalid or too long.
+        HTTPException (500): If any error occurs during fetching of the statistics.
+    """
+    try:
+        etag = await run_db(make_etag, conn, ("History",), f"{request_variant(request)}@{date.today().isoformat()}")
+        if(is_not_modified(request, etag)):
+            return not_modified_response(etag)
+        checkouts = await run_db(stats_crud.get_daily_checkouts, conn, start, end)
+        return with_etag(ORJSONResponse(content=checkouts, status_code=200), etag)
+    except ValueError as valueError:
+        raise HTTPException(status_code=400, detail=str(valueError))
+    except sqlite3.Error as databaseError:
+        raise HTTPException(status_code=500, detail=f"Database error: {databaseError}")
+    except Exception as exception:
+        raise HTTPException(status_code=500, detail=f"Error: {exception}")
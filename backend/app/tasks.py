@@ -0,0 +1,268 @@
+import abc
+import asyncio
+import datetime
+import logging
+import threading
+import time
+import pathlib
+import app.data_logic.allocations_data_logic as allocation_crud
+import app.data_logic.history_data_logic as history_crud
+from app.config import settings
+from app.database import pool, dedicated_connection, ARCHIVE_PATH
+
+logger = logging.getLogger(__name__)
+
+class PeriodicJob(abc.ABC):
+    """
+    A background job run at a fixed interval, off the event loop.
+    Subclasses implement run_once(), which is called in a worker thread; a failed run is logged and retried at the next interval.
+    Attributes:
+        interval (float): The number of seconds between runs, or 0 if the job is disabled.
+    """
+    name = "Background job"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task = None
+
+    @abc.abstractmethod
+    def run_once(self):
+        """
+        Run the job once.
+        Parameters:
+            None
+        Returns:
+            outcome: A summary of the run, passed to log_outcome().
+        """
+
+    def log_outcome(self, outcome):
+        """
+        Log the summary of a successful run.
+        Parameters:
+            outcome: The return value of run_once().
+        Returns:
+            None
+        """
+
+    async def _run_forever(self):
+        """
+        Run the job every interval until cancelled, off the event loop.
+        A failed run is logged and retried at the next interval.
+        Parameters:
+            None
+        Returns:
+            None
+        """
+        while True:
+            try:
+                self.log_outcome(await asyncio.to_thread(self.run_once))
+            except Exception:
+                logger.exception("%s failed", self.name)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Schedule the job on the running event loop, unless it is disabled or already running.
+        Parameters:
+            None
+        Returns:
+            None
+        """
+        if(self.interval <= 0 or self._task is not None):
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run_forever())
+
+    async def stop(self):
+        """
+        Cancel the job and wait for it to finish.
+        Parameters:
+            None
+        Returns:
+            None
+        """
+        if(self._task is None):
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+class OverdueSweeper(PeriodicJob):
+    """
+    A background job that flags overdue loans at a fixed interval.
+    Each run checks a connection out of the pool and flips the overdue flag of every open loan past its end date in Allocations and History with one set-based update per table, so reads never have to write.
+    Attributes:
+        interval (float): The number of seconds between runs, or 0 if the sweeper is disabled.
+    """
+    name = "Overdue sweep"
+
+    def __init__(self, connection, interval: float):
+        super().__init__(interval)
+        self._connection = connection
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "failures": 0,
+            "last_run": None,
+            "last_duration": None,
+            "last_allocations_marked": 0,
+            "last_history_marked": 0,
+            "rows_touched_total": 0,
+            "last_error": None,
+        }
+
+    def run_once(self, today: datetime.date = None):
+        """
+        Flag the overdue loans once and record the outcome.
+        Parameters:
+            today (date): The date loans are compared with, or None for the current date.
+        Returns:
+            marked (tuple): The number of Allocations rows and of History rows flagged.
+        Raises:
+            sqlite3.Error: If the update fails; the failure is recorded before it is raised.
+        """
+        started = time.perf_counter()
+        startedAt = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        try:
+            with self._connection() as conn:
+                allocations, history = allocation_crud.mark_overdue_allocations(conn, today or datetime.date.today())
+        except Exception as exception:
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["failures"] += 1
+                self._stats["last_run"] = startedAt
+                self._stats["last_duration"] = time.perf_counter() - started
+                self._stats["last_error"] = str(exception)
+            raise
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["last_run"] = startedAt
+            self._stats["last_duration"] = time.perf_counter() - started
+            self._stats["last_allocations_marked"] = allocations
+            self._stats["last_history_marked"] = history
+            self._stats["rows_touched_total"] += allocations + history
+            self._stats["last_error"] = None
+        return allocations, history
+
+    def log_outcome(self, outcome):
+        """
+        Log how many rows a run flagged, if any.
+        Parameters:
+            outcome (tuple): The number of Allocations rows and of History rows flagged.
+        Returns:
+            None
+        """
+        allocations, history = outcome
+        if(allocations or history):
+            logger.info("Overdue sweep flagged %d allocations and %d history rows", allocations, history)
+
+    def status(self):
+        """
+        Report when the sweeper last ran and how many rows it touched.
+        Parameters:
+            None
+        Returns:
+            status (dict): The interval, whether the sweeper is running, the run and failure counts, the start time and duration of the last run, the rows it flagged per table, the rows flagged in total and the last error.
+        """
+        with self._lock:
+            status = dict(self._stats)
+        status["interval"] = self.interval
+        status["running"] = self._task is not None
+        return status
+
+class HistoryArchiver(PeriodicJob):
+    """
+    A background job that moves old closed loans from the History table to the history archive at a fixed interval.
+    Each run opens its own connection, since it attaches the archive read-write, and archives the returned loans that ended more than the horizon ago, keeping the History table limited to recent and open loans.
+    Attributes:
+        interval (float): The number of seconds between runs, or 0 if the archiver is disabled.
+        archive_path (Path): The archive file.
+        horizon_days (int): The number of days after its end date a returned loan stays in the History table.
+        batch_size (int): The number of loans moved per transaction.
+    """
+    name = "History archival"
+
+    def __init__(self, connection, interval: float, archive_path: pathlib.Path, horizon_days: int, batch_size: int):
+        super().__init__(interval)
+        self._connection = connection
+        self.archive_path = pathlib.Path(archive_path)
+        self.horizon_days = horizon_days
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0,
+            "failures": 0,
+            "last_run": None,
+            "last_duration": None,
+            "last_cutoff": None,
+            "last_archived": 0,
+            "archived_total": 0,
+            "last_error": None,
+        }
+
+    def run_once(self, today: datetime.date = None):
+        """
+        Archive the loans past the horizon once and record the outcome.
+        Parameters:
+            today (date): The date the horizon is counted back from, or None for the current date.
+        Returns:
+            archived (int): The number of loans moved to the archive.
+        Raises:
+            sqlite3.Error: If archiving fails; the failure is recorded before it is raised.
+        """
+        started = time.perf_counter()
+        startedAt = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        cutoff = (today or datetime.date.today()) - datetime.timedelta(days=self.horizon_days)
+        try:
+            with self._connection() as conn:
+                archived = history_crud.archive_history(conn, self.archive_path, cutoff, self.batch_size)
+        except Exception as exception:
+            with self._lock:
+                self._stats["runs"] += 1
+                self._stats["failures"] += 1
+                self._stats["last_run"] = startedAt
+                self._stats["last_duration"] = time.perf_counter() - started
+                self._stats["last_cutoff"] = cutoff.isoformat()
+                self._stats["last_error"] = str(exception)
+            raise
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["last_run"] = startedAt
+            self._stats["last_duration"] = time.perf_counter() - started
+            self._stats["last_cutoff"] = cutoff.isoformat()
+            self._stats["last_archived"] = archived
+            self._stats["archived_total"] += archived
+            self._stats["last_error"] = None
+        return archived
+
+    def log_outcome(self, outcome):
+        """
+        Log how many loans a run archived, if any.
+        Parameters:
+            outcome (int): The number of loans moved to the archive.
+        Returns:
+            None
+        """
+        if(outcome):
+            logger.info("History archival moved %d loans to %s", outcome, self.archive_path)
+
+    def status(self):
+        """
+        Report when the archiver last ran and how many loans it moved.
+        Parameters:
+            None
+        Returns:
+            status (dict): The interval, horizon and archive path, whether the archiver is running, the run and failure counts, the start time, duration and cutoff date of the last run, the loans it archived, the loans archived in total and the last error.
+        """
+        with self._lock:
+            status = dict(self._stats)
+        status["interval"] = self.interval
+        status["horizon_days"] = self.horizon_days
+        status["archive_path"] = str(self.archive_path)
+        status["running"] = self._task is not None
+        return status
+
+overdue_sweeper = OverdueSweeper(pool.connection, settings.overdue_sweep_interval)
+history_archiver = HistoryArchiver(dedicated_connection, settings.archive_interval, ARCHIVE_PATH, settings.archive_horizon_days, settings.archive_batch_size)
@@ -0,0 +1,272 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+from app.cache import book_cache
+from app.config import settings
+from app.database import pool, dedicated_connection
+
+logger = logging.getLogger(__name__)
+
+class WriteQueue:
+    """
+    A single writer that commits writes submitted by many requests together (group commit).
+    Writes are collected until the batch is full or the oldest one has waited max_delay seconds, then applied in one IMMEDIATE transaction with a savepoint each, so a failing write is rolled back alone and the batch costs one commit and one sync.
+    Each submitter gets a future resolved with the result of its own write once the batch is committed, or with its own error.
+    The writer thread holds one connection from the given factory for as long as it runs, so it never competes for a pooled connection with the requests waiting on it.
+    Attributes:
+        max_batch (int): The largest number of writes committed together.
+        max_delay (float): The number of seconds the first write of a batch waits for more writes to arrive.
+        enabled (bool): Whether callers should route their writes through the queue.
+    """
+    def __init__(self, connection, max_batch: int, max_delay: float, on_commit=None, enabled: bool = True):
+        self._connection = connection
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.enabled = enabled
+        self._on_commit = on_commit
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "items": 0,
+            "failed_items": 0,
+            "commit_failures": 0,
+            "largest_batch": 0,
+            "batch_sizes": {},
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "last_commit_duration": None,
+        }
+
+    def start(self):
+        """
+        Start the writer thread, unless it is already running.
+        Parameters:
+            None
+        Returns:
+            None
+        """
+        with self._lock:
+            if(self._thread is None):
+                self._thread = threading.Thread(target=self._run_forever, name="write-queue", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Commit the writes already queued and stop the writer thread.
+        Parameters:
+            timeout (float): The number of seconds to wait for the thread, or None to wait until it finishes.
+        Returns:
+            None
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if(thread is None):
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def submit(self, apply, *args):
+        """
+        Queue a write, starting the writer thread if needed.
+        Parameters:
+            apply (callable): A function taking a connection holding a write transaction and the given arguments, which writes without committing.
+            *args: The arguments passed to apply after the connection.
+        Returns:
+            future (Future): Resolved with the return value of apply once the batch is committed, or with the exception raised by apply or by the commit.
+        """
+        future = concurrent.futures.Future()
+        self.start()
+        self._queue.put((apply, args, future, time.perf_counter()))
+        return future
+
+    async def run(self, apply, *args):
+        """
+        Queue a write and wait for its batch to be committed, without blocking the event loop.
+        Parameters:
+            apply (callable): A function taking a connection holding a write transaction and the given arguments, which writes without committing.
+            *args: The arguments passed to apply after the connection.
+        Returns:
+            result: The return value of apply.
+        Raises:
+            Exception: The exception raised by apply, or by the commit of its batch.
+        """
+        return await asyncio.wrap_future(self.submit(apply, *args))
+
+    def _collect(self):
+        """
+        Wait for the next write, then gather more until the batch is full or max_delay has passed since the first one.
+        Parameters:
+            None
+        Returns:
+            batch (list): The queued writes, or None if the queue is stopping and empty.
+        """
+        first = self._queue.get()
+        if(first is None):
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_delay
+        while(len(batch) < self.max_batch):
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if(item is None):
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run_forever(self):
+        """
+        Collect and commit batches on the writer's connection until stopped.
+        Parameters:
+            None
+        Returns:
+            None
+        """
+        with self._connection() as conn:
+            while True:
+                batch = self._collect()
+                if(batch is None):
+                    return
+                try:
+                    self._commit(conn, batch)
+                except Exception:
+                    logger.exception("Write queue batch failed")
+
+    def _commit(self, conn, batch: list):
+        """
+        Apply a batch of writes in one transaction and resolve their futures.
+        Parameters:
+            conn (sqlite3.Connection): The writer's connection.
+            batch (list): The queued writes, as (apply, args, future, queued at) tuples.
+        Returns:
+            None
+        """
+        started = time.perf_counter()
+        waits = [started - queuedAt for _, _, _, queuedAt in batch]
+        applied = []
+        failed = []
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                for apply, args, future, _ in batch:
+                    if(not future.set_running_or_notify_cancel()):
+                        continue
+                    conn.execute("SAVEPOINT queued_write;")
+                    try:
+                        result = apply(conn, *args)
+                    except Exception as exception:
+                        conn.execute("ROLLBACK TO queued_write;")
+                        conn.execute("RELEASE queued_write;")
+                        failed.append((future, exception))
+                    else:
+                        conn.execute("RELEASE queued_write;")
+                        applied.append((future, result))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        except Exception as exception:
+            for future, _ in applied:
+                future.set_exception(exception)
+            for future, itemError in failed:
+                future.set_exception(itemError)
+            self._record(len(batch), waits, len(batch), time.perf_counter() - started, committed=False)
+            raise
+
+        if(self._on_commit is not None and applied):
+            try:
+                self._on_commit([result for _, result in applied])
+            except Exception:
+                logger.exception("Write queue commit hook failed")
+        for future, result in applied:
+            future.set_result(result)
+        for future, itemError in failed:
+            future.set_exception(itemError)
+        self._record(len(batch), waits, len(failed), time.perf_counter() - started, committed=True)
+
+    def _record(self, size: int, waits: list, failures: int, duration: float, committed: bool):
+        """
+        Add a batch to the counters.
+        Parameters:
+            size (int): The number of writes in the batch.
+            waits (list): The number of seconds each write spent in the queue.
+            failures (int): The number of writes that failed.
+            duration (float): The number of seconds spent applying and committing the batch.
+            committed (bool): Whether the commit succeeded.
+        Returns:
+            None
+        """
+        bucket = 1
+        while(bucket < size):
+            bucket *= 2
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["items"] += size
+            self._stats["failed_items"] += failures
+            self._stats["commit_failures"] += 0 if committed else 1
+            self._stats["largest_batch"] = max(self._stats["largest_batch"], size)
+            self._stats["batch_sizes"][bucket] = self._stats["batch_sizes"].get(bucket, 0) + 1
+            self._stats["queue_wait_total"] += sum(waits)
+            self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], *waits)
+            self._stats["last_commit_duration"] = duration
+
+    def metrics(self):
+        """
+        Report the batching counters.
+        Parameters:
+            None
+        Returns:
+            metrics (dict): The configuration, whether the writer is running, the writes waiting, the batch, write and failure counts, the largest and mean batch size, the number of batches per power-of-two size bucket, the mean and maximum queue wait in seconds, and the duration of the last commit.
+        """
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics["batch_sizes"] = {f"<={bucket}": count for bucket, count in sorted(self._stats["batch_sizes"].items())}
+            metrics["running"] = self._thread is not None
+        queueWaitTotal = metrics.pop("queue_wait_total")
+        metrics["mean_batch_size"] = metrics["items"] / metrics["batches"] if metrics["batches"] else None
+        metrics["queue_wait_mean"] = queueWaitTotal / metrics["items"] if metrics["items"] else None
+        metrics["queued"] = self._queue.qsize()
+        metrics["enabled"] = self.enabled
+        metrics["max_batch"] = self.max_batch
+        metrics["max_delay"] = self.max_delay
+        return metrics
+
+def invalidate_books(bookIds: list):
+    """
+    Drop the books whose allocated copies changed in a committed batch from the book cache.
+    Parameters:
+        bookIds (list): The IDs returned by the applied writes.
+    Returns:
+        None
+    """
+    book_cache.invalidate_tags([("id", bookId) for bookId in set(bookIds)])
+
+async def get_write_connection():
+    """
+    FastAPI dependency that provides a pooled connection to the routes whose writes can go through the allocation write queue.
+    Provides None when the queue is enabled, since the write is then applied by the writer thread on its own connection, and a request holding a pooled connection while it waits for the writer would keep it from the other requests.
+    Parameters:
+        None
+    Yields:
+        conn (sqlite3.Connection): A pooled connection to the database, or None if the queue is enabled.
+    Raises:
+        sqlite3.OperationalError: If no connection becomes free within the pool timeout.
+    """
+    if(allocation_write_queue.enabled):
+        yield None
+        return
+    conn = await pool.acquire_async()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+allocation_write_queue = WriteQueue(dedicated_connection, settings.write_queue_max_batch, settings.write_queue_max_delay, invalidate_books, settings.write_queue_enabled)
@@ -0,0 +1,194 @@
+"""
+Helpers shared by the benchmarks: the words of generated titles, seeding a small library, timing a function, starting and polling a local server,
+and recording latencies per route into the JSON results loadtest.py writes and compares.
+"""
+import asyncio
+import collections
+import datetime
+import math
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import time
+from app.migrations import upgrade
+from app.models import to_day_number
+
+# Words book titles, authors and search queries are drawn from, so searches and suggestions match a realistic share of the catalog.
+WORDS = [
+    "river", "shadow", "garden", "winter", "empire", "silent", "golden", "forest", "ocean", "memory", "glass", "secret", "island", "north",
+    "stone", "crown", "letters", "night", "journey", "mountain", "broken", "summer", "hidden", "machine", "kingdom", "storm", "paper", "city",
+    "light", "harbor", "wild", "distant", "history", "science", "meadow", "dragon", "silver", "house", "bridge", "echo",
+]
+
+def insert_catalog(conn: sqlite3.Connection, books: int, members: int):
+    """
+    Insert the given number of books, with ten copies each, and of members.
+    """
+    conn.executemany("INSERT INTO Books (name, author, total_copies, allocated_copies) VALUES (?, ?, 10, 0);",
+                     ((f"Book {i}", f"Author {i % 500}") for i in range(books)))
+    conn.executemany("INSERT INTO Members (name, email, phone) VALUES (?, ?, ?);",
+                     ((f"Member {i}", f"member{i}@example.com", "1234567890") for i in range(members)))
+
+def seed(path: str, books: int, members: int, loans: int):
+    """
+    Create a database at the given path with the given number of books, members and returned loans.
+    """
+    conn = sqlite3.connect(path)
+    upgrade(conn)
+    insert_catalog(conn, books, members)
+    insert_returned_loans(conn, books, members, loans)
+    conn.commit()
+    conn.close()
+
+def insert_returned_loans(conn: sqlite3.Connection, books: int, members: int, loans: int):
+    """
+    Insert the given number of returned loans of random books by random members.
+    Dates are written as day numbers, or as ISO text if the History table predates day numbers, so a database created by an older checkout can be seeded too.
+    """
+    columns = {column[1]: column[2] for column in conn.execute("PRAGMA table_info(History);")}
+    start = datetime.date(2024, 3, 1)
+    end = start + datetime.timedelta(days=14)
+    startDate, endDate = (start.isoformat(), end.isoformat()) if columns["start_date"] == "TEXT" else (to_day_number(start), to_day_number(end))
+    conn.executemany("INSERT INTO History (book_id, member_id, start_date, end_date, returned) VALUES (?, ?, ?, ?, 1);",
+                     ((random.randint(1, books), random.randint(1, members), startDate, endDate) for _ in range(loans)))
+
+def timed(function, repeat: int):
+    """
+    Run a function the given number of times.
+    Returns the median duration in milliseconds and the last result.
+    """
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000, result
+
+def free_port():
+    """
+    Pick a free TCP port on the loopback interface.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def read_response(reader: asyncio.StreamReader):
+    """
+    Read a response with a Content-Length or chunked body, as streamed reports are sent.
+    Returns the status code, the headers with lowercase names and the body.
+    """
+    lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if(line):
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    if(status in (204, 304)):
+        return status, headers, b""
+    if(headers.get("transfer-encoding") == "chunked"):
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            chunks.append((await reader.readexactly(size + 2))[:-2])
+            if(size == 0):
+                break
+        return status, headers, b"".join(chunks)
+    return status, headers, await reader.readexactly(int(headers["content-length"]))
+
+async def wait_until_up(port: int, timeout: float = 30.0):
+    """
+    Poll the server until it answers or the timeout expires.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics/pool HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await read_response(reader)
+            writer.close()
+            return
+        except (OSError, asyncio.IncompleteReadError):
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+class Recorder:
+    """
+    Latencies and status codes per route, counted only once the warm-up is over.
+    """
+    def __init__(self, measure_from: float):
+        self.measure_from = measure_from
+        self.latencies = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+        self.errors = collections.Counter()
+
+    def record(self, route: str, started: float, status: int, accepted: bool):
+        if(started < self.measure_from):
+            return
+        self.statuses[route][str(status)] += 1
+        if(accepted):
+            self.latencies[route].append(time.perf_counter() - started)
+        else:
+            self.errors[route] += 1
+
+def percentile(ordered: list, share: float):
+    """
+    The nearest-rank percentile of sorted values, in milliseconds.
+    """
+    return round(ordered[max(math.ceil(share * len(ordered)) - 1, 0)] * 1000, 3) if ordered else None
+
+def summarise(recorder: Recorder, elapsed: float):
+    """
+    Requests/sec and latency percentiles per route and for all routes together.
+    """
+    def summary(latencies: list, errors: int, statuses: collections.Counter):
+        ordered = sorted(latencies)
+        return {
+            "requests": len(ordered) + errors,
+            "errors": errors,
+            "requests_per_sec": round((len(ordered) + errors) / elapsed, 1),
+            "p50_ms": percentile(ordered, 0.50),
+            "p95_ms": percentile(ordered, 0.95),
+            "p99_ms": percentile(ordered, 0.99),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+            "max_ms": round(ordered[-1] * 1000, 3) if ordered else None,
+            "statuses": dict(sorted(statuses.items())),
+        }
+
+    routes = sorted(set(recorder.latencies) | set(recorder.errors))
+    allStatuses = sum((recorder.statuses[route] for route in routes), collections.Counter())
+    allLatencies = [latency for route in routes for latency in recorder.latencies[route]]
+    return summary(allLatencies, sum(recorder.errors.values()), allStatuses), {
+        route: summary(recorder.latencies[route], recorder.errors[route], recorder.statuses[route]) for route in routes
+    }
+
+def source_version(directory: str = None):
+    """
+    The commit of the working tree holding the given directory, or the current one, marked dirty if it has uncommitted changes, or None outside a git checkout.
+    """
+    git = ["git"] if directory is None else ["git", "-C", directory]
+    try:
+        commit = subprocess.run([*git, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run([*git, "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+def results_document(benchmark: str, version: str, recorder: Recorder, elapsed: float, parameters: dict):
+    """
+    The results of a run as written to JSON: the benchmark, the revision served, when and where it ran, its parameters, and the totals and figures per route.
+    """
+    total, routes = summarise(recorder, elapsed)
+    return {
+        "benchmark": benchmark,
+        "version": version,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "platform": platform.platform(), "cpus": os.cpu_count()},
+        "parameters": parameters,
+        "total": total,
+        "routes": routes,
+    }
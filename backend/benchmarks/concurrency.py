@@ -0,0 +1,133 @@
+"""
+Throughput of the API under many concurrent clients.
+Serves a temporary database with uvicorn in a subprocess and drives it with concurrent keep-alive clients issuing a read-heavy mix of list, detail and history requests.
+The clients speak plain HTTP/1.1 over asyncio streams, so the load generator stays cheap next to the server on the same machine.
+The server runs from this checkout, or from the backend directory of another one given with --server-dir, so an older revision can be measured with the same
+load; the served checkout creates the schema it expects and the library is seeded into it. --url drives a server that is already running instead.
+Results are printed and can be written as JSON in the shape loadtest.py writes, recording the revision served. Measured results are kept in benchmarks/results.
+Run from the backend directory, e.g.:
+    PYTHONPATH=. python benchmarks/concurrency.py --clients 200 --duration 10
+    git worktree add /tmp/before fd2005e
+    PYTHONPATH=. python benchmarks/concurrency.py --server-dir /tmp/before/backend --output benchmarks/results/concurrency-fd2005e.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+from benchmarks.common import Recorder, insert_catalog, insert_returned_loans, free_port, read_response, wait_until_up, results_document, source_version
+
+# The backend directory of this checkout, served unless --server-dir or --url is given.
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+async def get(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, path: str):
+    """
+    Send a GET request on a keep-alive connection and read the response.
+    Returns the status code and the body.
+    """
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    status, _, body = await read_response(reader)
+    return status, body
+
+async def drive(host: str, port: int, clients: int, duration: float, books: int, members: int):
+    """
+    Issue requests from the given number of concurrent clients for the given number of seconds.
+    Returns the recorder holding the latency and status of every request, and the measured wall time.
+    """
+    paths = [
+        ("GET /books/", lambda: f"/books/?limit=20&after={random.randint(0, books - 20)}"),
+        ("GET /books/{id}", lambda: f"/books/{random.randint(1, books)}"),
+        ("GET /members/{id}", lambda: f"/members/{random.randint(1, members)}"),
+        ("GET /members/", lambda: f"/members/?limit=20&after={random.randint(0, members - 20)}"),
+        ("GET /history/", lambda: f"/history/?limit=20&book_id={random.randint(1, books)}"),
+    ]
+    recorder = Recorder(time.perf_counter())
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while time.monotonic() < deadline:
+                route, path = random.choice(paths)
+                started = time.perf_counter()
+                try:
+                    status, _ = await get(reader, writer, path())
+                except (OSError, asyncio.IncompleteReadError):
+                    recorder.record(route, started, 0, False)
+                    writer.close()
+                    reader, writer = await asyncio.open_connection(host, port)
+                    continue
+                recorder.record(route, started, status, status == 200)
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return recorder, time.perf_counter() - recorder.measure_from
+
+def serve_and_drive(serverDir: str, arguments: argparse.Namespace):
+    """
+    Start the checkout in the given backend directory on a temporary database, seed it once the server has created the schema, and drive it.
+    Returns the recorder and the measured wall time.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "library.sql")
+        port = free_port()
+        env = {**os.environ, "PYTHONPATH": serverDir, "LIBRARY_DB_PATH": path, "LIBRARY_ARCHIVE_PATH": os.path.join(directory, "library.archive.sql"),
+               "LIBRARY_OVERDUE_SWEEP_INTERVAL": "0", "LIBRARY_ARCHIVE_INTERVAL": "0"}
+        server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"], cwd=serverDir, env=env)
+        try:
+            asyncio.run(wait_until_up(port))
+            conn = sqlite3.connect(path, timeout=30)
+            insert_catalog(conn, arguments.books, arguments.members)
+            insert_returned_loans(conn, arguments.books, arguments.members, arguments.loans)
+            conn.commit()
+            conn.close()
+            return asyncio.run(drive("127.0.0.1", port, arguments.clients, arguments.duration, arguments.books, arguments.members))
+        finally:
+            server.terminate()
+            server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--books", type=int, default=10000, help="books seeded, or held by the server given with --url")
+    parser.add_argument("--members", type=int, default=5000, help="members seeded, or held by the server given with --url")
+    parser.add_argument("--loans", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-dir", default=BACKEND_DIR, help="backend directory of the checkout to serve")
+    parser.add_argument("--url", help="drive the server already running at this base URL, e.g. http://127.0.0.1:8000, instead of starting one")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    arguments = parser.parse_args()
+    random.seed(arguments.seed)
+
+    if(arguments.url):
+        address = urllib.parse.urlsplit(arguments.url)
+        version = None
+        recorder, elapsed = asyncio.run(drive(address.hostname, address.port or 80, arguments.clients, arguments.duration, arguments.books, arguments.members))
+    else:
+        serverDir = os.path.abspath(arguments.server_dir)
+        version = source_version(serverDir)
+        recorder, elapsed = serve_and_drive(serverDir, arguments)
+
+    results = results_document("concurrency", version, recorder, elapsed, {
+        "clients": arguments.clients, "duration": arguments.duration, "books": arguments.books, "members": arguments.members, "seed": arguments.seed,
+        **({"url": arguments.url} if arguments.url else {"loans": arguments.loans}),
+    })
+    total = results["total"]
+    print(f"version={version} clients={arguments.clients} duration={elapsed:.1f}s requests={total['requests']} failures={total['errors']}")
+    print(f"requests/sec={total['requests_per_sec']:.0f}")
+    if(total["p50_ms"] is not None):
+        print(f"p50={total['p50_ms']:.1f}ms p99={total['p99_ms']:.1f}ms")
+    if(arguments.output):
+        with open(arguments.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == "__main__":
+    main()
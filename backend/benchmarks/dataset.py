@@ -0,0 +1,262 @@
+"""
+Generator of large synthetic libraries for benchmarks and capacity planning.
+Writes a database with the schema of data/library.sql, every migration applied, holding the given number of books, members and History rows, e.g. 1M books,
+500k members and 20M loans. Popularity is skewed: books are borrowed and members borrow following Zipf laws, popular books have more copies and prolific
+authors write more books. Returned loans spread evenly over the given number of years with a share returned late, and open loans are the latest checkouts
+with the given share of them past their due date and flagged overdue, as the sweeper would have left them.
+Rows are inserted in large batches in a single transaction with the indexes and triggers dropped, and the indexes, the full-text index and the loan
+statistics are built once at the end, so the 20M-row library builds in minutes. The same arguments and seed always give the same rows; pass --today to
+reproduce a library on another day.
+Run from the backend directory, e.g.:
+    PYTHONPATH=. python benchmarks/dataset.py --output /tmp/library.sql --books 1000000 --members 500000 --history 20000000 --open-loans 250000
+    PYTHONPATH=. python benchmarks/loadtest.py --database /tmp/library.sql --mix mixed
+    LIBRARY_DB_PATH=/tmp/library.sql uvicorn app.main:app
+"""
+import argparse
+import collections
+import datetime
+import itertools
+import os
+import random
+import sqlite3
+import time
+from app.migrations import upgrade
+from app.models import to_day_number
+from benchmarks.common import WORDS
+
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth", "William", "Barbara", "Richard", "Susan",
+    "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen", "Aarav", "Priya", "Rohan", "Ananya", "Wei", "Mei", "Hiroshi", "Yuki", "Omar",
+    "Fatima", "Carlos", "Lucia", "Pierre", "Amelie", "Lars", "Ingrid", "Kwame", "Amara", "Dmitri", "Olga",
+]
+
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez", "Hernandez", "Lopez", "Wilson",
+    "Anderson", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Thompson", "Sharma", "Patel", "Kim", "Chen", "Wang", "Tanaka", "Sato",
+    "Haddad", "Silva", "Rossi", "Dubois", "Larsen", "Mensah", "Okafor", "Ivanov", "Novak", "Kowalski", "Murphy", "Schmidt", "Nguyen",
+]
+
+# Rows inserted per executemany call, which bounds the memory held by the generator.
+BATCH_SIZE = 100000
+
+# Books drawn for an open loan before falling back to the most popular book with a copy left, which bounds the work once popular books run out.
+MAX_REDRAWS = 32
+
+# Loaded tables whose indexes and triggers are dropped during the load and recreated after it.
+LOADED_TABLES = ("Books", "Members", "Allocations", "History", "book_stats", "member_stats", "daily_checkouts")
+
+class Zipf:
+    """
+    Draws IDs from 1 to count with the probability of the rank-th most popular proportional to 1 / (rank + count / 1000) ** skew.
+    The offset flattens the head, so at scale the most popular book is borrowed about as often as a few copies can be and the busiest member borrows a
+    book or two a day, while the tail stays a power law. Ranks are shuffled over the IDs, so popular rows are spread over the table instead of being its first rows.
+    """
+    def __init__(self, count: int, skew: float, rng: random.Random):
+        self.rng = rng
+        self.ids = list(range(1, count + 1))
+        rng.shuffle(self.ids)
+        offset = count // 1000
+        self.weights = list(itertools.accumulate(1 / (rank + offset) ** skew for rank in range(1, count + 1)))
+
+    def draw(self, k: int):
+        return self.rng.choices(self.ids, cum_weights=self.weights, k=k)
+
+def batches(count: int):
+    """
+    Split a number of rows into (offset, size) batches.
+    """
+    for offset in range(0, count, BATCH_SIZE):
+        yield offset, min(BATCH_SIZE, count - offset)
+
+def drop_indexes_and_triggers(conn: sqlite3.Connection):
+    """
+    Drop the indexes and triggers of the loaded tables, so rows are appended without maintaining them.
+    Returns the statements recreating them, in their original order; indexes backing UNIQUE constraints cannot be dropped and are kept.
+    """
+    placeholders = ", ".join("?" for _ in LOADED_TABLES)
+    objects = conn.execute(f"SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({placeholders}) ORDER BY rowid;",
+                           LOADED_TABLES).fetchall()
+    for type_, name, _ in objects:
+        conn.execute(f"DROP {type_.upper()} {name};")
+    return [sql for _, _, sql in objects]
+
+def insert_books(conn: sqlite3.Connection, count: int, popularity: Zipf, rng: random.Random):
+    """
+    Insert the books. Titles are drawn from the load test's words, authors from a pool an eighth the size of the catalog with prolific authors writing
+    more books, and the most popular hundredth of the catalog has more copies.
+    Returns the number of copies of each book, indexed by ID.
+    """
+    authors = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(max(1, count // 8))]
+    authorPopularity = Zipf(len(authors), 0.8, rng)
+    rank = [0] * (count + 1)
+    for position, bookId in enumerate(popularity.ids):
+        rank[bookId] = position
+    copies = [0] + [rng.randint(1, 3) + (rng.randint(2, 7) if rank[bookId] < count // 100 else 0) for bookId in range(1, count + 1)]
+    for offset, size in batches(count):
+        names = [" ".join(rng.choices(WORDS, k=rng.randint(2, 4))).title() for _ in range(size)]
+        bookAuthors = [authors[authorId - 1] for authorId in authorPopularity.draw(size)]
+        conn.executemany("INSERT INTO Books (id, name, author, total_copies, allocated_copies) VALUES (?, ?, ?, ?, 0);",
+                         zip(range(offset + 1, offset + size + 1), names, bookAuthors, copies[offset + 1:offset + size + 1]))
+    return copies
+
+def insert_members(conn: sqlite3.Connection, count: int, rng: random.Random):
+    """
+    Insert the members, with unique e-mail addresses.
+    """
+    for offset, size in batches(count):
+        rows = []
+        for memberId in range(offset + 1, offset + size + 1):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            rows.append((memberId, f"{first} {last}", f"{first}.{last}.{memberId}@example.com".lower(), str(rng.randrange(10 ** 9, 10 ** 10))))
+        conn.executemany("INSERT INTO Members (id, name, email, phone) VALUES (?, ?, ?, ?);", rows)
+
+def insert_returned_loans(conn: sqlite3.Connection, count: int, first_day: int, last_day: int, loan_days: int, late_ratio: float,
+                          books: Zipf, members: Zipf, stats: argparse.Namespace):
+    """
+    Insert the returned loans into History with IDs from 1, their checkouts spread evenly from the first day to the last, so IDs follow checkout order.
+    A share of them was returned late and keeps the overdue flag. The loans are counted in the given statistics.
+    """
+    rng = books.rng
+    span = last_day - first_day + 1
+    for offset, size in batches(count):
+        ids = range(offset + 1, offset + size + 1)
+        starts = [first_day + position * span // count for position in range(offset, offset + size)]
+        ends = [start + loan_days for start in starts]
+        late = [rng.random() < late_ratio for _ in range(size)]
+        bookIds = books.draw(size)
+        memberIds = members.draw(size)
+        conn.executemany("INSERT INTO History (id, book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, 1, ?);",
+                         zip(ids, bookIds, memberIds, starts, ends, late))
+        stats.book_loans.update(bookIds)
+        stats.member_loans.update(memberIds)
+        stats.daily_checkouts.update(starts)
+
+def insert_open_loans(conn: sqlite3.Connection, count: int, first_id: int, today: int, loan_days: int, overdue_ratio: float,
+                      copies: list, books: Zipf, members: Zipf, stats: argparse.Namespace):
+    """
+    Insert the open loans into History and Allocations with the same IDs, following the returned loans.
+    The overdue share was checked out more than a loan period ago, late by an exponentially distributed number of days with a mean of two weeks, and is
+    flagged overdue; the others were checked out within the last loan period. A book is never lent more copies than it has: a loan drawing a book with no
+    copy left draws again up to MAX_REDRAWS times, then takes the most popular book that still has one.
+    The loans are counted in the given statistics, and the copies lent per book are returned.
+    """
+    rng = books.rng
+    allocated = collections.Counter()
+    capacity = sum(copies)
+    if(count > capacity):
+        raise SystemExit(f"Cannot lend {count} copies out of {capacity}")
+    spare = 0
+    overdueCount = round(count * overdue_ratio)
+    starts = sorted(today - loan_days - 1 - min(int(rng.expovariate(1 / 14)), 365) for _ in range(overdueCount))
+    starts += sorted(today - rng.randint(0, loan_days) for _ in range(count - overdueCount))
+    for offset, size in batches(count):
+        rows = []
+        bookIds = books.draw(size)
+        for position, (bookId, memberId) in enumerate(zip(bookIds, members.draw(size))):
+            redraws = 0
+            while(allocated[bookId] >= copies[bookId] and redraws < MAX_REDRAWS):
+                bookId = books.draw(1)[0]
+                redraws += 1
+            if(allocated[bookId] >= copies[bookId]):
+                while(allocated[books.ids[spare]] >= copies[books.ids[spare]]):
+                    spare += 1
+                bookId = books.ids[spare]
+            allocated[bookId] += 1
+            start = starts[offset + position]
+            rows.append((first_id + offset + position, bookId, memberId, start, start + loan_days, start + loan_days < today))
+        conn.executemany("INSERT INTO History (id, book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, 0, ?);", rows)
+        conn.executemany("INSERT INTO Allocations (id, book_id, member_id, start_date, end_date, returned, overdue) VALUES (?, ?, ?, ?, ?, 0, ?);", rows)
+        stats.book_loans.update(row[1] for row in rows)
+        stats.member_loans.update(row[2] for row in rows)
+        stats.book_active.update(row[1] for row in rows)
+        stats.member_active.update(row[2] for row in rows)
+        stats.daily_checkouts.update(row[3] for row in rows)
+    return allocated
+
+def insert_stats(conn: sqlite3.Connection, allocated: collections.Counter, stats: argparse.Namespace):
+    """
+    Write the copies lent per book and the loan statistics counted while inserting the loans, as the History triggers would have kept them.
+    """
+    conn.executemany("UPDATE Books SET allocated_copies = ? WHERE id = ?;", ((lent, bookId) for bookId, lent in sorted(allocated.items())))
+    conn.executemany("INSERT INTO book_stats (book_id, loans, active_loans) VALUES (?, ?, ?);",
+                     ((bookId, loans, stats.book_active[bookId]) for bookId, loans in sorted(stats.book_loans.items())))
+    conn.executemany("INSERT INTO member_stats (member_id, loans, active_loans) VALUES (?, ?, ?);",
+                     ((memberId, loans, stats.member_active[memberId]) for memberId, loans in sorted(stats.member_loans.items())))
+    conn.executemany("INSERT INTO daily_checkouts (day, checkouts) VALUES (?, ?);", sorted(stats.daily_checkouts.items()))
+
+def generate(path: str, books: int, members: int, history: int, open_loans: int, today: datetime.date, years: float, loan_days: int,
+             book_skew: float, member_skew: float, overdue_ratio: float, late_ratio: float, seed: int, report=print):
+    """
+    Create a library at the given path; see the module documentation. Each step is reported with its duration.
+    """
+    if(open_loans > history):
+        raise SystemExit("Open loans are History rows too and cannot outnumber them")
+    rng = random.Random(seed)
+    todayNumber = to_day_number(today)
+    started = time.perf_counter()
+
+    def step(label: str):
+        report(f"{label:<34} {time.perf_counter() - started:8.1f}s")
+
+    conn = sqlite3.connect(path)
+    upgrade(conn)
+    conn.execute("PRAGMA journal_mode = OFF;")
+    conn.execute("PRAGMA synchronous = OFF;")
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE;")
+    conn.execute("PRAGMA cache_size = -524288;")
+    conn.execute("BEGIN;")
+    statements = drop_indexes_and_triggers(conn)
+
+    bookPopularity = Zipf(books, book_skew, rng)
+    memberActivity = Zipf(members, member_skew, rng)
+    copies = insert_books(conn, books, bookPopularity, rng)
+    step(f"{books} books")
+    insert_members(conn, members, rng)
+    step(f"{members} members")
+    stats = argparse.Namespace(book_loans=collections.Counter(), member_loans=collections.Counter(), book_active=collections.Counter(),
+                               member_active=collections.Counter(), daily_checkouts=collections.Counter())
+    returned = history - open_loans
+    insert_returned_loans(conn, returned, todayNumber - round(years * 365), todayNumber - 1, loan_days, late_ratio, bookPopularity, memberActivity, stats)
+    step(f"{returned} returned loans")
+    allocated = insert_open_loans(conn, open_loans, returned + 1, todayNumber, loan_days, overdue_ratio, copies, bookPopularity, memberActivity, stats)
+    insert_stats(conn, allocated, stats)
+    step(f"{open_loans} open loans and statistics")
+    for statement in statements:
+        conn.execute(statement)
+    step("indexes and triggers")
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild');")
+    step("full-text index")
+    conn.commit()
+    conn.close()
+    report(f"{os.path.getsize(path)} bytes written to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", required=True, help="path of the database to create")
+    parser.add_argument("--force", action="store_true", help="replace the output if it exists")
+    parser.add_argument("--books", type=int, default=1000000)
+    parser.add_argument("--members", type=int, default=500000)
+    parser.add_argument("--history", type=int, default=20000000, help="History rows, open loans included")
+    parser.add_argument("--open-loans", type=int, default=250000)
+    parser.add_argument("--today", type=datetime.date.fromisoformat, default=datetime.date.today(), help="the day the library is generated as of, as YYYY-MM-DD")
+    parser.add_argument("--years", type=float, default=5.0, help="years the returned loans spread over")
+    parser.add_argument("--loan-days", type=int, default=14, help="days from checkout to due date")
+    parser.add_argument("--book-skew", type=float, default=1.0, help="Zipf exponent of book popularity")
+    parser.add_argument("--member-skew", type=float, default=0.8, help="Zipf exponent of member activity")
+    parser.add_argument("--overdue-ratio", type=float, default=0.15, help="share of open loans past their due date")
+    parser.add_argument("--late-ratio", type=float, default=0.08, help="share of returned loans returned late")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    if(os.path.exists(arguments.output)):
+        if(not arguments.force):
+            raise SystemExit(f"{arguments.output} exists; pass --force to replace it")
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if(os.path.exists(arguments.output + suffix)):
+                os.remove(arguments.output + suffix)
+    print(f"books={arguments.books} members={arguments.members} history={arguments.history} open_loans={arguments.open_loans} today={arguments.today} seed={arguments.seed}")
+    generate(arguments.output, arguments.books, arguments.members, arguments.history, arguments.open_loans, arguments.today, arguments.years,
+             arguments.loan_days, arguments.book_skew, arguments.member_skew, arguments.overdue_ratio, arguments.late_ratio, arguments.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Cost of the overdue and date-range queries with dates stored as text and as day numbers.
+Seeds a temporary database at the schema before day numbers (migration 11) with the given number of open loans and of historic loans,
+copies it and upgrades the copy, then times the same queries on both: the overdue report, the overdue sweep, a window of the history
+by end date and the daily checkout statistics. Dates are bound as ISO text on the first database and as day numbers on the second,
+and the rows are serialised to the same JSON, so the outputs are compared. The file size and the time taken by the upgrade are reported too.
+Run from the backend directory, e.g.:
+    PYTHONPATH=. python benchmarks/dates.py --loans 1000000 --history 1000000
+"""
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from app.migrations import MIGRATIONS, upgrade
+from app.models import to_day_number, iso_date
+from benchmarks.common import insert_catalog, timed
+
+# The last schema version storing dates as text.
+TEXT_DATES_VERSION = 11
+
+def seed(path: str, books: int, members: int, loans: int, history: int, today: datetime.date):
+    """
+    Create a database at the text dates schema with the given number of books, members, open loans and returned loans.
+    Open loans end from a week before today to a year after it, so a small share of them is overdue; returned loans spread over three years.
+    """
+    conn = sqlite3.connect(path)
+    for version, description, statements in MIGRATIONS:
+        if(version > TEXT_DATES_VERSION):
+            break
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP);")
+        conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?);", (version, description))
+    insert_catalog(conn, books, members)
+
+    def loan(returned: bool):
+        end = today + datetime.timedelta(days=random.randint(-1095, -30) if returned else random.randint(-7, 365))
+        start = end - datetime.timedelta(days=14)
+        return (random.randint(1, books), random.randint(1, members), start.isoformat(), end.isoformat(), returned)
+
+    conn.executemany("INSERT INTO Allocations (book_id, member_id, start_date, end_date, returned) VALUES (?, ?, ?, ?, ?);", (loan(False) for _ in range(loans)))
+    conn.executemany("INSERT INTO History (book_id, member_id, start_date, end_date, returned) VALUES (?, ?, ?, ?, ?);", (loan(True) for _ in range(history)))
+    conn.commit()
+    conn.close()
+
+def queries(date, today: datetime.date):
+    """
+    The benchmarked queries, as (label, SQL, parameters), for dates rendered to SQL values and to JSON by the given function.
+    """
+    yield ("overdue report", f"""
+        SELECT json_object('id', Allocations.id, 'book_name', Books.name, 'member_name', Members.name, 'end_date', {date.json('Allocations.end_date')})
+        FROM Allocations
+        LEFT JOIN Books ON Books.id = Allocations.book_id
+        LEFT JOIN Members ON Members.id = Allocations.member_id
+        WHERE Allocations.returned = 0 AND Allocations.end_date < ?
+        ORDER BY Allocations.end_date, Allocations.id;
+    """, (date.value(today),))
+    yield ("overdue sweep count", "SELECT COUNT(*) FROM Allocations WHERE overdue = 0 AND end_date < ?;", (date.value(today),))
+    yield ("history end window", f"""
+        SELECT json_object('id', id, 'start_date', {date.json('start_date')}, 'end_date', {date.json('end_date')})
+        FROM History WHERE end_date >= ? AND end_date <= ?;
+    """, (date.value(today - datetime.timedelta(days=400)), date.value(today - datetime.timedelta(days=370))))
+    yield ("daily checkouts", f"SELECT {date.json('day')}, checkouts FROM daily_checkouts WHERE daily_checkouts.day >= ? AND daily_checkouts.day <= ? ORDER BY daily_checkouts.day;",
+           (date.value(today - datetime.timedelta(days=365)), date.value(today)))
+
+class TextDates:
+    """
+    Dates stored as ISO 8601 text.
+    """
+    value = staticmethod(lambda day: day.isoformat())
+    json = staticmethod(lambda column: column)
+
+class DayNumbers:
+    """
+    Dates stored as day numbers since 1970-01-01.
+    """
+    value = staticmethod(to_day_number)
+    json = staticmethod(iso_date)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--loans", type=int, default=200000)
+    parser.add_argument("--history", type=int, default=200000)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+    random.seed(0)
+    today = datetime.date(2024, 3, 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        textPath = os.path.join(directory, "text.sql")
+        dayPath = os.path.join(directory, "days.sql")
+        seed(textPath, arguments.books, arguments.members, arguments.loans, arguments.history, today)
+        shutil.copyfile(textPath, dayPath)
+        conn = sqlite3.connect(dayPath)
+        started = time.perf_counter()
+        upgrade(conn)
+        print(f"loans={arguments.loans} history={arguments.history} repeat={arguments.repeat}")
+        print(f"upgrade to day numbers {(time.perf_counter() - started) * 1000:8.1f}ms")
+        conn.execute("VACUUM;")
+        conn.close()
+
+        textConn = sqlite3.connect(textPath)
+        textConn.execute("VACUUM;")
+        dayConn = sqlite3.connect(dayPath)
+        print(f"{'file size':<22} {os.path.getsize(textPath):>12} bytes text {os.path.getsize(dayPath):>12} bytes day numbers")
+        for (label, textQuery, textParams), (_, dayQuery, dayParams) in zip(queries(TextDates, today), queries(DayNumbers, today)):
+            textMilliseconds, textRows = timed(lambda: textConn.execute(textQuery, textParams).fetchall(), arguments.repeat)
+            dayMilliseconds, dayRows = timed(lambda: dayConn.execute(dayQuery, dayParams).fetchall(), arguments.repeat)
+            assert textRows == dayRows, label
+            print(f"{label:<22} {textMilliseconds:8.1f}ms text {dayMilliseconds:8.1f}ms day numbers {len(dayRows):>8} rows")
+        textConn.close()
+        dayConn.close()
+
+if __name__ == "__main__":
+    main()
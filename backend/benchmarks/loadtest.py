@@ -0,0 +1,267 @@
+"""
+Load test of the REST API under realistic mixes of requests.
+Serves a database with uvicorn in a subprocess and drives it for a fixed time with concurrent keep-alive clients, each sending its next request as soon as the
+previous one is answered. The mix of catalog browsing, search, checkouts, returns and history paging is chosen by name or given as operation=weight pairs.
+Requests/sec and p50/p95/p99 latency are reported per route, and can be written as JSON and compared with the results of an earlier run to catch regressions.
+Everything runs locally: the database is built by the dataset generator in a temporary directory, or copied there from --database, so the original is never written.
+Run from the backend directory, e.g.:
+    PYTHONPATH=. python benchmarks/loadtest.py --mix mixed --clients 50 --duration 30 --output results.json
+    PYTHONPATH=. python benchmarks/loadtest.py --mix search=3,checkout=1 --baseline results.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from app.migrations import upgrade
+from benchmarks.common import WORDS, Recorder, free_port, read_response, wait_until_up, results_document, source_version
+from benchmarks.dataset import generate
+
+# The named mixes, as operation weights.
+MIXES = {
+    "browse": {"books": 40, "book": 30, "suggest": 15, "member": 15},
+    "search": {"search": 70, "suggest": 30},
+    "circulation": {"checkout": 50, "return": 50},
+    "history": {"history": 100},
+    "mixed": {"books": 20, "book": 20, "member": 5, "search": 15, "suggest": 10, "checkout": 8, "return": 7, "history": 10, "top": 5},
+}
+
+def parse_mix(text: str):
+    """
+    Turn a mix name or a list of operation=weight pairs into operation weights.
+    """
+    if(text in MIXES):
+        return MIXES[text]
+    mix = {}
+    for pair in text.split(","):
+        operation, _, weight = pair.partition("=")
+        if(operation not in OPERATIONS):
+            raise SystemExit(f"Unknown operation {operation!r}; choose from {', '.join(OPERATIONS)} or a mix: {', '.join(MIXES)}")
+        mix[operation] = float(weight or 1)
+    return mix
+
+class Client:
+    """
+    One keep-alive connection sending requests one after another.
+    """
+    def __init__(self, port: int, workload, recorder: Recorder, rng: random.Random):
+        self.port = port
+        self.workload = workload
+        self.recorder = recorder
+        self.rng = rng
+        self.history_cursor = 0
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        if(self.writer is not None):
+            self.writer.close()
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+
+    async def call(self, route: str, method: str, path: str, body=None, accept=(200,)):
+        """
+        Send a request, read the whole response and record it under the given route.
+        Returns the status code, the response headers and the body, or None if the connection failed.
+        """
+        payload = b"" if body is None else json.dumps(body).encode()
+        head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(payload)}\r\n"
+        if(body is not None):
+            head += "Content-Type: application/json\r\n"
+        started = time.perf_counter()
+        try:
+            self.writer.write(f"{head}\r\n".encode() + payload)
+            status, headers, content = await read_response(self.reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            self.recorder.record(route, started, 0, False)
+            await self.connect()
+            return None
+        self.recorder.record(route, started, status, status in accept)
+        return status, headers, content
+
+def search_prefix(rng: random.Random):
+    """
+    A word of the catalog cut to three letters or more, as typed in a search box.
+    """
+    word = rng.choice(WORDS)
+    return word[:rng.randint(3, len(word))]
+
+async def books(client: Client):
+    await client.call("GET /books/", "GET", f"/books/?limit=20&after={client.rng.randint(0, max(client.workload.books - 20, 0))}")
+
+async def book(client: Client):
+    await client.call("GET /books/{id}", "GET", f"/books/{client.rng.randint(1, client.workload.books)}")
+
+async def member(client: Client):
+    await client.call("GET /members/{id}", "GET", f"/members/{client.rng.randint(1, client.workload.members)}")
+
+async def search(client: Client):
+    await client.call("GET /books/search", "GET", f"/books/search?q={search_prefix(client.rng)}&limit=20")
+
+async def suggest(client: Client):
+    await client.call("GET /books/suggest", "GET", f"/books/suggest?prefix={search_prefix(client.rng)}")
+
+async def checkout(client: Client):
+    today = datetime.date.today()
+    body = {"id": 0, "book_id": client.rng.randint(1, client.workload.books), "member_id": client.rng.randint(1, client.workload.members),
+            "start_date": today.isoformat(), "end_date": (today + datetime.timedelta(days=14)).isoformat()}
+    await client.call("POST /allocations/", "POST", "/allocations/", body, accept=(200, 409))
+
+async def return_loan(client: Client):
+    if(not client.workload.open_loans):
+        # Once the known loans are returned, look up open ones as a librarian would, including those checked out during the run.
+        # One client looks them up at a time, so the same loans are not handed out twice.
+        async with client.workload.refill:
+            if(client.workload.open_loans):
+                return
+            response = await client.call("GET /allocations/", "GET", f"/allocations/?returned=false&limit=100&after={client.workload.allocation_cursor}")
+            if(response is None or response[0] != 200):
+                return
+            client.workload.open_loans.extend(allocation["id"] for allocation in json.loads(response[2]))
+            client.workload.allocation_cursor = int(response[1].get("x-next-cursor") or 0)
+        return
+    await client.call("DELETE /allocations/{id}", "DELETE", f"/allocations/{client.workload.open_loans.pop()}")
+
+async def history(client: Client):
+    response = await client.call("GET /history/", "GET", f"/history/?limit=50&after={client.history_cursor}")
+    if(response is not None):
+        client.history_cursor = int(response[1].get("x-next-cursor") or 0)
+
+async def top(client: Client):
+    await client.call("GET /stats/books/top", "GET", "/stats/books/top?limit=10")
+
+# The operations a mix is made of, each sending one request.
+OPERATIONS = {
+    "books": books,
+    "book": book,
+    "member": member,
+    "search": search,
+    "suggest": suggest,
+    "checkout": checkout,
+    "return": return_loan,
+    "history": history,
+    "top": top,
+}
+
+async def drive(port: int, workload, mix: dict, clients: int, warmup: float, duration: float, seed: int):
+    """
+    Run the mix from the given number of clients for the warm-up and then the measured duration.
+    Returns the recorder and the measured wall time.
+    """
+    workload.refill = asyncio.Lock()
+    operations = [OPERATIONS[name] for name in mix]
+    weights = list(mix.values())
+    started = time.perf_counter()
+    recorder = Recorder(started + warmup)
+    deadline = started + warmup + duration
+
+    async def worker(index: int):
+        client = Client(port, workload, recorder, random.Random(seed * 1000003 + index))
+        await client.connect()
+        try:
+            while time.perf_counter() < deadline:
+                await client.rng.choices(operations, weights)[0](client)
+        finally:
+            client.writer.close()
+
+    await asyncio.gather(*(worker(index) for index in range(clients)))
+    return recorder, time.perf_counter() - recorder.measure_from
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Print the change of every route against a baseline run and list the routes that got slower or served fewer requests than the tolerance allows.
+    """
+    regressions = []
+    print(f"\nagainst {baseline.get('version')} ({baseline.get('timestamp')}), tolerance {tolerance:.0%}")
+    for route, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if(not previous or not previous["p95_ms"] or not current["p95_ms"]):
+            continue
+        throughput = current["requests_per_sec"] / previous["requests_per_sec"] - 1
+        latency = current["p95_ms"] / previous["p95_ms"] - 1
+        print(f"{route:<26} req/s {throughput:+7.1%}   p95 {latency:+7.1%}")
+        if(throughput < -tolerance or latency > tolerance):
+            regressions.append(route)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mix", default="mixed", help=f"one of {', '.join(MIXES)}, or operation=weight pairs from {', '.join(OPERATIONS)}")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds run before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", help="run against a copy of this database instead of a seeded one")
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=220000, help="History rows, open loans included")
+    parser.add_argument("--open-loans", type=int, default=20000)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra setting for the server, e.g. LIBRARY_WRITE_QUEUE_ENABLED=true")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results of an earlier run and exit with status 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative drop in req/s or rise in p95 latency")
+    arguments = parser.parse_args()
+    mix = parse_mix(arguments.mix)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "library.sql")
+        if(arguments.database):
+            shutil.copyfile(arguments.database, path)
+            conn = sqlite3.connect(path)
+            upgrade(conn)
+        else:
+            generate(path, arguments.books, arguments.members, arguments.history, arguments.open_loans, datetime.date.today(), years=3.0, loan_days=14,
+                     book_skew=1.0, member_skew=0.8, overdue_ratio=0.15, late_ratio=0.08, seed=arguments.seed)
+            conn = sqlite3.connect(path)
+        openLoans = [row[0] for row in conn.execute("SELECT id FROM Allocations WHERE returned = 0 ORDER BY id;")]
+        workload = argparse.Namespace(
+            books=conn.execute("SELECT MAX(id) FROM Books;").fetchone()[0] or 1,
+            members=conn.execute("SELECT MAX(id) FROM Members;").fetchone()[0] or 1,
+            open_loans=openLoans,
+            allocation_cursor=0,
+        )
+        conn.close()
+        random.Random(arguments.seed).shuffle(workload.open_loans)
+
+        port = free_port()
+        env = {**os.environ, "LIBRARY_DB_PATH": path, "LIBRARY_ARCHIVE_PATH": os.path.join(directory, "library.archive.sql"),
+               "LIBRARY_OVERDUE_SWEEP_INTERVAL": "0", "LIBRARY_ARCHIVE_INTERVAL": "0"}
+        env.update(setting.split("=", 1) for setting in arguments.env)
+        server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"], env=env)
+        try:
+            asyncio.run(wait_until_up(port))
+            recorder, elapsed = asyncio.run(drive(port, workload, mix, arguments.clients, arguments.warmup, arguments.duration, arguments.seed))
+        finally:
+            server.terminate()
+            server.wait()
+
+    results = results_document("loadtest", source_version(), recorder, elapsed, {
+        "mix": mix, "clients": arguments.clients, "duration": arguments.duration, "warmup": arguments.warmup, "seed": arguments.seed,
+        "database": arguments.database, "env": arguments.env,
+        **({} if arguments.database else {"books": arguments.books, "members": arguments.members, "history": arguments.history, "open_loans": arguments.open_loans}),
+    })
+    total, routes = results["total"], results["routes"]
+
+    print(f"mix={arguments.mix} clients={arguments.clients} duration={elapsed:.1f}s requests={total['requests']} errors={total['errors']}")
+    print(f"{'route':<26} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route, summary in [*routes.items(), ("all", total)]:
+        p50, p95, p99 = (f"{summary[key]:.1f}" if summary[key] is not None else "-" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{route:<26} {summary['requests_per_sec']:>8.1f} {p50:>8} {p95:>8} {p99:>8} {summary['errors']:>7}")
+    if(arguments.output):
+        with open(arguments.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if(arguments.baseline):
+        with open(arguments.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), arguments.tolerance)
+        if(regressions):
+            print(f"regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cost of serialising a large /history/ response.
+Seeds a temporary database with the given number of loans and times one page holding all of them, built three ways:
+dictionaries per row encoded by the standard library (the previous response path), dictionaries per row encoded by orjson,
+and rows serialised by SQLite's json_object() and joined into bytes (the current path). The full route is then timed with
+and without gzip, reporting the size on the wire.
+Run from the backend directory, e.g.:
+    PYTHONPATH=. python benchmarks/serialization.py --loans 100000
+"""
+import argparse
+import os
+
+# The page size cap is read when the application is imported, so it must be raised first.
+os.environ.setdefault("LIBRARY_PAGE_SIZE_MAX", "1000000")
+
+import gzip
+import json
+import random
+import sqlite3
+import tempfile
+from fastapi.testclient import TestClient
+from app import app
+from app.database import get_db_connection
+from app.models import dates_to_iso
+from app.pagination import to_page
+from app.responses import orjson
+import app.data_logic.history_data_logic as history_crud
+from benchmarks.common import seed, timed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--loans", type=int, default=100000)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "library.sql")
+        seed(path, arguments.books, arguments.members, arguments.loans)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        limit = arguments.loans
+
+        def dictionaries():
+            rows = conn.execute("SELECT * FROM History WHERE id > 0 ORDER BY id LIMIT ?;", (limit + 1,)).fetchall()
+            return [dates_to_iso(row) for row in to_page(rows, limit)[0]]
+
+        def stdlib():
+            return json.dumps(dictionaries(), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+        def sqlite_json():
+            return history_crud.get_history(conn, limit=limit)[0]
+
+        results = [("dicts + json", stdlib)]
+        if(orjson is not None):
+            results.append(("dicts + orjson", lambda: orjson.dumps(dictionaries())))
+        results.append(("json_object + join", sqlite_json))
+
+        print(f"loans={arguments.loans} repeat={arguments.repeat}")
+        bodies = []
+        for label, function in results:
+            milliseconds, body = timed(function, arguments.repeat)
+            bodies.append(body)
+            print(f"{label:<22} {milliseconds:8.1f}ms {len(body):>10} bytes")
+        assert all(json.loads(body) == json.loads(bodies[0]) for body in bodies[1:])
+
+        milliseconds, compressed = timed(lambda: gzip.compress(bodies[-1], compresslevel=6, mtime=0), arguments.repeat)
+        print(f"{'gzip level 6':<22} {milliseconds:8.1f}ms {len(compressed):>10} bytes")
+
+        app.dependency_overrides[get_db_connection] = lambda: conn
+        # The client is not entered, so the lifespan, which would upgrade the configured database and start the background jobs, does not run.
+        client = TestClient(app)
+        for encoding in ("identity", "gzip"):
+            def request():
+                response = client.get(f"/history/?limit={limit}", headers={"Accept-Encoding": encoding})
+                return len(response.content), response.num_bytes_downloaded
+            milliseconds, (size, wire) = timed(request, arguments.repeat)
+            print(f"{'GET /history/ ' + encoding:<22} {milliseconds:8.1f}ms {wire:>10} bytes on the wire")
+        app.dependency_overrides.clear()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,70 +2,50 @@ import pytest
 from fastapi.testclient import TestClient
 from app import app
 from app.database import get_db_connection
+from app.write_queue import get_write_connection
+from app.cache import book_cache, member_cache
+from app.migrations import upgrade
+from app.models import Allocation, to_day_number
+from app.errors import ConflictError
+import app.data_logic.allocations_data_logic as allocation_crud
+import datetime
+import json
 import sqlite3
+import threading
 
 client = TestClient(app)
 
 def override_get_db_connection():
     """
     Override the database connection to use an in-memory SQLite database for testing.
-    This function creates the necessary tables and returns the connection.
+    This function applies the schema migrations and returns the connection.
     """
-    conn = sqlite3.connect(":memory:")
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.executescript("""
-        CREATE TABLE Books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            author TEXT NOT NULL,
-            total_copies INTEGER NOT NULL,
-            allocated_copies INTEGER DEFAULT 0
-        );
-        CREATE TABLE Members (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE,
-            phone TEXT
-        );
-        CREATE TABLE Allocations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            returned BOOLEAN DEFAULT FALSE,
-            overdue BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (book_id) REFERENCES Books(id),
-            FOREIGN KEY (member_id) REFERENCES Members(id)
-        );
-        CREATE TABLE History (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            returned BOOLEAN DEFAULT FALSE,
-            overdue BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (book_id) REFERENCES Books(id),
-            FOREIGN KEY (member_id) REFERENCES Members(id)
-        );
-    """)
-    conn.commit()
+    upgrade(conn)
     return conn
 
-app.dependency_overrides = {get_db_connection: override_get_db_connection}
-
 @pytest.fixture(scope="function")
 def test_db():
     """
     Pytest fixture to provide a temporary in-memory database for testing.
-    This fixture sets up the database before each test and tears it down after each test.
+    This fixture sets up the database before each test, hands it to the routers in place of a pooled connection, empties the read caches, and tears it down after each test.
     """
     conn = override_get_db_connection()
+    app.dependency_overrides[get_db_connection] = lambda: conn
+    app.dependency_overrides[get_write_connection] = lambda: conn
+    book_cache.clear()
+    member_cache.clear()
     yield conn
+    app.dependency_overrides.clear()
     conn.close()
 
+def day(text: str):
+    """
+    Convert an ISO 8601 date to the day number stored in the database.
+    """
+    return to_day_number(datetime.date.fromisoformat(text))
+
 def test_get_allocations(test_db):
     """
     Test case for retrieving all allocations.
@@ -103,7 +83,7 @@ def test_get_allocation_by_id(test_db):
     Test case for retrieving an allocation by its ID.
     This test verifies that the endpoint returns the correct allocation details.
     """
-    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, '2024-03-01', '2024-03-10')")
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")))
     test_db.commit()
     
     response = client.get("/allocations/1")
@@ -115,7 +95,7 @@ def test_get_allocations_of_book(test_db):
     Test case for retrieving allocations of a specific book.
     This test verifies that the endpoint returns the correct allocations for the given book.
     """
-    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, '2024-03-01', '2024-03-10')")
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")))
     test_db.commit()
     
     response = client.get("/allocations/?book=1")
@@ -127,7 +107,7 @@ def test_get_allocations_of_member(test_db):
     Test case for retrieving allocations of a specific member.
     This test verifies that the endpoint returns the correct allocations for the given member.
     """
-    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, '2024-03-01', '2024-03-10')")
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")))
     test_db.commit()
     
     response = client.get("/allocations/?member=1")
@@ -140,7 +120,7 @@ def test_edit_allocation(test_db):
     This test verifies that an allocation can be successfully updated in the database.
     """
     test_db.execute(
-        "INSERT INTO Allocations (book_id, member_id, start_date, end_date, returned, overdue) VALUES (1, 1, '2024-03-01', '2024-03-10', 0, 0)"
+        "INSERT INTO Allocations (book_id, member_id, start_date, end_date, returned, overdue) VALUES (1, 1, ?, ?, 0, 0)", (day("2024-03-01"), day("2024-03-10"))
     )
     test_db.commit()
     
@@ -162,7 +142,7 @@ def test_delete_allocation(test_db):
     Test case for deleting an allocation.
     This test verifies that an allocation can be successfully deleted from the database.
     """
-    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, '2024-03-01', '2024-03-10')")
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")))
     test_db.commit()
     
     response = client.delete("/allocations/1")
@@ -192,3 +172,258 @@ def test_invalid_allocation_id(test_db):
     """
     response = client.get("/allocations/abc")
     assert response.status_code == 400
+
+def test_filter_allocations(test_db):
+    """
+    Test case for filtering allocations with query parameters.
+    This test verifies that only the allocations matching the book, member and date filters are returned.
+    """
+    test_db.executemany(
+        "INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (?, ?, ?, ?)",
+        [(1, 1, day("2024-03-01"), day("2024-03-10")), (2, 1, day("2024-03-05"), day("2024-03-15")), (2, 2, day("2024-04-01"), day("2024-04-10"))],
+    )
+    test_db.commit()
+
+    response = client.get("/allocations/?book_id=2")
+    assert response.status_code == 200
+    assert [allocation["id"] for allocation in response.json()] == [2, 3]
+
+    response = client.get("/allocations/?member=1&book=2")
+    assert [allocation["id"] for allocation in response.json()] == [2]
+
+    response = client.get("/allocations/?end_from=2024-03-12&end_to=2024-03-31")
+    assert [allocation["id"] for allocation in response.json()] == [2]
+
+def test_overdue_allocations(test_db):
+    """
+    Test case for the overdue report.
+    This test verifies that only open loans ending before the cutoff are returned, earliest end date first and with the names of their book and member, for the default, due_before and due_within_days cutoffs.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 5)")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    today = datetime.date.today()
+    test_db.executemany(
+        "INSERT INTO Allocations (book_id, member_id, start_date, end_date, returned) VALUES (?, 1, ?, ?, ?)",
+        [(1, day("2024-03-01"), to_day_number(today - datetime.timedelta(days=3)), 0), (1, day("2024-03-01"), to_day_number(today - datetime.timedelta(days=10)), 0),
+         (1, day("2024-03-01"), to_day_number(today - datetime.timedelta(days=5)), 1), (2, day("2024-03-01"), to_day_number(today), 0),
+         (1, day("2024-03-01"), to_day_number(today + datetime.timedelta(days=7)), 0)],
+    )
+    test_db.commit()
+
+    response = client.get("/allocations/overdue")
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": 2, "book_id": 1, "book_name": "Test Book", "member_id": 1, "member_name": "John Doe", "start_date": "2024-03-01", "end_date": (today - datetime.timedelta(days=10)).isoformat()},
+        {"id": 1, "book_id": 1, "book_name": "Test Book", "member_id": 1, "member_name": "John Doe", "start_date": "2024-03-01", "end_date": (today - datetime.timedelta(days=3)).isoformat()},
+    ]
+    assert "ETag" in response.headers
+
+    response = client.get("/allocations/overdue?due_within_days=0")
+    assert [(allocation["id"], allocation["book_name"]) for allocation in response.json()] == [(2, "Test Book"), (1, "Test Book"), (4, None)]
+    response = client.get("/allocations/overdue?due_within_days=7")
+    assert [allocation["id"] for allocation in response.json()] == [2, 1, 4, 5]
+    response = client.get(f"/allocations/overdue?due_before={(today - datetime.timedelta(days=4)).isoformat()}")
+    assert [allocation["id"] for allocation in response.json()] == [2]
+
+def test_overdue_allocations_streamed_in_chunks(test_db):
+    """
+    Test case for an overdue report longer than one chunk.
+    This test verifies that the chunks join into one JSON array, and that an empty report is an empty array.
+    """
+    chunks = list(allocation_crud.get_overdue_allocations(test_db, datetime.date(2024, 3, 20), chunk_size=2))
+    assert chunks == [b"[]"]
+
+    test_db.executemany("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?)", [(day("2024-03-01"), day(f"2024-03-{end:02d}")) for end in range(10, 15)])
+    test_db.commit()
+    chunks = list(allocation_crud.get_overdue_allocations(test_db, datetime.date(2024, 3, 20), chunk_size=2))
+    assert len(chunks) == 4
+    assert [allocation["end_date"] for allocation in json.loads(b"".join(chunks))] == [f"2024-03-{end:02d}" for end in range(10, 15)]
+
+def test_overdue_allocations_invalid_cutoff(test_db):
+    """
+    Test case for the overdue report with conflicting or invalid cutoffs.
+    This test verifies that giving both cutoffs, or a negative number of days, is rejected.
+    """
+    assert client.get("/allocations/overdue?due_before=2024-03-10&due_within_days=3").status_code == 400
+    assert client.get("/allocations/overdue?due_within_days=-1").status_code == 400
+    assert client.get("/allocations/overdue?due_before=not-a-date").status_code == 422
+
+def test_filter_allocations_invalid_date(test_db):
+    """
+    Test case for filtering allocations with a malformed date.
+    This test verifies that the endpoint rejects the request instead of ignoring the filter.
+    """
+    response = client.get("/allocations/?end_to=not-a-date")
+    assert response.status_code == 422
+
+def test_add_allocations_batch(test_db):
+    """
+    Test case for checking out several books in one request.
+    This test verifies that valid items are allocated, unknown books and members are reported per item, and allocated_copies is updated once per book.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Book A', 'Author', 5), ('Book B', 'Author', 5)")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    test_db.commit()
+
+    items = [{"id": -1, "book_id": book_id, "member_id": member_id, "start_date": "2024-03-01", "end_date": "2024-03-10"}
+             for book_id, member_id in [(1, 1), (1, 1), (2, 1), (3, 1), (2, 9)]]
+    response = client.post("/allocations/batch", json={"allocations": items})
+    assert response.status_code == 200, response.text
+    outcomes = response.json()
+    assert [outcome["status"] for outcome in outcomes] == ["allocated", "allocated", "allocated", "failed", "failed"]
+    assert outcomes[3]["error"] == "Book not found"
+    assert outcomes[4]["error"] == "Member not found"
+
+    copies = dict(test_db.execute("SELECT id, allocated_copies FROM Books;").fetchall())
+    assert copies == {1: 2, 2: 1}
+    assert test_db.execute("SELECT COUNT(*) FROM History;").fetchone()[0] == 3
+    assert client.get(f"/allocations/{outcomes[0]['id']}").status_code == 200
+
+def test_return_allocations_batch(test_db):
+    """
+    Test case for returning several books in one request.
+    This test verifies that existing allocations are returned, unknown IDs are reported per item, and allocated_copies is decremented per book.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies, allocated_copies) VALUES ('Book A', 'Author', 5, 2)")
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?), (1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")) * 2)
+    test_db.execute("INSERT INTO History (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?), (1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")) * 2)
+    test_db.commit()
+
+    response = client.post("/allocations/batch/return", json={"ids": [1, 2, 2, 99]})
+    assert response.status_code == 200, response.text
+    assert response.json() == [
+        {"id": 1, "status": "returned"},
+        {"id": 2, "status": "returned"},
+        {"id": 99, "status": "failed", "error": "Allocation not found"},
+    ]
+    assert test_db.execute("SELECT allocated_copies FROM Books WHERE id=1;").fetchone()[0] == 0
+    assert test_db.execute("SELECT COUNT(*) FROM History WHERE returned = 1;").fetchone()[0] == 2
+
+def test_conditional_get_allocations(test_db):
+    """
+    Test case for conditional requests on the allocations list.
+    This test verifies that the list answers 304 until an allocation is added.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 5)")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    test_db.commit()
+
+    etag = client.get("/allocations/").headers["ETag"]
+    assert client.get("/allocations/", headers={"If-None-Match": etag}).status_code == 304
+    allocation = {"id": 1, "book_id": 1, "member_id": 1, "start_date": "2024-03-01", "end_date": "2024-03-10"}
+    assert client.post("/allocations/", json=allocation).status_code == 200
+    response = client.get("/allocations/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+def test_add_allocation_unavailable(test_db):
+    """
+    Test case for checking out a book with no copy left.
+    This test verifies that the endpoint returns a 409 status code without adding an allocation, and a 404 status code for an unknown book.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 1)")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    test_db.commit()
+
+    allocation_data = {"id": 0, "book_id": 1, "member_id": 1, "start_date": "2024-03-01", "end_date": "2024-03-10"}
+    assert client.post("/allocations/", json=allocation_data).status_code == 200
+    response = client.post("/allocations/", json=allocation_data)
+    assert response.status_code == 409
+    assert response.json()["detail"] == "No copy of the book is available"
+    assert test_db.execute("SELECT COUNT(*) FROM Allocations;").fetchone()[0] == 1
+    assert test_db.execute("SELECT allocated_copies FROM Books WHERE id=1;").fetchone()[0] == 1
+
+    assert client.post("/allocations/", json={**allocation_data, "book_id": 9}).status_code == 404
+
+def test_add_allocations_batch_unavailable(test_db):
+    """
+    Test case for checking out more copies than a book has in one batch.
+    This test verifies that items beyond the free copies are reported and the book is not over-allocated.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies, allocated_copies) VALUES ('Test Book', 'Author', 3, 1)")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    test_db.commit()
+
+    items = [{"id": -1, "book_id": 1, "member_id": 1, "start_date": "2024-03-01", "end_date": "2024-03-10"}] * 3
+    outcomes = client.post("/allocations/batch", json={"allocations": items}).json()
+    assert [outcome["status"] for outcome in outcomes] == ["allocated", "allocated", "failed"]
+    assert outcomes[2]["error"] == "No copy available"
+    assert test_db.execute("SELECT allocated_copies FROM Books WHERE id=1;").fetchone()[0] == 3
+
+def test_concurrent_batch_returns_return_once(tmp_path):
+    """
+    Test case for a batch return racing another return of the same allocations.
+    This test verifies that a batch waiting on the write lock reads the allocations only once it holds it, so it reports the allocations returned meanwhile as not found and gives no copy back twice.
+    """
+    path = str(tmp_path / "library.sql")
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    upgrade(conn)
+    conn.execute("INSERT INTO Books (name, author, total_copies, allocated_copies) VALUES ('Test Book', 'Author', 5, 2)")
+    conn.execute("INSERT INTO History (id, book_id, member_id, start_date, end_date) VALUES (1, 1, 1, ?, ?), (2, 1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")) * 2)
+    conn.execute("INSERT INTO Allocations (id, book_id, member_id, start_date, end_date) VALUES (1, 1, 1, ?, ?), (2, 1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")) * 2)
+    conn.commit()
+    outcomes = []
+
+    def return_batch():
+        worker = sqlite3.connect(path, timeout=30)
+        worker.row_factory = sqlite3.Row
+        outcomes.extend(allocation_crud.delete_allocations(worker, [1, 2]))
+        worker.close()
+
+    conn.execute("BEGIN IMMEDIATE;")
+    worker = threading.Thread(target=return_batch)
+    worker.start()
+    worker.join(0.2)
+    conn.execute("DELETE FROM Allocations;")
+    conn.execute("UPDATE History SET returned = 1;")
+    conn.execute("UPDATE Books SET allocated_copies = 0;")
+    conn.commit()
+    worker.join()
+
+    assert [outcome["status"] for outcome in outcomes] == ["failed", "failed"]
+    assert conn.execute("SELECT allocated_copies FROM Books WHERE id=1;").fetchone()[0] == 0
+    assert conn.execute("SELECT loans, active_loans FROM book_stats WHERE book_id=1;").fetchone() == (2, 0)
+    conn.close()
+
+def test_concurrent_checkouts_do_not_over_allocate(tmp_path):
+    """
+    Test case for many checkouts of the same book at once.
+    This test verifies that with parallel writers on separate connections exactly the available copies are allocated and every other checkout fails with a conflict.
+    """
+    path = str(tmp_path / "library.sql")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    upgrade(conn)
+    conn.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 10)")
+    conn.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    conn.commit()
+
+    threads, attempts = 16, 8
+    barrier = threading.Barrier(threads)
+    results = []
+
+    def checkout():
+        worker = sqlite3.connect(path, timeout=30)
+        worker.row_factory = sqlite3.Row
+        barrier.wait()
+        for _ in range(attempts):
+            try:
+                allocation_crud.add_allocation(worker, Allocation(id=0, book_id=1, member_id=1, start_date="2024-03-01", end_date="2024-03-10"))
+                results.append("allocated")
+            except ConflictError:
+                results.append("conflict")
+        worker.close()
+
+    workers = [threading.Thread(target=checkout) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert results.count("allocated") == 10
+    assert results.count("conflict") == threads * attempts - 10
+    assert conn.execute("SELECT allocated_copies FROM Books WHERE id=1;").fetchone()[0] == 10
+    assert conn.execute("SELECT COUNT(*) FROM Allocations;").fetchone()[0] == 10
+    assert conn.execute("SELECT COUNT(*) FROM History;").fetchone()[0] == 10
+    conn.close()
@@ -2,6 +2,11 @@ import pytest
 from fastapi.testclient import TestClient
 from app import app
 from app.database import get_db_connection
+from app.write_queue import get_write_connection
+from app.cache import book_cache, member_cache
+from app.migrations import upgrade
+from app.models import to_day_number
+import datetime
 import sqlite3
 
 client = TestClient(app)
@@ -9,62 +14,33 @@ client = TestClient(app)
 def override_get_db_connection():
     """
     Override the database connection to use an in-memory SQLite database for testing.
-    This function creates the necessary tables and returns the connection.
+    This function applies the schema migrations and returns the connection.
     """
-    conn = sqlite3.connect(":memory:")
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.executescript("""
-        CREATE TABLE Books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            author TEXT NOT NULL,
-            total_copies INTEGER NOT NULL,
-            allocated_copies INTEGER DEFAULT 0
-        );
-        CREATE TABLE Members (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE,
-            phone TEXT
-        );
-        CREATE TABLE Allocations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            returned BOOLEAN DEFAULT FALSE,
-            overdue BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (book_id) REFERENCES Books(id),
-            FOREIGN KEY (member_id) REFERENCES Members(id)
-        );
-        CREATE TABLE History (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            returned BOOLEAN DEFAULT FALSE,
-            overdue BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (book_id) REFERENCES Books(id),
-            FOREIGN KEY (member_id) REFERENCES Members(id)
-        );
-    """)
-    conn.commit()
+    upgrade(conn)
     return conn
 
-app.dependency_overrides = {get_db_connection: override_get_db_connection}
 
+def day(text: str):
+    """
+    Convert an ISO 8601 date to the day number stored in the database.
+    """
+    return to_day_number(datetime.date.fromisoformat(text))
 
 @pytest.fixture(scope="function")
 def test_db():
     """
     Pytest fixture to provide a temporary in-memory database for testing.
-    This fixture sets up the database before each test and tears it down after each test.
+    This fixture sets up the database before each test, hands it to the routers in place of a pooled connection, empties the read caches, and tears it down after each test.
     """
     conn = override_get_db_connection()
+    app.dependency_overrides[get_db_connection] = lambda: conn
+    app.dependency_overrides[get_write_connection] = lambda: conn
+    book_cache.clear()
+    member_cache.clear()
     yield conn
+    app.dependency_overrides.clear()
     conn.close()
 
 
@@ -170,4 +146,227 @@ def test_invalid_book_id(test_db):
     This test verifies that the endpoint returns a 400 status code for an invalid book ID.
     """
     response = client.get("/books/abc")
-    assert response.status_code == 400
\ No newline at end of file
+    assert response.status_code == 400
+
+
+def test_get_books_paginated(test_db):
+    """
+    Test case for paging through the books with a cursor.
+    This test verifies that every book is returned exactly once and that the last page has no next cursor.
+    """
+    test_db.executemany("INSERT INTO Books (name, author, total_copies) VALUES (?, 'Author', 1)", [(f"Book {i}",) for i in range(5)])
+    test_db.commit()
+
+    names = []
+    response = client.get("/books/?limit=2")
+    while True:
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        names += [book["name"] for book in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        response = client.get(f"/books/?after={response.headers['X-Next-Cursor']}&limit=2")
+
+    assert names == [f"Book {i}" for i in range(5)]
+
+def test_get_books_invalid_limit(test_db):
+    """
+    Test case for retrieving books with an invalid page size.
+    This test verifies that the endpoint returns a 400 status code for a non-positive limit.
+    """
+    response = client.get("/books/?limit=0")
+    assert response.status_code == 400
+
+def test_get_book_with_allocations(test_db):
+    """
+    Test case for retrieving a book with its current allocations.
+    This test verifies that the allocations of the book are embedded with the names of their members.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies, allocated_copies) VALUES ('Test Book', 'Author Name', 5, 1)")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")))
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (2, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")))
+    test_db.commit()
+
+    response = client.get("/books/1?include=allocations")
+    assert response.status_code == 200
+    allocations = response.json()["allocations"]
+    assert [(allocation["id"], allocation["member_name"]) for allocation in allocations] == [(1, "John Doe")]
+
+    response = client.get("/books/1?include=reviews")
+    assert response.status_code == 400
+
+def test_get_books_batch(test_db):
+    """
+    Test case for looking up several books by ID.
+    This test verifies that the found books are keyed by ID and the unknown IDs are reported as missing.
+    """
+    test_db.executemany("INSERT INTO Books (name, author, total_copies) VALUES (?, 'Author', 1)", [(f"Book {i}",) for i in range(3)])
+    test_db.commit()
+
+    response = client.get("/books/batch?ids=3,1,99,1")
+    assert response.status_code == 200
+    assert {bookId: book["name"] for bookId, book in response.json()["items"].items()} == {"1": "Book 0", "3": "Book 2"}
+    assert response.json()["missing"] == [99]
+
+    response = client.post("/books/batch", json={"ids": list(range(1, 2001))})
+    assert response.status_code == 200
+    assert len(response.json()["items"]) == 3
+    assert len(response.json()["missing"]) == 1997
+
+    response = client.get("/books/batch?ids=1,abc")
+    assert response.status_code == 400
+
+def test_import_books_csv(test_db):
+    """
+    Test case for importing books from a CSV body.
+    This test verifies that the valid rows are inserted and the invalid rows are reported with their row numbers.
+    """
+    body = 'name,author,total_copies\nFirst Book,Author,3\n"Second, Book","Multi\nLine Author",1\nBad Book,Author,many\n'
+    response = client.post("/books/import", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 2
+    assert [error["row"] for error in response.json()["errors"]] == [3]
+
+    names = [row["name"] for row in test_db.execute("SELECT name FROM Books ORDER BY id")]
+    assert names == ["First Book", "Second, Book"]
+
+def test_import_books_ndjson(test_db):
+    """
+    Test case for importing books from an NDJSON body.
+    This test verifies that each JSON line becomes a book and malformed lines are reported.
+    """
+    body = '{"name": "First Book", "author": "Author", "total_copies": 3}\n\n{"name": "No Author"}\nnot json\n'
+    response = client.post("/books/import", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1
+    assert [error["row"] for error in response.json()["errors"]] == [2, 3]
+
+def test_import_books_unsupported_type(test_db):
+    """
+    Test case for importing books from an unsupported body.
+    This test verifies that the endpoint returns a 415 status code.
+    """
+    response = client.post("/books/import", content="[]", headers={"Content-Type": "application/json"})
+    assert response.status_code == 415
+
+def test_cached_book_is_invalidated_by_writes(test_db):
+    """
+    Test case for the book read cache.
+    This test verifies that repeated reads are served from the cache and that editing the book or allocating a copy makes the next read see the change.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 5)")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    test_db.commit()
+
+    assert client.get("/books/1").json()["allocated_copies"] == 0
+    assert client.get("/books/").json() == [{"id": 1, "name": "Test Book", "author": "Author", "total_copies": 5, "allocated_copies": 0}]
+    hits = book_cache.stats()["hits"]
+    assert client.get("/books/1").status_code == 200
+    assert client.get("/books/").json()[0]["allocated_copies"] == 0
+    assert book_cache.stats()["hits"] == hits + 2
+
+    allocation = {"id": 1, "book_id": 1, "member_id": 1, "start_date": "2024-03-01", "end_date": "2024-03-10"}
+    assert client.post("/allocations/", json=allocation).status_code == 200
+    assert client.get("/books/1").json()["allocated_copies"] == 1
+    assert client.get("/books/").json()[0]["allocated_copies"] == 1
+
+    book = {"id": 1, "name": "Renamed Book", "author": "Author", "total_copies": 5, "allocated_copies": 1}
+    assert client.put("/books/1", json=book).status_code == 200
+    assert client.get("/books/1").json()["name"] == "Renamed Book"
+    assert client.get("/books/?name=Renamed Book").json()[0]["id"] == 1
+
+def test_conditional_get_books(test_db):
+    """
+    Test case for conditional requests on the books endpoints.
+    This test verifies that a matching If-None-Match gets 304 Not Modified, and that a write through the API changes the ETag.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 5)")
+    test_db.commit()
+
+    for path in ["/books/", "/books/1"]:
+        response = client.get(path)
+        etag = response.headers["ETag"]
+        assert response.status_code == 200
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+
+    listEtag = client.get("/books/").headers["ETag"]
+    assert client.get("/books/?limit=1").headers["ETag"] != listEtag
+    book = {"id": 1, "name": "Renamed Book", "author": "Author", "total_copies": 5, "allocated_copies": 0}
+    assert client.put("/books/1", json=book).status_code == 200
+    response = client.get("/books/", headers={"If-None-Match": listEtag})
+    assert response.status_code == 200
+    assert response.json()[0]["name"] == "Renamed Book"
+
+def test_search_books(test_db):
+    """
+    Test case for searching the books.
+    This test verifies that every word must match the start of a word in the name or author, that short names matching every word rank first, and that pages are followed by offset.
+    """
+    test_db.executemany("INSERT INTO Books (name, author, total_copies) VALUES (?, ?, 1)", [
+        ("The Lord of the Rings", "J. R. R. Tolkien"),
+        ("The Hobbit", "J. R. R. Tolkien"),
+        ("Ring Theory", "Louis Rowen"),
+        ("Rings of Saturn", "W. G. Sebald"),
+    ])
+    test_db.commit()
+
+    response = client.get("/books/search?q=lord ring")
+    assert response.status_code == 200
+    assert [book["name"] for book in response.json()] == ["The Lord of the Rings"]
+
+    response = client.get("/books/search?q=tolk")
+    assert sorted(book["name"] for book in response.json()) == ["The Hobbit", "The Lord of the Rings"]
+
+    response = client.get("/books/search?q=ring")
+    assert [book["name"] for book in response.json()][0] in ("Ring Theory", "Rings of Saturn")
+
+    response = client.get("/books/search?q=rin&limit=2")
+    assert len(response.json()) == 2
+    names = [book["name"] for book in response.json()]
+    response = client.get(f"/books/search?q=rin&limit=2&offset={response.headers['X-Next-Cursor']}")
+    assert "X-Next-Cursor" not in response.headers
+    names += [book["name"] for book in response.json()]
+    assert sorted(names) == ["Ring Theory", "Rings of Saturn", "The Lord of the Rings"]
+
+def test_search_books_follows_writes(test_db):
+    """
+    Test case for keeping the search index in sync with the books.
+    This test verifies that added, renamed and deleted books are found under their current names only.
+    """
+    client.post("/books/", json={"id": 0, "name": "Dune", "author": "Frank Herbert", "total_copies": 1, "allocated_copies": 0})
+    assert [book["name"] for book in client.get("/books/search?q=dune").json()] == ["Dune"]
+
+    client.put("/books/1", json={"id": 1, "name": "Dune Messiah", "author": "Frank Herbert", "total_copies": 1, "allocated_copies": 0})
+    assert [book["name"] for book in client.get("/books/search?q=messiah").json()] == ["Dune Messiah"]
+
+    client.delete("/books/1")
+    assert client.get("/books/search?q=dune").json() == []
+
+def test_search_books_literal_query(test_db):
+    """
+    Test case for searching with FTS5 syntax characters.
+    This test verifies that operators are matched as plain words and a query without words is rejected.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Cats AND Dogs', 'Author', 1)")
+    test_db.commit()
+
+    response = client.get('/books/search?q=cats "AND* dogs')
+    assert response.status_code == 200
+    assert [book["name"] for book in response.json()] == ["Cats AND Dogs"]
+    assert client.get("/books/search?q=*-").status_code == 400
+
+def test_suggest_books(test_db):
+    """
+    Test case for suggesting books by name prefix.
+    This test verifies that names starting with the prefix in any case are returned in name order.
+    """
+    test_db.executemany("INSERT INTO Books (name, author, total_copies) VALUES (?, 'Author', 1)", [("dune",), ("Dune Messiah",), ("Emma",)])
+    test_db.commit()
+
+    response = client.get("/books/suggest?prefix=Du")
+    assert response.status_code == 200
+    assert response.json() == [{"id": 1, "name": "dune", "author": "Author"}, {"id": 2, "name": "Dune Messiah", "author": "Author"}]
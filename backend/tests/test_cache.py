@@ -0,0 +1,82 @@
+from fastapi.testclient import TestClient
+from app import app
+from app.cache import LRUCache, MISSING
+import time
+
+client = TestClient(app)
+
+def test_cache_evicts_least_recently_used():
+    """
+    Test case for the size bound of the cache.
+    This test verifies that the least recently used entry is evicted and counted once the cache is full.
+    """
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+def test_cache_expires_entries():
+    """
+    Test case for the time to live of the cache.
+    This test verifies that an entry older than the TTL is not served.
+    """
+    cache = LRUCache(max_entries=2, ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is MISSING
+    assert cache.stats()["expirations"] == 1
+
+def test_cache_invalidates_by_tag():
+    """
+    Test case for tag-based invalidation.
+    This test verifies that exactly the entries carrying an invalidated tag are dropped.
+    """
+    cache = LRUCache(max_entries=10, ttl=60)
+    cache.put(("book", 1), {"id": 1}, [("id", 1)])
+    cache.put(("list", 0), [{"id": 1}, {"id": 2}], ["list", ("id", 1), ("id", 2)])
+    cache.put(("list", 2), [{"id": 3}], ["list", ("id", 3)])
+
+    cache.invalidate_tags([("id", 1)])
+    assert cache.get(("book", 1)) is MISSING
+    assert cache.get(("list", 0)) is MISSING
+    assert cache.get(("list", 2)) == [{"id": 3}]
+
+def test_cache_skips_values_read_before_an_invalidation():
+    """
+    Test case for a read racing a write.
+    This test verifies that a value loaded before an invalidation is not stored.
+    """
+    cache = LRUCache(max_entries=10, ttl=60)
+    generation = cache.generation()
+    cache.invalidate_tags([("id", 1)])
+    cache.put(("book", 1), {"id": 1}, [("id", 1)], generation)
+    assert cache.get(("book", 1)) is MISSING
+
+def test_disabled_cache_stores_nothing():
+    """
+    Test case for a disabled cache.
+    This test verifies that nothing is stored or served.
+    """
+    cache = LRUCache(max_entries=10, ttl=60, enabled=False)
+    cache.put("a", 1)
+    assert cache.get("a") is MISSING
+    assert cache.stats()["entries"] == 0
+
+def test_get_cache_metrics():
+    """
+    Test case for retrieving the cache counters.
+    This test verifies that the endpoint reports the counters of both caches.
+    """
+    response = client.get("/metrics/cache")
+    assert response.status_code == 200
+    assert {"hits", "misses", "evictions", "entries", "enabled"} <= response.json()["books"].keys()
+    assert response.json()["members"].keys() == response.json()["books"].keys()
@@ -0,0 +1,153 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import app
+from app.config import settings
+from app.database import ConnectionPool, ENGINE_PRAGMAS, apply_engine_profile, get_engine_profile, get_db_connection
+import asyncio
+import sqlite3
+import threading
+
+client = TestClient(app)
+
+def create_memory_connection():
+    """
+    Connection factory for the pools under test.
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+@pytest.fixture(scope="function")
+def test_pool():
+    """
+    Pytest fixture to provide a small connection pool for testing.
+    This fixture creates a pool of two in-memory connections and closes it after each test.
+    """
+    pool = ConnectionPool(create_memory_connection, size=2, timeout=0.1, health_check_interval=0)
+    yield pool
+    pool.close()
+
+def test_pool_reuses_connections(test_pool):
+    """
+    Test case for reusing pooled connections.
+    This test verifies that a released connection is handed out again instead of opening a new one.
+    """
+    first = test_pool.acquire()
+    test_pool.release(first)
+    second = test_pool.acquire()
+    test_pool.release(second)
+
+    assert first is second
+    metrics = test_pool.metrics()
+    assert metrics["checkouts"] == 2
+    assert metrics["connections_created"] == 1
+    assert metrics["idle"] == 1
+
+def test_pool_waits_and_times_out(test_pool):
+    """
+    Test case for an exhausted pool.
+    This test verifies that acquire() waits for a released connection and times out when none is released.
+    """
+    held = [test_pool.acquire(), test_pool.acquire()]
+    with pytest.raises(sqlite3.OperationalError):
+        test_pool.acquire()
+
+    timer = threading.Timer(0.02, test_pool.release, args=(held[0],))
+    timer.start()
+    conn = test_pool.acquire()
+    timer.join()
+
+    assert conn is held[0]
+    metrics = test_pool.metrics()
+    assert metrics["waits"] == 2
+    assert metrics["timeouts"] == 1
+    assert metrics["in_use"] == 2
+
+def test_pool_discards_broken_connections(test_pool):
+    """
+    Test case for the health check on checkout.
+    This test verifies that a connection which fails the health check is replaced by a new one.
+    """
+    broken = test_pool.acquire()
+    test_pool.release(broken)
+    broken.close()
+
+    conn = test_pool.acquire()
+    assert conn is not broken
+    assert conn.execute("SELECT 1;").fetchone()[0] == 1
+    assert test_pool.metrics()["health_check_failures"] == 1
+
+def test_pool_rolls_back_on_release(test_pool):
+    """
+    Test case for releasing a connection with an open transaction.
+    This test verifies that uncommitted changes are rolled back before the connection is reused.
+    """
+    conn = test_pool.acquire()
+    conn.execute("CREATE TABLE Items (id INTEGER PRIMARY KEY);")
+    conn.execute("INSERT INTO Items (id) VALUES (1);")
+    test_pool.release(conn)
+
+    conn = test_pool.acquire()
+    assert conn.execute("SELECT COUNT(*) FROM Items;").fetchone()[0] == 0
+
+def test_pool_async_acquire_serves_waiters_in_order(test_pool):
+    """
+    Test case for acquiring connections from coroutines on an exhausted pool.
+    This test verifies that released connections are handed to waiting coroutines in arrival order and that a wait times out.
+    """
+    async def scenario():
+        held = [await test_pool.acquire_async(), await test_pool.acquire_async()]
+        first = asyncio.ensure_future(test_pool.acquire_async())
+        second = asyncio.ensure_future(test_pool.acquire_async())
+        await asyncio.sleep(0)
+        test_pool.release(held[1])
+        assert await first is held[1]
+        assert not second.done()
+        with pytest.raises(sqlite3.OperationalError):
+            await second
+
+    asyncio.run(scenario())
+    metrics = test_pool.metrics()
+    assert metrics["timeouts"] == 1
+    assert metrics["in_use"] == 2
+
+def test_get_pool_metrics():
+    """
+    Test case for retrieving the connection pool metrics.
+    This test verifies that the endpoint reports the pool size and usage counters.
+    """
+    response = client.get("/metrics/pool")
+    assert response.status_code == 200
+    assert {"size", "open", "idle", "in_use", "checkouts", "waits"} <= response.json().keys()
+
+def test_engine_profile_is_applied():
+    """
+    Test case for the engine profile.
+    This test verifies that the configured pragmas are in effect on a configured connection.
+    """
+    conn = create_memory_connection()
+    apply_engine_profile(conn)
+    profile = get_engine_profile(conn)
+    conn.close()
+
+    assert profile["busy_timeout"] == settings.db_busy_timeout
+    assert profile["cache_size"] == settings.db_cache_size
+    assert profile["synchronous"] == ["OFF", "NORMAL", "FULL", "EXTRA"].index(settings.db_synchronous)
+
+def test_get_engine_profile():
+    """
+    Test case for retrieving the effective engine settings.
+    This test verifies that the endpoint reports the database path and every configured pragma.
+    """
+    conn = create_memory_connection()
+    apply_engine_profile(conn)
+    overrides = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db_connection] = lambda: conn
+    try:
+        response = client.get("/metrics/engine")
+    finally:
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(overrides)
+        conn.close()
+    assert response.status_code == 200
+    assert response.json()["pragmas"].keys() == ENGINE_PRAGMAS.keys()
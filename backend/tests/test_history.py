@@ -0,0 +1,248 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import app
+from app.database import get_db_connection
+from app.migrations import upgrade
+from app.models import to_day_number
+import app.data_logic.history_data_logic as history_crud
+import datetime
+import sqlite3
+
+client = TestClient(app)
+
+def override_get_db_connection():
+    """
+    Override the database connection to use an in-memory SQLite database for testing.
+    This function applies the schema migrations and returns the connection.
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    upgrade(conn)
+    return conn
+
+def day(text: str):
+    """
+    Convert an ISO 8601 date to the day number stored in the database.
+    """
+    return to_day_number(datetime.date.fromisoformat(text))
+
+@pytest.fixture(scope="function")
+def test_db():
+    """
+    Pytest fixture to provide a temporary in-memory database for testing.
+    This fixture sets up the database with two books, two members and three historic allocations before each test, hands it to the routers in place of a pooled connection, and tears it down after each test.
+    """
+    conn = override_get_db_connection()
+    conn.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 5)")
+    conn.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Other Book', 'Author', 1)")
+    conn.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    conn.execute("INSERT INTO Members (name, email, phone) VALUES ('Jane Doe', 'jane@example.com', '0987654321')")
+    conn.executemany(
+        "INSERT INTO History (book_id, member_id, start_date, end_date, returned) VALUES (?, ?, ?, ?, ?)",
+        [(1, 1, day("2024-03-01"), day("2024-03-10"), 1), (2, 2, day("2024-03-05"), day("2024-03-15"), 0), (1, 2, day("2024-04-01"), day("2024-04-10"), 0)],
+    )
+    conn.commit()
+    app.dependency_overrides[get_db_connection] = lambda: conn
+    yield conn
+    app.dependency_overrides.clear()
+    conn.close()
+
+def test_get_history(test_db):
+    """
+    Test case for retrieving the history.
+    This test verifies that the endpoint returns the historic allocations without names by default.
+    """
+    response = client.get("/history/")
+    assert response.status_code == 200
+    assert [allocation["id"] for allocation in response.json()] == [1, 2, 3]
+    assert "book_name" not in response.json()[0]
+
+def test_get_history_filtered(test_db):
+    """
+    Test case for filtering the history.
+    This test verifies that only the historic allocations of the given member that are not returned are listed.
+    """
+    response = client.get("/history/?member_id=2&returned=false")
+    assert response.status_code == 200
+    assert [allocation["id"] for allocation in response.json()] == [2, 3]
+
+def test_get_history_filtered_by_book_name(test_db):
+    """
+    Test case for filtering the history by the beginning of the book name.
+    This test verifies that the prefix matches in any case, combines with the other filters, and that an empty prefix is rejected.
+    """
+    response = client.get("/history/?book_name=test&order=desc")
+    assert response.status_code == 200
+    assert [allocation["id"] for allocation in response.json()] == [3, 1]
+    assert [allocation["id"] for allocation in client.get("/history/?book_name=OTHER&member_id=2").json()] == [2]
+    assert client.get("/history/?book_name=Missing").json() == []
+    assert client.get("/history/?book_name=").status_code == 400
+
+def test_get_history_newest_first(test_db):
+    """
+    Test case for reading the history from the newest loan.
+    This test verifies that order=desc pages from the highest ID down, following the cursor towards older loans, and that an unknown order is rejected.
+    """
+    response = client.get("/history/?order=desc&limit=2")
+    assert response.status_code == 200
+    assert [allocation["id"] for allocation in response.json()] == [3, 2]
+    response = client.get(f"/history/?order=desc&after={response.headers['X-Next-Cursor']}")
+    assert [allocation["id"] for allocation in response.json()] == [1]
+    assert "X-Next-Cursor" not in response.headers
+    assert client.get("/history/?order=newest").status_code == 400
+
+def test_get_history_expanded(test_db):
+    """
+    Test case for retrieving the history with book and member names.
+    This test verifies that the names are joined into each row and paging still works.
+    """
+    response = client.get("/history/?expand=book,member&limit=2")
+    assert response.status_code == 200
+    assert [(allocation["book_name"], allocation["member_name"]) for allocation in response.json()] == [("Test Book", "John Doe"), ("Other Book", "Jane Doe")]
+
+    response = client.get(f"/history/?expand=book&after={response.headers['X-Next-Cursor']}")
+    assert [(allocation["id"], allocation["book_name"]) for allocation in response.json()] == [(3, "Test Book")]
+    assert "member_name" not in response.json()[0]
+
+def test_get_history_expand_deleted_book(test_db):
+    """
+    Test case for expanding a historic allocation of a deleted book.
+    This test verifies that the row is kept with a null book name.
+    """
+    test_db.execute("DELETE FROM Books WHERE id=2")
+    test_db.commit()
+
+    response = client.get("/history/?expand=book")
+    assert response.status_code == 200
+    assert [allocation["book_name"] for allocation in response.json()] == ["Test Book", None, "Test Book"]
+
+def test_get_history_invalid_expand(test_db):
+    """
+    Test case for expanding an unknown entity.
+    This test verifies that the endpoint returns a 400 status code.
+    """
+    response = client.get("/history/?expand=publisher")
+    assert response.status_code == 400
+
+def test_get_history_serialised_rows(test_db):
+    """
+    Test case for the rows serialised by SQLite.
+    This test verifies that every column of a historic allocation is returned with its stored type.
+    """
+    response = client.get("/history/?limit=1")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == [{"id": 1, "book_id": 1, "member_id": 1, "start_date": "2024-03-01", "end_date": "2024-03-10", "returned": 1, "overdue": 0}]
+
+def test_get_history_compressed(test_db):
+    """
+    Test case for compressing a large page.
+    This test verifies that a page above the size threshold is sent gzip-encoded with a weak ETag, while a small page is sent as it is, and that both vary on Accept-Encoding.
+    """
+    test_db.executemany(
+        "INSERT INTO History (book_id, member_id, start_date, end_date, returned) VALUES (1, 1, ?, ?, 1)",
+        [(day("2024-05-01"), day("2024-05-10"))] * 50,
+    )
+    test_db.commit()
+
+    response = client.get("/history/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.headers["etag"].startswith("W/")
+    assert len(response.json()) == 53
+
+    response = client.get("/history/", headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+    response = client.get("/history/?limit=1", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["vary"]
+
+    response = client.get("/history/", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()) == 53
+
+@pytest.fixture(scope="function")
+def archived_db(tmp_path, monkeypatch):
+    """
+    Pytest fixture to provide a database whose oldest returned loan has been moved to a history archive.
+    This fixture opens the database with URI filenames enabled, as pooled connections are, so the archive is attached read-only, and points the application at the archive file.
+    """
+    conn = sqlite3.connect("file::memory:", uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    upgrade(conn)
+    conn.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 5)")
+    conn.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    conn.executemany(
+        "INSERT INTO History (book_id, member_id, start_date, end_date, returned) VALUES (1, 1, ?, ?, ?)",
+        [(day("2020-03-01"), day("2020-03-10"), 1), (day("2020-04-01"), day("2020-04-10"), 0), (day("2024-03-01"), day("2024-03-10"), 1)],
+    )
+    conn.commit()
+    archivePath = tmp_path / "library.archive.sql"
+    assert history_crud.archive_history(conn, archivePath, datetime.date(2023, 1, 1)) == 1
+    monkeypatch.setattr("app.database.ARCHIVE_PATH", archivePath)
+    app.dependency_overrides[get_db_connection] = lambda: conn
+    yield conn
+    app.dependency_overrides.clear()
+    conn.close()
+
+def test_get_history_spans_archive(archived_db):
+    """
+    Test case for retrieving the history after old loans were archived.
+    This test verifies that only the returned loan past the horizon left the History table, and that the endpoint still lists every loan in ID order across both tiers, page by page, in either direction.
+    """
+    assert [row["id"] for row in archived_db.execute("SELECT id FROM main.History ORDER BY id;")] == [2, 3]
+
+    response = client.get("/history/?expand=book&limit=2")
+    assert response.status_code == 200
+    assert [(allocation["id"], allocation["book_name"]) for allocation in response.json()] == [(1, "Test Book"), (2, "Test Book")]
+    response = client.get(f"/history/?after={response.headers['X-Next-Cursor']}")
+    assert [allocation["id"] for allocation in response.json()] == [3]
+
+    response = client.get("/history/?order=desc&limit=2")
+    assert [allocation["id"] for allocation in response.json()] == [3, 2]
+    response = client.get(f"/history/?order=desc&after={response.headers['X-Next-Cursor']}")
+    assert [allocation["id"] for allocation in response.json()] == [1]
+    assert [allocation["id"] for allocation in client.get("/history/?book_name=test").json()] == [1, 2, 3]
+
+def test_get_history_skips_archive_when_filtered_out(archived_db):
+    """
+    Test case for filters that rule out every archived loan.
+    This test verifies that open loans and date ranges after the newest archived loan are answered from the History table alone.
+    """
+    assert [allocation["id"] for allocation in client.get("/history/?returned=false").json()] == [2]
+    assert [allocation["id"] for allocation in client.get("/history/?start_from=2021-01-01").json()] == [3]
+    assert [allocation["id"] for allocation in client.get("/history/?end_to=2020-12-31").json()] == [1, 2]
+
+def test_history_archive_is_read_only(archived_db):
+    """
+    Test case for the archive attached to request connections.
+    This test verifies that the archive cannot be written through it, and that a loan left in both tiers by an interrupted run is listed once.
+    """
+    client.get("/history/")
+    with pytest.raises(sqlite3.OperationalError):
+        archived_db.execute("DELETE FROM archive.History;")
+
+    archived_db.execute("INSERT INTO main.History SELECT * FROM archive.History;")
+    archived_db.commit()
+    assert [allocation["id"] for allocation in client.get("/history/").json()] == [1, 2, 3]
+
+def test_archive_with_text_dates_is_upgraded(test_db, tmp_path):
+    """
+    Test case for archiving into an archive written before dates were stored as day numbers.
+    This test verifies that the archived loans are converted to day numbers and the new loans are added next to them.
+    """
+    archivePath = tmp_path / "library.archive.sql"
+    archive = sqlite3.connect(archivePath)
+    archive.execute("CREATE TABLE History (id INTEGER PRIMARY KEY, book_id INTEGER NOT NULL, member_id INTEGER NOT NULL, start_date TEXT NOT NULL, end_date TEXT NOT NULL, returned BOOLEAN DEFAULT FALSE, overdue BOOLEAN DEFAULT FALSE);")
+    archive.execute("INSERT INTO History VALUES (100, 1, 1, '2020-03-01', '2020-03-10', 1, 0);")
+    archive.commit()
+    archive.close()
+
+    assert history_crud.archive_history(test_db, archivePath, datetime.date(2024, 3, 31)) == 1
+    archive = sqlite3.connect(archivePath)
+    assert archive.execute("SELECT id, start_date, end_date FROM History ORDER BY id;").fetchall() == [(1, day("2024-03-01"), day("2024-03-10")), (100, day("2020-03-01"), day("2020-03-10"))]
+    assert archive.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_history_end_date';").fetchone()[0] == 1
+    archive.close()
@@ -2,6 +2,10 @@ import pytest
 from fastapi.testclient import TestClient
 from app import app
 from app.database import get_db_connection
+from app.cache import book_cache, member_cache
+from app.migrations import upgrade
+from app.models import to_day_number
+import datetime
 import sqlite3
 
 client = TestClient(app)
@@ -9,61 +13,31 @@ client = TestClient(app)
 def override_get_db_connection():
     """
     Override the database connection to use an in-memory SQLite database for testing.
-    This function creates the necessary tables and returns the connection.
+    This function applies the schema migrations and returns the connection.
     """
-    conn = sqlite3.connect(":memory:")
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.executescript("""
-        CREATE TABLE Books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            author TEXT NOT NULL,
-            total_copies INTEGER NOT NULL,
-            allocated_copies INTEGER DEFAULT 0
-        );
-        CREATE TABLE Members (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE,
-            phone TEXT
-        );
-        CREATE TABLE Allocations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            returned BOOLEAN DEFAULT FALSE,
-            overdue BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (book_id) REFERENCES Books(id),
-            FOREIGN KEY (member_id) REFERENCES Members(id)
-        );
-        CREATE TABLE History (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            book_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
-            start_date TEXT NOT NULL,
-            end_date TEXT NOT NULL,
-            returned BOOLEAN DEFAULT FALSE,
-            overdue BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (book_id) REFERENCES Books(id),
-            FOREIGN KEY (member_id) REFERENCES Members(id)
-        );
-    """)
-    conn.commit()
+    upgrade(conn)
     return conn
 
-app.dependency_overrides = {get_db_connection: override_get_db_connection}
+def day(text: str):
+    """
+    Convert an ISO 8601 date to the day number stored in the database.
+    """
+    return to_day_number(datetime.date.fromisoformat(text))
 
 @pytest.fixture(scope="function")
 def test_db():
     """
     Pytest fixture to provide a temporary in-memory database for testing.
-    This fixture sets up the database before each test and tears it down after each test.
+    This fixture sets up the database before each test, hands it to the routers in place of a pooled connection, empties the read caches, and tears it down after each test.
     """
     conn = override_get_db_connection()
+    app.dependency_overrides[get_db_connection] = lambda: conn
+    book_cache.clear()
+    member_cache.clear()
     yield conn
+    app.dependency_overrides.clear()
     conn.close()
 
 def test_get_members(test_db):
@@ -173,4 +147,68 @@ def test_invalid_member_id(test_db):
     This test verifies that the endpoint returns a 400 status code for an invalid member ID.
     """
     response = client.get("/members/abc")
-    assert response.status_code == 400
\ No newline at end of file
+    assert response.status_code == 400
+def test_get_member_with_allocations(test_db):
+    """
+    Test case for retrieving a member with their current allocations.
+    This test verifies that the allocations of the member are embedded with the names of their books.
+    """
+    test_db.execute("INSERT INTO Books (name, author, total_copies, allocated_copies) VALUES ('Test Book', 'Author Name', 5, 1)")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?)", (day("2024-03-01"), day("2024-03-10")))
+    test_db.commit()
+
+    response = client.get("/members/1?include=allocations")
+    assert response.status_code == 200
+    assert response.json()["name"] == "John Doe"
+    assert [allocation["book_name"] for allocation in response.json()["allocations"]] == ["Test Book"]
+
+    response = client.get("/members/1")
+    assert "allocations" not in response.json()
+
+def test_get_members_batch(test_db):
+    """
+    Test case for looking up several members by ID.
+    This test verifies that the found members are keyed by ID and the unknown IDs are reported as missing.
+    """
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    test_db.commit()
+
+    response = client.post("/members/batch", json={"ids": [1, 2]})
+    assert response.status_code == 200
+    assert response.json()["items"]["1"]["name"] == "John Doe"
+    assert response.json()["missing"] == [2]
+
+def test_import_members_duplicate_email(test_db):
+    """
+    Test case for importing members with a duplicate email.
+    This test verifies that only the duplicate row is rejected and the rest of the batch is inserted.
+    """
+    body = "name,email,phone\nJohn Doe,john@example.com,123\nJane Doe,jane@example.com,\nJohnny,john@example.com,456\n"
+    response = client.post("/members/import", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 2
+    assert [error["row"] for error in response.json()["errors"]] == [3]
+    assert test_db.execute("SELECT phone FROM Members WHERE name='Jane Doe'").fetchone()["phone"] is None
+
+def test_suggest_members(test_db):
+    """
+    Test case for suggesting members by name prefix.
+    This test verifies that names starting with the prefix in any case are returned in name order, up to the limit.
+    """
+    test_db.executemany("INSERT INTO Members (name, email, phone) VALUES (?, ?, '1234567890')", [
+        ("john Smith", "smith@example.com"),
+        ("Joanna Doe", "joanna@example.com"),
+        ("John Doe", "john@example.com"),
+        ("Mary Jones", "mary@example.com"),
+    ])
+    test_db.commit()
+
+    response = client.get("/members/suggest?prefix=JO")
+    assert response.status_code == 200
+    assert [member["name"] for member in response.json()] == ["Joanna Doe", "John Doe", "john Smith"]
+    assert response.json()[0] == {"id": 2, "name": "Joanna Doe", "email": "joanna@example.com", "phone": "1234567890"}
+
+    response = client.get("/members/suggest?prefix=john&limit=1")
+    assert [member["name"] for member in response.json()] == ["John Doe"]
+    assert client.get("/members/suggest?prefix=").status_code == 400
@@ -0,0 +1,166 @@
+import pytest
+from app.migrations import MIGRATIONS, get_schema_version, upgrade
+import sqlite3
+
+import app.data_logic.books_data_logic as book_crud
+import app.data_logic.members_data_logic as member_crud
+import app.data_logic.allocations_data_logic as allocation_crud
+import app.data_logic.history_data_logic as history_crud
+from app.cache import book_cache, member_cache
+from app.etags import make_etag
+from app.models import Allocation, to_day_number
+import datetime
+
+TODAY = datetime.date(2024, 3, 10)
+
+# Calls covering every lookup issued by the data_logic modules, with sample arguments.
+# The statements each call runs are traced, and every one must be answered from an index or the primary key rather than a full table scan.
+DATA_LOGIC_CALLS = {
+    "get_book": lambda conn: book_crud.get_book(conn, 1, include_allocations=True),
+    "get_books_by_ids": lambda conn: book_crud.get_books_by_ids(conn, [1, 2]),
+    "get_all_books_by_name": lambda conn: book_crud.get_all_books(conn, name="Test Book"),
+    "get_all_books_by_author": lambda conn: book_crud.get_all_books(conn, author="Author"),
+    "suggest_books": lambda conn: book_crud.suggest_books(conn, "te"),
+    "get_member": lambda conn: member_crud.get_member(conn, 1, include_allocations=True),
+    "get_all_members_by_name": lambda conn: member_crud.get_all_members(conn, name="John Doe"),
+    "get_all_members_by_email": lambda conn: member_crud.get_all_members(conn, email="john@example.com"),
+    "suggest_members": lambda conn: member_crud.suggest_members(conn, "jo"),
+    "get_allocation": lambda conn: allocation_crud.get_allocation(conn, 1),
+    "get_allocations_of_book": lambda conn: allocation_crud.get_allocations_of_book(conn, 1),
+    "get_allocations_of_member": lambda conn: allocation_crud.get_allocations_of_member(conn, 1),
+    "get_allocation_by_book_and_member": lambda conn: allocation_crud.get_allocation_by_book_and_member(conn, 1, 1),
+    "get_all_allocation_by_book": lambda conn: allocation_crud.get_all_allocation(conn, book_id=1),
+    "get_all_allocation_by_member": lambda conn: allocation_crud.get_all_allocation(conn, member_id=1),
+    "add_allocation": lambda conn: allocation_crud.add_allocation(conn, Allocation(id=0, book_id=1, member_id=1, start_date=TODAY, end_date=TODAY)),
+    "delete_allocation": lambda conn: allocation_crud.delete_allocation(conn, 1),
+    "delete_allocations": lambda conn: allocation_crud.delete_allocations(conn, [1, 2]),
+    "get_overdue_allocations": lambda conn: list(allocation_crud.get_overdue_allocations(conn, TODAY)),
+    "mark_overdue_allocations": lambda conn: allocation_crud.mark_overdue_allocations(conn, TODAY),
+    "get_history": lambda conn: history_crud.get_history(conn),
+    "get_history_by_book": lambda conn: history_crud.get_history(conn, book_id=1),
+    "get_history_by_member": lambda conn: history_crud.get_history(conn, member_id=1),
+    "make_etag": lambda conn: make_etag(conn, ("Books", "Allocations"), ""),
+}
+
+def traced_statements(conn: sqlite3.Connection, call):
+    """
+    Run a data_logic call and collect the queries it sent to SQLite.
+    Parameters:
+        conn (sqlite3.Connection): The connection passed to the call.
+        call (callable): A function taking the connection.
+    Returns:
+        statements (list): The distinct SELECT, UPDATE and DELETE statements run, with their parameters bound.
+    """
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call(conn)
+    finally:
+        conn.set_trace_callback(None)
+    return [statement for statement in dict.fromkeys(statements) if statement.split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE")]
+
+@pytest.fixture(scope="function")
+def test_db():
+    """
+    Pytest fixture to provide an empty in-memory database for testing.
+    This fixture opens the database before each test and closes it after each test.
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+def test_upgrade_applies_all_migrations(test_db):
+    """
+    Test case for upgrading an empty database.
+    This test verifies that every migration is applied in order and recorded in the schema_version table.
+    """
+    assert upgrade(test_db) == MIGRATIONS[-1][0]
+    versions = [row["version"] for row in test_db.execute("SELECT version FROM schema_version ORDER BY version;")]
+    assert versions == [migration[0] for migration in MIGRATIONS]
+
+def test_upgrade_is_idempotent(test_db):
+    """
+    Test case for upgrading an up-to-date database.
+    This test verifies that running the upgrade again applies nothing.
+    """
+    upgrade(test_db)
+    upgrade(test_db)
+    assert get_schema_version(test_db) == MIGRATIONS[-1][0]
+    assert test_db.execute("SELECT COUNT(*) FROM schema_version;").fetchone()[0] == len(MIGRATIONS)
+
+def test_upgrade_existing_database(test_db):
+    """
+    Test case for upgrading a database created before migrations existed.
+    This test verifies that the tables are kept with their rows and the indexes are added.
+    """
+    for statement in MIGRATIONS[0][2]:
+        test_db.execute(statement)
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 5);")
+    test_db.commit()
+
+    upgrade(test_db)
+    assert test_db.execute("SELECT COUNT(*) FROM Books;").fetchone()[0] == 1
+    indexes = {row["name"] for row in test_db.execute("SELECT name FROM sqlite_master WHERE type='index';")}
+    assert {"idx_allocations_book_id", "idx_allocations_member_id", "idx_books_name", "idx_members_name"} <= indexes
+
+@pytest.mark.parametrize("call", DATA_LOGIC_CALLS.values(), ids=DATA_LOGIC_CALLS.keys())
+def test_data_logic_queries_use_indexes(test_db, call):
+    """
+    Test case for the query plans of the data_logic queries.
+    This test verifies that EXPLAIN QUERY PLAN reports an index or primary key search and no full table scan for every query the call runs.
+    """
+    upgrade(test_db)
+    test_db.execute("INSERT INTO Books (name, author, total_copies, allocated_copies) VALUES ('Test Book', 'Author', 5, 2);")
+    test_db.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890');")
+    loans = [(to_day_number(datetime.date(2024, 3, 1)), to_day_number(endDate)) for endDate in (datetime.date(2024, 3, 5), datetime.date(2024, 3, 20))]
+    test_db.executemany("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?);", loans)
+    test_db.executemany("INSERT INTO History (book_id, member_id, start_date, end_date) VALUES (1, 1, ?, ?);", loans)
+    test_db.commit()
+    book_cache.clear()
+    member_cache.clear()
+
+    statements = traced_statements(test_db, call)
+    assert statements
+    for statement in statements:
+        plan = [row["detail"] for row in test_db.execute(f"EXPLAIN QUERY PLAN {statement}")]
+        assert plan, statement
+        assert all(detail.startswith("SEARCH") for detail in plan), (statement, plan)
+
+def test_upgrade_indexes_existing_books_for_search(test_db):
+    """
+    Test case for the full-text index of a database with books.
+    This test verifies that books inserted before the index existed can be searched after the upgrade.
+    """
+    for statement in MIGRATIONS[0][2]:
+        test_db.execute(statement)
+    test_db.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 5);")
+    test_db.commit()
+
+    upgrade(test_db)
+    assert test_db.execute("SELECT rowid FROM books_fts WHERE books_fts MATCH 'test*';").fetchone()[0] == 1
+
+def test_upgrade_converts_dates_to_day_numbers(test_db):
+    """
+    Test case for upgrading a database that stores the dates of loans as text.
+    This test verifies that the dates become day numbers, that the indexes, the statistics triggers and the ID counters survive the rebuild, and that IDs of deleted allocations are not reused.
+    """
+    for _, _, statements in MIGRATIONS[:11]:
+        for statement in statements:
+            test_db.execute(statement)
+    test_db.executemany("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, '2024-03-01', ?);", [("2024-03-10",), ("2024-03-20",)])
+    test_db.executemany("INSERT INTO History (book_id, member_id, start_date, end_date) VALUES (1, 1, '2024-03-01', ?);", [("2024-03-10",), ("2024-03-20",)])
+    test_db.execute("DELETE FROM Allocations WHERE id = 2;")
+    test_db.commit()
+
+    upgrade(test_db)
+    assert [tuple(row) for row in test_db.execute("SELECT id, start_date, end_date FROM Allocations;")] == [(1, 19783, 19792)]
+    assert [tuple(row) for row in test_db.execute("SELECT id, start_date, end_date FROM History;")] == [(1, 19783, 19792), (2, 19783, 19802)]
+    assert [tuple(row) for row in test_db.execute("SELECT day, checkouts FROM daily_checkouts;")] == [(19783, 2)]
+    indexes = {row["name"] for row in test_db.execute("SELECT name FROM sqlite_master WHERE type='index';")}
+    assert {"idx_allocations_book_id", "idx_allocations_returned_end_date", "idx_history_end_date", "idx_history_overdue_sweep"} <= indexes
+
+    test_db.execute("INSERT INTO Allocations (book_id, member_id, start_date, end_date) VALUES (1, 1, 19784, 19790);")
+    test_db.execute("INSERT INTO History (book_id, member_id, start_date, end_date) VALUES (1, 1, 19784, 19790);")
+    assert test_db.execute("SELECT MAX(id) FROM Allocations;").fetchone()[0] == 3
+    assert test_db.execute("SELECT checkouts FROM daily_checkouts WHERE day = 19784;").fetchone()[0] == 1
@@ -0,0 +1,113 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import app
+from app.database import get_db_connection
+from app.cache import book_cache, member_cache
+from app.migrations import upgrade, MIGRATIONS
+import sqlite3
+
+client = TestClient(app)
+
+def override_get_db_connection():
+    """
+    Override the database connection to use an in-memory SQLite database for testing.
+    This function applies the schema migrations and returns the connection.
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    upgrade(conn)
+    return conn
+
+@pytest.fixture(scope="function")
+def test_db():
+    """
+    Pytest fixture to provide a temporary in-memory database with three books and two members.
+    This fixture sets up the database before each test, hands it to the routers in place of a pooled connection, empties the read caches, and tears it down after each test.
+    """
+    conn = override_get_db_connection()
+    conn.executemany("INSERT INTO Books (name, author, total_copies) VALUES (?, 'Author', 5)", [("Book A",), ("Book B",), ("Book C",)])
+    conn.executemany("INSERT INTO Members (name, email, phone) VALUES (?, ?, '1234567890')", [("John Doe", "john@example.com"), ("Jane Doe", "jane@example.com")])
+    conn.commit()
+    app.dependency_overrides[get_db_connection] = lambda: conn
+    book_cache.clear()
+    member_cache.clear()
+    yield conn
+    app.dependency_overrides.clear()
+    conn.close()
+
+def checkout(book_id: int, member_id: int, start_date: str = "2024-03-01"):
+    """
+    Check a book out to a member through the API and return the ID of the allocation.
+    """
+    response = client.post("/allocations/batch", json={"allocations": [{"id": 0, "book_id": book_id, "member_id": member_id, "start_date": start_date, "end_date": "2024-03-30"}]})
+    return response.json()[0]["id"]
+
+def test_top_books(test_db):
+    """
+    Test case for the most borrowed books.
+    This test verifies that books are ranked by loans ever made, or by loans not yet returned, and that returns only change the latter.
+    """
+    for book_id, member_id in [(2, 1), (2, 2), (3, 1), (2, 1), (3, 2), (1, 1)]:
+        checkout(book_id, member_id)
+    client.post("/allocations/batch/return", json={"ids": [1, 2, 4]})
+
+    response = client.get("/stats/books/top?limit=2")
+    assert response.status_code == 200
+    assert response.json() == [
+        {"book_id": 2, "name": "Book B", "author": "Author", "loans": 3, "active_loans": 0},
+        {"book_id": 3, "name": "Book C", "author": "Author", "loans": 2, "active_loans": 2},
+    ]
+    response = client.get("/stats/books/top?by=active_loans")
+    assert [(book["book_id"], book["active_loans"]) for book in response.json()] == [(3, 2), (1, 1), (2, 0)]
+    assert client.get("/stats/books/top?by=name").status_code == 400
+
+def test_top_members_and_item_stats(test_db):
+    """
+    Test case for the busiest members and the counters of a single book or member.
+    This test verifies that member counters follow checkouts, that an edit moving a loan to another member moves its count, and that unknown IDs return 404.
+    """
+    checkout(1, 1)
+    allocationId = checkout(2, 1)
+    checkout(3, 2)
+    client.put(f"/allocations/{allocationId}", json={"id": allocationId, "book_id": 2, "member_id": 2, "start_date": "2024-03-01", "end_date": "2024-03-30"})
+
+    response = client.get("/stats/members/top")
+    assert [(member["name"], member["loans"], member["active_loans"]) for member in response.json()] == [("Jane Doe", 2, 2), ("John Doe", 1, 1)]
+    assert client.get("/stats/members/2").json() == {"member_id": 2, "loans": 2, "active_loans": 2}
+    assert client.get("/stats/books/1").json() == {"book_id": 1, "loans": 1, "active_loans": 1}
+    assert client.get("/stats/books/9").status_code == 404
+
+def test_daily_checkouts(test_db):
+    """
+    Test case for the checkouts per day.
+    This test verifies that a window returns the count of each day with checkouts and their total, and that an inverted window is rejected.
+    """
+    for day in ["2024-03-01", "2024-03-01", "2024-03-03", "2024-04-01"]:
+        checkout(1, 1, day)
+
+    response = client.get("/stats/checkouts?start=2024-03-01&end=2024-03-31")
+    assert response.status_code == 200
+    assert response.json() == {
+        "start": "2024-03-01",
+        "end": "2024-03-31",
+        "total": 3,
+        "days": [{"day": "2024-03-01", "checkouts": 2}, {"day": "2024-03-03", "checkouts": 1}],
+    }
+    assert client.get("/stats/checkouts?start=2024-03-31&end=2024-03-01").status_code == 400
+    assert client.get("/stats/checkouts?start=2020-01-01&end=2024-03-01").status_code == 400
+
+def test_stats_backfilled_on_upgrade():
+    """
+    Test case for upgrading a database with loans made before the statistics existed.
+    This test verifies that the counters are computed from the History table by the migration, with the day stored as a day number.
+    """
+    conn = sqlite3.connect(":memory:")
+    for statement in MIGRATIONS[0][2]:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO History (book_id, member_id, start_date, end_date, returned) VALUES (?, ?, '2024-03-01', '2024-03-10', ?)", [(1, 1, 1), (1, 2, 0)])
+    conn.commit()
+
+    upgrade(conn)
+    assert conn.execute("SELECT book_id, loans, active_loans FROM book_stats;").fetchall() == [(1, 2, 1)]
+    assert conn.execute("SELECT day, checkouts FROM daily_checkouts;").fetchall() == [(19783, 2)]
+    conn.close()
@@ -0,0 +1,99 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import app
+from app.migrations import upgrade
+from app.models import to_day_number
+from app.tasks import OverdueSweeper, HistoryArchiver
+from contextlib import contextmanager
+import datetime
+import sqlite3
+
+client = TestClient(app)
+
+def day(text: str):
+    """
+    Convert an ISO 8601 date to the day number stored in the database.
+    """
+    return to_day_number(datetime.date.fromisoformat(text))
+
+@pytest.fixture(scope="function")
+def test_db():
+    """
+    Pytest fixture to provide a temporary in-memory database with loans on either side of the due date.
+    This fixture sets up the database before each test and tears it down after each test.
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    upgrade(conn)
+    loans = [(1, 1, day("2024-03-01"), day("2024-03-05"), 0), (1, 2, day("2024-03-01"), day("2024-03-20"), 0), (2, 1, day("2024-02-01"), day("2024-02-10"), 1)]
+    conn.executemany("INSERT INTO Allocations (book_id, member_id, start_date, end_date, returned) VALUES (?, ?, ?, ?, ?)", loans[:2])
+    conn.executemany("INSERT INTO History (book_id, member_id, start_date, end_date, returned) VALUES (?, ?, ?, ?, ?)", loans)
+    conn.commit()
+    yield conn
+    conn.close()
+
+@pytest.fixture(scope="function")
+def test_sweeper(test_db):
+    """
+    Pytest fixture to provide an overdue sweeper working on the test database.
+    """
+    @contextmanager
+    def connection():
+        yield test_db
+    return OverdueSweeper(connection, interval=0)
+
+def test_sweep_flags_overdue_loans(test_db, test_sweeper):
+    """
+    Test case for a run of the overdue sweeper.
+    This test verifies that only open loans past their end date are flagged, and that the run is recorded.
+    """
+    assert test_sweeper.run_once(datetime.date(2024, 3, 10)) == (1, 1)
+    assert [row["overdue"] for row in test_db.execute("SELECT overdue FROM Allocations ORDER BY id;")] == [1, 0]
+    assert [row["overdue"] for row in test_db.execute("SELECT overdue FROM History ORDER BY id;")] == [1, 0, 0]
+
+    status = test_sweeper.status()
+    assert status["runs"] == 1
+    assert status["last_run"] is not None
+    assert status["rows_touched_total"] == 2
+
+def test_sweep_is_idempotent(test_sweeper):
+    """
+    Test case for repeated runs of the overdue sweeper.
+    This test verifies that loans already flagged are not touched again.
+    """
+    test_sweeper.run_once(datetime.date(2024, 3, 10))
+    assert test_sweeper.run_once(datetime.date(2024, 3, 10)) == (0, 0)
+    assert test_sweeper.status()["rows_touched_total"] == 2
+
+def test_get_overdue_sweeper_status():
+    """
+    Test case for retrieving the status of the overdue sweeper.
+    This test verifies that the endpoint reports the last run and the rows touched.
+    """
+    response = client.get("/metrics/overdue-sweeper")
+    assert response.status_code == 200
+    assert {"interval", "running", "last_run", "rows_touched_total"} <= response.json().keys()
+
+def test_archiver_moves_loans_past_horizon(test_db, tmp_path):
+    """
+    Test case for a run of the history archiver.
+    This test verifies that only returned loans that ended more than the horizon ago are moved to the archive, in batches, and that the run is recorded.
+    """
+    @contextmanager
+    def connection():
+        yield test_db
+    archiver = HistoryArchiver(connection, interval=0, archive_path=tmp_path / "archive.sql", horizon_days=30, batch_size=1)
+    test_db.execute("INSERT INTO History (book_id, member_id, start_date, end_date, returned) VALUES (2, 2, ?, ?, 1)", (day("2024-01-01"), day("2024-01-10")))
+    test_db.commit()
+
+    assert archiver.run_once(datetime.date(2024, 3, 20)) == 2
+    assert [row["id"] for row in test_db.execute("SELECT id FROM History ORDER BY id;")] == [1, 2]
+    archive = sqlite3.connect(tmp_path / "archive.sql")
+    assert [row[0] for row in archive.execute("SELECT id FROM History ORDER BY id;")] == [3, 4]
+    archive.close()
+
+    assert archiver.run_once(datetime.date(2024, 3, 20)) == 0
+    status = archiver.status()
+    assert status["runs"] == 2
+    assert status["archived_total"] == 2
+    assert status["last_cutoff"] == "2024-02-19"
@@ -0,0 +1,129 @@
+import pytest
+from fastapi.testclient import TestClient
+from app import app
+from app.database import pool
+from app.cache import book_cache
+from app.errors import ConflictError
+from app.migrations import upgrade
+from app.models import Allocation
+from app.write_queue import WriteQueue, allocation_write_queue
+import app.data_logic.allocations_data_logic as allocation_crud
+from contextlib import contextmanager
+import concurrent.futures
+import sqlite3
+
+client = TestClient(app)
+
+@pytest.fixture(scope="function")
+def test_db():
+    """
+    Pytest fixture to provide a temporary in-memory database with a book of three copies and a member.
+    This fixture sets up the database before each test and tears it down after each test.
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    upgrade(conn)
+    conn.execute("INSERT INTO Books (name, author, total_copies) VALUES ('Test Book', 'Author', 3)")
+    conn.execute("INSERT INTO Members (name, email, phone) VALUES ('John Doe', 'john@example.com', '1234567890')")
+    conn.commit()
+    yield conn
+    conn.close()
+
+@pytest.fixture(scope="function")
+def test_connection(test_db):
+    """
+    Pytest fixture to provide a connection factory handing out the test database, as the pool does.
+    """
+    @contextmanager
+    def connection():
+        yield test_db
+    return connection
+
+def allocation(book_id: int = 1):
+    """
+    Build an allocation of the given book to the test member.
+    """
+    return Allocation(id=0, book_id=book_id, member_id=1, start_date="2024-03-01", end_date="2024-03-10")
+
+def test_queue_commits_writes_together(test_db, test_connection):
+    """
+    Test case for group commit.
+    This test verifies that writes queued while the writer waits are committed as one batch, and each future gets its own result.
+    """
+    queue = WriteQueue(test_connection, max_batch=10, max_delay=0.2)
+    futures = [queue.submit(allocation_crud.apply_add_allocation, allocation()) for _ in range(3)]
+    assert [future.result(timeout=5) for future in futures] == [1, 1, 1]
+    queue.stop()
+
+    assert test_db.execute("SELECT allocated_copies FROM Books WHERE id=1;").fetchone()[0] == 3
+    assert test_db.execute("SELECT COUNT(*) FROM Allocations;").fetchone()[0] == 3
+    metrics = queue.metrics()
+    assert metrics["batches"] == 1
+    assert metrics["items"] == 3
+    assert metrics["batch_sizes"] == {"<=4": 1}
+    assert metrics["running"] is False
+
+def test_queue_isolates_failing_writes(test_db, test_connection):
+    """
+    Test case for a failing write in a batch.
+    This test verifies that only the failing writes are rolled back and get their own error, while the others are committed.
+    """
+    queue = WriteQueue(test_connection, max_batch=10, max_delay=0.2)
+    futures = [queue.submit(allocation_crud.apply_add_allocation, allocation(book_id)) for book_id in (1, 9, 1, 1, 1)]
+    concurrent.futures.wait(futures, timeout=5)
+    queue.stop()
+
+    assert futures[0].result() == 1
+    with pytest.raises(KeyError):
+        futures[1].result()
+    assert futures[2].result() == 1
+    assert futures[3].result() == 1
+    with pytest.raises(ConflictError):
+        futures[4].result()
+    assert test_db.execute("SELECT COUNT(*) FROM Allocations;").fetchone()[0] == 3
+    assert test_db.execute("SELECT COUNT(*) FROM History;").fetchone()[0] == 3
+    assert queue.metrics()["failed_items"] == 2
+
+def test_queue_respects_max_batch(test_connection):
+    """
+    Test case for the batch size bound.
+    This test verifies that no batch holds more writes than max_batch.
+    """
+    queue = WriteQueue(test_connection, max_batch=2, max_delay=0.2)
+    futures = [queue.submit(allocation_crud.apply_add_allocation, allocation()) for _ in range(3)]
+    concurrent.futures.wait(futures, timeout=5)
+    queue.stop()
+
+    metrics = queue.metrics()
+    assert metrics["largest_batch"] == 2
+    assert metrics["batches"] == 2
+
+def test_routes_use_enabled_queue(test_db, test_connection, monkeypatch):
+    """
+    Test case for checkouts and returns through the write queue.
+    This test verifies that the routes answer as without the queue, including 409 for a book with no copy left, without checking a connection out of the pool, and that the metrics endpoint reports the batches.
+    """
+    def no_pooled_connection():
+        raise AssertionError("A queued write took a pooled connection")
+
+    monkeypatch.setattr(allocation_write_queue, "enabled", True)
+    monkeypatch.setattr(pool, "acquire", no_pooled_connection)
+    monkeypatch.setattr(pool, "acquire_async", no_pooled_connection)
+    monkeypatch.setattr(allocation_write_queue, "_connection", test_connection)
+    book_cache.clear()
+    try:
+        allocation_data = {"id": 0, "book_id": 1, "member_id": 1, "start_date": "2024-03-01", "end_date": "2024-03-10"}
+        for _ in range(3):
+            assert client.post("/allocations/", json=allocation_data).status_code == 200
+        assert test_db.execute("SELECT allocated_copies FROM Books WHERE id=1;").fetchone()[0] == 3
+        assert client.post("/allocations/", json=allocation_data).status_code == 409
+
+        assert client.delete("/allocations/1").status_code == 200
+        assert client.delete("/allocations/1").status_code == 404
+        assert test_db.execute("SELECT allocated_copies FROM Books WHERE id=1;").fetchone()[0] == 2
+
+        metrics = client.get("/metrics/write-queue").json()
+        assert metrics["enabled"] is True
+        assert metrics["items"] >= 6
+    finally:
+        allocation_write_queue.stop()
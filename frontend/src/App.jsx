@@ -15,7 +15,7 @@
  * @requires ./components/BottomNav
  * @export App
  */
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import { BrowserRouter as Router, Route, Routes, Navigate } from 'react-router-dom';
 import { Container } from '@mui/material';
 import { Books } from './components/Books';
@@ -34,6 +34,13 @@ import './App.css';
  */
 function App() {
     const [searchQuery, setSearchQuery] = useState('');
+    const [debouncedQuery, setDebouncedQuery] = useState('');
+
+    // The pages search on the server, so the query is only handed to them once the user has stopped typing for a moment
+    useEffect(() => {
+        const timeout = setTimeout(() => setDebouncedQuery(searchQuery.trim()), 300);
+        return () => clearTimeout(timeout);
+    }, [searchQuery]);
 
     /**
      * Handles search input changes and updates the search query state.
@@ -52,9 +59,9 @@ function App() {
             <Container className="Container">
                 <Routes>
                     <Route path="/" element={<Navigate to="/books" />} />
-                    <Route path="/books" element={<Books searchQuery={searchQuery} />} />
-                    <Route path="/members" element={<Members searchQuery={searchQuery} />} />
-                    <Route path="/history" element={<History searchQuery={searchQuery} />} />
+                    <Route path="/books" element={<Books searchQuery={debouncedQuery} />} />
+                    <Route path="/members" element={<Members searchQuery={debouncedQuery} />} />
+                    <Route path="/history" element={<History searchQuery={debouncedQuery} />} />
                 </Routes>
             </Container>
         </Router>
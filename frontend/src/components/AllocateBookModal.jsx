@@ -9,7 +9,7 @@
  * @export AllocatebookModal
  */
 import { useState, useEffect } from 'react';
-import { Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField, MenuItem } from '@mui/material';
+import { Dialog, DialogTitle, DialogContent, DialogActions, Button, TextField, Autocomplete } from '@mui/material';
 import PropTypes from 'prop-types';
 
 /**
@@ -24,30 +24,43 @@ import PropTypes from 'prop-types';
  */
 const AllocateBookModal = ({ open, onClose, onAllocate }) => {
   const [members, setMembers] = useState([]);
-  const [memberId, setMemberId] = useState('');
+  const [member, setMember] = useState(null);
+  const [memberQuery, setMemberQuery] = useState('');
   const [fromDate, setFromDate] = useState('');
   const [toDate, setToDate] = useState('');
 
   useEffect(() => {
+    const prefix = memberQuery.trim();
+    if (!prefix) {
+      setMembers([]);
+      return;
+    }
+    // Members are looked up by name prefix as the user types, so the picker never has to load every member
+    let cancelled = false;
     const fetchMembers = async () => {
       try {
-        const response = await fetch('http://localhost:8000/members/');
+        const response = await fetch(`http://localhost:8000/members/suggest?prefix=${encodeURIComponent(prefix)}`);
         if (!response.ok) {
           throw new Error('Network response was not ok');
         }
         const data = await response.json();
-        setMembers(data);
+        if (!cancelled) {
+          setMembers(data);
+        }
       } catch (error) {
         console.error('Error fetching members:', error);
       }
     };
 
     fetchMembers();
-  }, []);
+    return () => {
+      cancelled = true;
+    };
+  }, [memberQuery]);
 
   const handleAllocate = () => {
     const allocation = {
-      member_id: parseInt(memberId, 10),
+      member_id: member ? member.id : NaN,
       start_date: fromDate,
       end_date: toDate,
     };
@@ -59,20 +72,21 @@ const AllocateBookModal = ({ open, onClose, onAllocate }) => {
     <Dialog open={open} onClose={onClose}>
       <DialogTitle>Allocate Book</DialogTitle>
       <DialogContent>
-        <TextField
-          select
-          label="Member"
-          fullWidth
-          margin="normal"
-          value={memberId}
-          onChange={(event) => setMemberId(event.target.value)}
-        >
-          {members.map((member) => (
-            <MenuItem key={member.id} value={member.id}>
-              {member.name}
-            </MenuItem>
-          ))}
-        </TextField>
+        <Autocomplete
+          options={members}
+          value={member}
+          onChange={(event, value) => setMember(value)}
+          onInputChange={(event, value, reason) => {
+            if (reason === 'input') {
+              setMemberQuery(value);
+            }
+          }}
+          getOptionLabel={(option) => (option.email ? `${option.name} (${option.email})` : option.name)}
+          isOptionEqualToValue={(option, value) => option.id === value.id}
+          filterOptions={(options) => options}
+          noOptionsText={memberQuery.trim() ? 'No members found' : 'Type a name'}
+          renderInput={(params) => <TextField {...params} label="Member" fullWidth margin="normal" />}
+        />
         <TextField
           label="From Date"
           type="date"
@@ -38,26 +38,12 @@ const BookDetailsModal = ({ open, onClose, book, setBook }) => {
         if (book) {
         const fetchAllocations = async () => {
             try {
-                const response = await axios.get(`http://localhost:8000/allocations/?book=${book.id.toString()}`);
+                const response = await axios.get(`http://localhost:8000/books/${book.id.toString()}?include=allocations`);
                 if (response.status !== 200) {
                     throw new Error('Network response was not ok');
                 }
-                const data = response.data;
-                // Fetch member details for each allocation
-                const allocationsWithMemberNames = await Promise.all(
-                    data.map(async (allocation) => {
-                    const memberResponse = await axios.get(`http://localhost:8000/members/${allocation.member_id}`);
-                    if (memberResponse.status !== 200) {
-                        throw new Error('Network response was not ok');
-                    }
-                    return {
-                        ...allocation,
-                        member_name: memberResponse.data.name,
-                    };
-                    })
-                );
-
-                setAllocations(allocationsWithMemberNames);
+                // Allocations come with the member names joined in
+                setAllocations(response.data.allocations);
             } catch (error) {
             setError(error.message);
             } finally {
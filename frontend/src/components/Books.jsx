@@ -14,7 +14,7 @@
  * @requires ./AllocateBookModal
  * @export Books
  */
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import PropTypes from 'prop-types';
 import axios from 'axios';
 import { Container, Typography, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, Paper, IconButton, CircularProgress, Button } from '@mui/material';
@@ -40,15 +40,29 @@ const Books = ({ searchQuery }) => {
     const [openAdd, setOpenAdd] = useState(false);
     const [openEdit, setOpenEdit] = useState(false);
     const [openAllocate, setOpenAllocate] = useState(false);
+    const [nextCursor, setNextCursor] = useState(null);
+    const latestRequest = useRef(0);
   
-    const fetchBooks = async () => {
+    // The first page replaces the list; later pages, fetched from the X-Next-Cursor of the previous one, are appended to it
+    // With a search query the pages come from the server's full-text search instead of the list of all books
+    const fetchBooks = async (after = 0) => {
+        const request = ++latestRequest.current;
         try {
-            const response = await fetch('http://localhost:8000/books/');
-            if (!response.ok) {
+            const response = await fetch(searchQuery
+                ? `http://localhost:8000/books/search?q=${encodeURIComponent(searchQuery)}&offset=${after}`
+                : `http://localhost:8000/books/?after=${after}`);
+            // A query without any word, such as punctuation alone, is rejected by the search and matches no book
+            const withoutWords = searchQuery && response.status === 400;
+            if (!response.ok && !withoutWords) {
                 throw new Error('Network response was not ok');
             }
-            const data = await response.json();
-            setBooks(data);
+            const data = withoutWords ? [] : await response.json();
+            // Answers to requests superseded by a newer query or page are dropped
+            if (request !== latestRequest.current) {
+                return;
+            }
+            setBooks((previousBooks) => (after ? [...previousBooks, ...data] : data));
+            setNextCursor(response.headers.get('X-Next-Cursor'));
         } catch (error) {
             setError(error.message);
         } finally {
@@ -58,7 +72,7 @@ const Books = ({ searchQuery }) => {
 
     useEffect(() => {
         fetchBooks();
-    }, []);
+    }, [searchQuery]);
   
     const handleOpenDetails = (book) => {
         setSelectedBook(book);
@@ -190,7 +204,7 @@ const Books = ({ searchQuery }) => {
                         </TableRow>
                     </TableHead>
                     <TableBody>
-                    {books.filter(book => book.name.toLowerCase().includes(searchQuery) ).map((book) => (
+                    {books.map((book) => (
                         <TableRow key={book.id} onClick={() => handleOpenDetails(book)} style={{ cursor: 'pointer' }}>
                             <TableCell>{book.name}</TableCell>
                             <TableCell>{book.author}</TableCell>
@@ -221,6 +235,11 @@ const Books = ({ searchQuery }) => {
                     </TableBody>
                 </Table>
             </TableContainer>  
+            {nextCursor && (
+                <Button variant="outlined" color="primary" style={{ marginTop: '16px' }} onClick={() => fetchBooks(nextCursor)}>
+                    Load More
+                </Button>
+            )}
             <BookDetailsModal open={openDetails} onClose={handleCloseDetails} book={selectedBook} setBook={setSelectedBook} />
             <AddBookModal open={openAdd} onClose={handleCloseAdd} onAdd={handleAddBook} />
             <EditBookModal open={openEdit} onClose={handleCloseEdit} book={selectedBook} onSave={handleEditBook} />
@@ -4,16 +4,14 @@
  * @component
  * @name History
  * @requires react
- * @requires axios
  * @requires prop-types
  * @requires @mui/material
  * @requires @mui/icons-material
  * @export History
  */
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import PropTypes from 'prop-types';
-import axios from 'axios';
-import { Container, Typography, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, Paper, CircularProgress } from '@mui/material';
+import { Container, Typography, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, Paper, CircularProgress, Button } from '@mui/material';
 
 /**
  * History component that displays a history of allocations of books.
@@ -24,43 +22,28 @@ import { Container, Typography, Table, TableBody, TableCell, TableContainer, Tab
  */
 const History = ({ searchQuery }) => {
     const [history, setHistory] = useState([]);
-    const [bookKey, setBookKey] = useState([]);
-    const [memberKey, setMemberKey] = useState([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
+    const latestRequest = useRef(0);
   
-    const fetchHistory = async () => {
+    // Pages are read newest first; later pages, fetched from the X-Next-Cursor of the previous one, are appended with older loans
+    // With a search query only the loans of books whose name starts with it are read, filtered by the server
+    const fetchHistory = async (after = 0) => {
+        const request = ++latestRequest.current;
         try {
-            const response = await fetch('http://localhost:8000/history/');
+            const bookName = searchQuery ? `&book_name=${encodeURIComponent(searchQuery)}` : '';
+            const response = await fetch(`http://localhost:8000/history/?expand=book,member&order=desc${bookName}&after=${after}`);
             if (!response.ok) {
                 throw new Error('Network response was not ok');
             }
             const data = await response.json();
-            setHistory(data.reverse());
-            
-            const bookPromises = {};
-            const memberPromises = {};
-                
-            data.forEach(allocation => {
-                if (!bookPromises[allocation.book_id]) {
-                    bookPromises[allocation.book_id] = axios.get(`http://localhost:8000/books/${allocation.book_id}`);
-                }
-                if (!memberPromises[allocation.member_id]) {
-                    memberPromises[allocation.member_id] = axios.get(`http://localhost:8000/members/${allocation.member_id}`);
-                }
-            });
-            
-            const bookResults = await Promise.all(Object.values(bookPromises));
-            const memberResults = await Promise.all(Object.values(memberPromises));
-            
-            const booksData = {};
-            const membersData = {};
-            
-            bookResults.forEach(res => booksData[res.data.id] = res.data.name);
-            memberResults.forEach(res => membersData[res.data.id] = res.data.name);
-            
-            setBookKey(booksData);
-            setMemberKey(membersData);
+            // Answers to requests superseded by a newer query or page are dropped
+            if (request !== latestRequest.current) {
+                return;
+            }
+            setHistory((previousHistory) => (after ? [...previousHistory, ...data] : data));
+            setNextCursor(response.headers.get('X-Next-Cursor'));
         } catch (error) {
             setError(error.message);
         } finally {
@@ -70,7 +53,7 @@ const History = ({ searchQuery }) => {
 
     useEffect(() => {
         fetchHistory();
-    }, []);
+    }, [searchQuery]);
   
     if (loading) {
       return <CircularProgress />;
@@ -98,10 +81,10 @@ const History = ({ searchQuery }) => {
                         </TableRow>
                     </TableHead>
                     <TableBody>
-                        {history.filter(allocation => bookKey[allocation.book_id]?.toLowerCase().includes(searchQuery)).map((allocation) => (
+                        {history.map((allocation) => (
                             <TableRow key={allocation.id}>
-                                <TableCell>{bookKey[allocation.book_id] || 'Loading...'}</TableCell>
-                                <TableCell>{memberKey[allocation.member_id] || 'Loading...'}</TableCell>
+                                <TableCell>{allocation.book_name}</TableCell>
+                                <TableCell>{allocation.member_name}</TableCell>
                                 <TableCell>{allocation.start_date}</TableCell>
                                 <TableCell>{allocation.end_date}</TableCell>
                                 <TableCell>{allocation.returned ? 'Yes' : 'No'}</TableCell>
@@ -111,6 +94,11 @@ const History = ({ searchQuery }) => {
                     </TableBody>
                 </Table>
             </TableContainer>  
+            {nextCursor && (
+                <Button variant="outlined" color="primary" style={{ marginTop: '16px' }} onClick={() => fetchHistory(nextCursor)}>
+                    Load More
+                </Button>
+            )}
         </Container>
     );
 };
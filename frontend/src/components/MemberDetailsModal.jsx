@@ -37,27 +37,12 @@ const MemberDetailsModal = ({ open, onClose, member }) => {
         if (member) {
         const fetchAllocations = async () => {
             try {
-            const response = await axios.get(`http://localhost:8000/allocations/?member=${member.id.toString()}`);
+            const response = await axios.get(`http://localhost:8000/members/${member.id.toString()}?include=allocations`);
             if (response.status !== 200) {
                 throw new Error('Network response was not ok');
             }
-            const data = response.data;
-
-            // Fetch book details for each allocation
-            const allocationsWithBookNames = await Promise.all(
-                data.map(async (allocation) => {
-                const bookResponse = await axios.get(`http://localhost:8000/books/${allocation.book_id}`);
-                if (bookResponse.status !== 200) {
-                    throw new Error('Network response was not ok');
-                }
-                return {
-                    ...allocation,
-                    book_name: bookResponse.data.name,
-                };
-                })
-            );
-
-            setAllocations(allocationsWithBookNames);
+            // Allocations come with the book names joined in
+            setAllocations(response.data.allocations);
             } catch (error) {
             setError(error.message);
             } finally {
@@ -13,7 +13,7 @@
  * @requires ./EditMemberModal
  * @export Members
  */
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import PropTypes from 'prop-types';
 import axios from 'axios';
 import { Container, Typography, Table, TableBody, TableCell, TableContainer, TableHead, TableRow, Paper, IconButton, CircularProgress, Button } from '@mui/material';
@@ -37,15 +37,26 @@ const Members = ({ searchQuery }) => {
     const [openDetails, setOpenDetails] = useState(false);
     const [openAdd, setOpenAdd] = useState(false);
     const [openEdit, setOpenEdit] = useState(false);
+    const [nextCursor, setNextCursor] = useState(null);
+    const latestRequest = useRef(0);
   
-    const fetchMembers = async () => {
+    // The first page replaces the list; later pages, fetched from the X-Next-Cursor of the previous one, are appended to it
+    // With a search query the members whose name starts with it are looked up on the server instead, as a single list without further pages
+    const fetchMembers = async (after = 0) => {
+        const request = ++latestRequest.current;
         try {
-            const response = await axios.get('http://localhost:8000/members/');
+            const response = searchQuery
+                ? await axios.get('http://localhost:8000/members/suggest', { params: { prefix: searchQuery, limit: 50 } })
+                : await axios.get('http://localhost:8000/members/', { params: { after } });
             if (response.status != 200) {
                 throw new Error('Network response was not ok');
             }
-            const { data } = await axios.get('http://localhost:8000/members/');
-            setMembers(data);
+            // Answers to requests superseded by a newer query or page are dropped
+            if (request !== latestRequest.current) {
+                return;
+            }
+            setMembers((previousMembers) => (after ? [...previousMembers, ...response.data] : response.data));
+            setNextCursor(response.headers['x-next-cursor'] ?? null);
         } catch (error) {
             setError(error.message);
         } finally {
@@ -55,7 +66,7 @@ const Members = ({ searchQuery }) => {
 
     useEffect(() => {
         fetchMembers();
-    }, []);
+    }, [searchQuery]);
   
     const handleOpenDetails = (member) => {
         setSelectedMember(member);
@@ -157,7 +168,7 @@ const Members = ({ searchQuery }) => {
                     </TableRow>
                     </TableHead>
                     <TableBody>
-                        {members.filter(member => member.name.toLowerCase().includes(searchQuery)).map((member) => (
+                        {members.map((member) => (
                             <TableRow key={member.id} onClick={() => handleOpenDetails(member)} style={{ cursor: 'pointer' }}>
                                 <TableCell>{member.name}</TableCell>
                                 <TableCell>{member.email}</TableCell>
@@ -181,6 +192,11 @@ const Members = ({ searchQuery }) => {
                     </TableBody>
                 </Table>
             </TableContainer>
+            {nextCursor && (
+                <Button variant="outlined" color="primary" style={{ marginTop: '16px' }} onClick={() => fetchMembers(nextCursor)}>
+                    Load More
+                </Button>
+            )}
     
             <MemberDetailsModal open={openDetails} onClose={handleCloseDetails} member={selectedMember} />
             <AddMemberModal open={openAdd} onClose={handleCloseAdd} onAdd={handleAddMember} />